@@ -1,10 +1,16 @@
 import logging
-import pandas as pd
+from functools import lru_cache
+
 import lightgbm as lgb
-import optuna
 
-# Import roc_auc_score instead of auc
-from sklearn.metrics import roc_auc_score
+from relbench_utils.datasets import create_binary_dataset
+from relbench_utils.features import load_features
+from relbench_utils.scoring import Scorer
+from relbench_utils.tuning import (
+    LightGBMPruningCallback,
+    create_pruner,
+    optimize_parallel,
+)
 
 # optuna_hm-churn.py >> opt-hm-churn.log 2>&1 &
 
@@ -23,59 +29,31 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 ###############################################################################
-# 2. Load and preprocess data
+# 2. Objective function (Optuna), run in the tuning worker processes
 # ##############################################################################
+@lru_cache(maxsize=None)
+def load_tuning_datasets():
+    """
+    Load the binary train and validation datasets the main process created, once
+    per worker.
+    """
+    train_data = lgb.Dataset("az_item_churn_train.bin", free_raw_data=False)
+    val_data = lgb.Dataset(
+        "az_item_churn_val.bin", reference=train_data, free_raw_data=False
+    )
+    return train_data, val_data
 
-train_df = pd.read_parquet(f"train_transform")
-val_df = pd.read_parquet(f"val_transform")
-test_df = pd.read_parquet(f"test_transform")
-
-X_train = train_df.drop(columns=["churn"])
-y_train = train_df["churn"]
-
-X_val = val_df.drop(columns=["churn"])
-y_val = val_df["churn"]
-
-X_test = test_df.drop(columns=["churn"])
-y_test = test_df["churn"]
-
-
-def convert_object_columns(df):
-    for col in df.select_dtypes(include=["object"]).columns:
-        try:
-            df[col] = df[col].astype(int)
-        except (ValueError, TypeError):
-            df[col] = df[col].astype("category")
-    return df
-
-X_train = convert_object_columns(X_train)
-X_val   = convert_object_columns(X_val)
-X_test  = convert_object_columns(X_test)
 
-categorical_cols = X_train.select_dtypes(include=["category"]).columns.tolist()
+def objective(trial, num_threads):
+    train_data, val_data = load_tuning_datasets()
 
-train_data = lgb.Dataset(
-    X_train, label=y_train,
-    categorical_feature=categorical_cols,
-    free_raw_data=False
-)
-val_data = lgb.Dataset(
-    X_val, label=y_val,
-    categorical_feature=categorical_cols,
-    free_raw_data=False
-)
-
-###############################################################################
-# 3. Objective function (Optuna)
-# ##############################################################################
-def objective(trial):
     params = {
         "objective": "binary",
         "metric": "auc",
         "verbosity": -1,               # Suppress LightGBM's default console spam
         "bagging_freq": 1,
         "feature_pre_filter": False,
-        # "num_threads": 32,
+        "num_threads": num_threads,    # this worker's share of the cores
         "max_depth": trial.suggest_int("max_depth", 3, 11),
         "learning_rate": trial.suggest_float("learning_rate", 1e-3, 0.1, log=True),
         "num_leaves": trial.suggest_int("num_leaves", 2, 1024),
@@ -92,14 +70,14 @@ def objective(trial):
         num_boost_round=2000,
         valid_sets=[val_data],
         callbacks=[
+            LightGBMPruningCallback(trial, "auc"),
             lgb.early_stopping(stopping_rounds=50, verbose=False),
             lgb.log_evaluation(period=0),  # period=0 suppresses iteration logs
         ]
     )
 
-    # Predict on validation set
-    pred_val = model.predict(X_val, num_iteration=model.best_iteration)
-    auc_val = roc_auc_score(y_val, pred_val)
+    # The early stopping already evaluated the AUC on the validation set
+    auc_val = model.best_score["valid_0"]["auc"]
 
     # Log the result for this trial
     logger.info(
@@ -108,64 +86,92 @@ def objective(trial):
 
     return auc_val
 
-###############################################################################
-# 4. Create or load Optuna study using SQLite
-# ##############################################################################
-storage_url = f"sqlite:///opt-az-item-churn.db"
-study_name  = f"opt-az-item-churn"
-
-study = optuna.create_study(
-    study_name=study_name,
-    storage=storage_url,
-    load_if_exists=True,
-    direction="maximize",
-)
-logger.info("Starting Optuna study...")
 
-###############################################################################
-# 5. Run optimization
-# ##############################################################################
-study.optimize(objective, n_trials=50)
+# the tuning workers import this script again, only the main process runs it
+if __name__ == "__main__":
+    ###########################################################################
+    # 3. Load and preprocess data
+    # ##########################################################################
 
-best_params = study.best_params
-best_params["objective"] = "binary"
-best_params["metric"] = "auc"
-best_params["feature_pre_filter"] = False
+    # memory-mapped arrow tables, string columns are encoded with the train categories
+    X_train, y_train, categorical_cols, encodings = load_features(
+        "train_transform", label="churn"
+    )
+    X_val, y_val, _, _ = load_features("val_transform", label="churn", encodings=encodings)
+    X_test, y_test, _, _ = load_features(
+        "test_transform", label="churn", encodings=encodings
+    )
 
-logger.info(f"Best trial found: {study.best_trial.number}")
-logger.info(f"Best params: {best_params}")
+    # binary dataset files are reused as long as the transformed features don't change
+    train_data = create_binary_dataset(
+        X_train, y_train, categorical_cols,
+        "az_item_churn_train.bin",
+        source="train_transform",
+        encodings=encodings,
+    )
+    val_data = create_binary_dataset(
+        X_val, y_val, categorical_cols,
+        "az_item_churn_val.bin",
+        reference=train_data,
+        source="val_transform",
+        encodings=encodings,
+    )
 
-###############################################################################
-# 6. Final model training with best parameters
-# ##############################################################################
-final_model = lgb.train(
-    best_params,
-    train_data,
-    num_boost_round=2000,
-    valid_sets=[val_data],
-    callbacks=[
-        lgb.early_stopping(stopping_rounds=50, verbose=False),
-        lgb.log_evaluation(period=0),  # No iteration logs, only final result
-    ]
-)
+    # predictions are batched over a thread pool and memoized per model and split
+    scorer = Scorer(
+        {"train": (X_train, y_train), "val": (X_val, y_val), "test": (X_test, y_test)}
+    )
 
-pred_test = final_model.predict(X_test, num_iteration=final_model.best_iteration)
-test_auc = roc_auc_score(y_test, pred_test)
-logger.info(f"Final model Test AUC: {test_auc:.6f}")
+    ###########################################################################
+    # 4. Create or load Optuna study using a journal file shared by all workers
+    # ##########################################################################
+    study_name  = f"opt-az-item-churn"
+    storage_path = f"opt-az-item-churn.journal"
+
+    # number of worker processes, each one gets an equal share of the cores
+    n_workers = 4
+
+    ###########################################################################
+    # 5. Run optimization
+    # ##########################################################################
+    study = optimize_parallel(
+        objective,
+        study_name=study_name,
+        direction="maximize",
+        n_trials=50,
+        n_workers=n_workers,
+        storage_path=storage_path,
+        pruner=create_pruner("median"),
+    )
 
-pred_train = final_model.predict(X_train, num_iteration=final_model.best_iteration)
-train_auc = roc_auc_score(y_train, pred_train)
-logger.info(f"Final model Train AUC: {train_auc:.6f}")
+    best_params = study.best_params
+    best_params["objective"] = "binary"
+    best_params["metric"] = "auc"
+    best_params["feature_pre_filter"] = False
 
-pred_val = final_model.predict(X_val, num_iteration=final_model.best_iteration)
-val_auc = roc_auc_score(y_val, pred_val)
-logger.info(f"Final model Val AUC: {val_auc:.6f}")
+    logger.info(f"Best trial found: {study.best_trial.number}")
+    logger.info(f"Best params: {best_params}")
 
-pred_test = final_model.predict(X_test, num_iteration=final_model.best_iteration)
-test_auc = roc_auc_score(y_test, pred_test)
-logger.info(f"Final model Test AUC: {test_auc:.6f}")
+    ###########################################################################
+    # 6. Final model training with best parameters
+    # ##########################################################################
+    final_model = lgb.train(
+        best_params,
+        train_data,
+        num_boost_round=2000,
+        valid_sets=[val_data],
+        callbacks=[
+            lgb.early_stopping(stopping_rounds=50, verbose=False),
+            lgb.log_evaluation(period=0),  # No iteration logs, only final result
+        ]
+    )
 
-###############################################################################
-# 7. Script end
-# ##############################################################################
-logger.info("Study completed.")
+    final_auc = scorer.scores(final_model, "auc")
+    logger.info(f"Final model Train AUC: {final_auc['train']:.6f}")
+    logger.info(f"Final model Val AUC: {final_auc['val']:.6f}")
+    logger.info(f"Final model Test AUC: {final_auc['test']:.6f}")
+
+    ###########################################################################
+    # 7. Script end
+    # ##########################################################################
+    logger.info("Study completed.")
@@ -0,0 +1,110 @@
+"""
+Run the benchmarks and compare them with a baseline, e.g.:
+
+    python -m benchmarks --suite lightgbm --output results.json \
+        --baseline benchmarks/baseline.json
+
+Exits with status 1 if a stage regressed beyond the thresholds. The committed
+baseline covers the lightgbm suite on the default synthetic features, measured on
+a single core; regenerate it with `--update-baseline` on the machine the
+benchmarks are compared on. Stages missing from the baseline, like those of the
+ctu suite, are skipped.
+"""
+
+import argparse
+import logging
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.harness import DEFAULT_THRESHOLDS, Recorder, compare, read_results
+
+logger = logging.getLogger(__name__)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "--suite", choices=["ctu", "lightgbm"], nargs="+", default=["lightgbm"]
+    )
+    parser.add_argument(
+        "--datasets", nargs="+", help="CTU datasets, all paper datasets by default"
+    )
+    parser.add_argument("--backend", choices=["pandas", "arrow"], default="pandas")
+    parser.add_argument(
+        "--cold",
+        action="store_true",
+        help="also measure downloading the CTU datasets from the database",
+    )
+    parser.add_argument(
+        "--features", help="feature file, a synthetic one is generated by default"
+    )
+    parser.add_argument("--label", default="label")
+    parser.add_argument("--drop-cols", nargs="*", default=[])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--num-threads", type=int)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline")
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="store the results as the new baseline instead of comparing",
+    )
+    for metric, threshold in DEFAULT_THRESHOLDS.items():
+        parser.add_argument(
+            f"--{metric.replace('_', '-')}-threshold", type=float, default=threshold
+        )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(message)s")
+
+    recorder = Recorder()
+
+    if "ctu" in args.suite:
+        from benchmarks import ctu_loading
+        from ctu.utils.notebook_stubs import PAPER_DATASETS
+
+        ctu_loading.run(
+            recorder, args.datasets or PAPER_DATASETS, args.backend, args.cold
+        )
+
+    if "lightgbm" in args.suite:
+        from benchmarks import lightgbm_training
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            features = args.features
+            if features is None:
+                features = lightgbm_training.synthetic_features(
+                    Path(tmp_dir) / f"synthetic_{args.rows}.parquet",
+                    n_rows=args.rows,
+                    label=args.label,
+                )
+            lightgbm_training.run(
+                recorder, features, args.label, args.drop_cols, args.num_threads
+            )
+
+    recorder.write(args.output)
+    logger.info(f"Results written to {args.output!r}.")
+
+    if args.baseline is None:
+        return 0
+    if args.update_baseline:
+        recorder.write(args.baseline)
+        logger.info(f"Baseline {args.baseline!r} updated.")
+        return 0
+
+    regressions = compare(
+        recorder.to_dict(),
+        read_results(args.baseline),
+        {metric: getattr(args, f"{metric}_threshold") for metric in DEFAULT_THRESHOLDS},
+    )
+    for regression in regressions:
+        logger.error(regression)
+    if regressions:
+        return 1
+    logger.info(f"No regressions against {args.baseline!r}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+"""
+Interval in seconds at which the resident set size is sampled during a stage.
+Shorter peaks may be missed.
+"""
+RSS_SAMPLING_INTERVAL = 0.01
+
+"""
+Relative regressions tolerated against the baseline: more wall time, more peak
+memory and less throughput than the baseline times (1 + threshold).
+"""
+DEFAULT_THRESHOLDS = {"seconds": 0.25, "peak_rss": 0.25, "rows_per_second": 0.25}
+
+"""
+Stages faster than this (in seconds) in the baseline are too noisy to be
+compared by their wall time or throughput.
+"""
+MIN_COMPARABLE_SECONDS = 0.1
+
+PACKAGES = ["getml", "pandas", "pyarrow", "numpy", "lightgbm", "optuna"]
+
+
+class Measurement(NamedTuple):
+    suite: str
+    case: str
+    stage: str
+    seconds: float
+    peak_rss: int
+    rss_delta: int
+    rows: Optional[int]
+
+    @property
+    def key(self) -> str:
+        return f"{self.suite}/{self.case}/{self.stage}"
+
+    @property
+    def rows_per_second(self) -> Optional[float]:
+        if self.rows is None or not self.seconds:
+            return None
+        return self.rows / self.seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self._asdict(), "rows_per_second": self.rows_per_second}
+
+    def __str__(self) -> str:
+        throughput = "" if self.rows is None else f", {self.rows_per_second:.0f} rows/s"
+        return (
+            f"{self.key}: {self.seconds:.3f}s, peak RSS "
+            f"{self.peak_rss / 1024**2:.0f} MiB (+{self.rss_delta / 1024**2:.0f} MiB)"
+            f"{throughput}"
+        )
+
+
+def rss() -> int:
+    """
+    Return the current resident set size of the process in bytes. Where `/proc` is
+    not available, the peak resident set size of the process so far is returned.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on linux, bytes on macOS
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class _PeakRSS(threading.Thread):
+    """
+    Samples the resident set size of the process in the background and keeps the
+    maximum.
+    """
+
+    def __init__(self, interval: float = RSS_SAMPLING_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.start_rss = rss()
+        self.peak = self.start_rss
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, rss())
+
+    def stop(self) -> int:
+        self.stopped.set()
+        self.join()
+        self.peak = max(self.peak, rss())
+        return self.peak
+
+
+class Stage:
+    """
+    The measurement of a running stage. Set `rows` to the number of rows the stage
+    processed to report its throughput.
+    """
+
+    def __init__(self):
+        self.rows: Optional[int] = None
+
+
+class Recorder:
+    """
+    Collects the measurements of a benchmark run.
+    """
+
+    def __init__(self):
+        self.measurements: List[Measurement] = []
+
+    @contextmanager
+    def measure(self, suite: str, case: str, stage: str) -> Iterator[Stage]:
+        """
+        Measure the wall time and the peak resident set size of a stage.
+        """
+        current = Stage()
+        sampler = _PeakRSS()
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            yield current
+        finally:
+            seconds = time.perf_counter() - start
+            peak = sampler.stop()
+        measurement = Measurement(
+            suite, case, stage, seconds, peak, peak - sampler.start_rss, current.rows
+        )
+        logger.info(str(measurement))
+        self.measurements.append(measurement)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "environment": environment(),
+            "results": {m.key: m.to_dict() for m in self.measurements},
+        }
+
+    def write(self, path: Union[str, Path]) -> None:
+        Path(path).write_text(json.dumps(self.to_dict(), indent=2) + "\n")
+
+
+def environment() -> Dict[str, Any]:
+    """
+    Describe the machine and the package versions a benchmark ran with.
+    """
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "memory": os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES"),
+        "packages": versions,
+    }
+
+
+def read_results(path: Union[str, Path]) -> Dict[str, Any]:
+    return json.loads(Path(path).read_text())
+
+
+def compare(
+    results: Dict[str, Any],
+    baseline: Dict[str, Any],
+    thresholds: Dict[str, float] = DEFAULT_THRESHOLDS,
+) -> List[str]:
+    """
+    Compare benchmark results with a baseline and describe the regressions beyond
+    `thresholds`. Stages missing from either side are skipped.
+    """
+    regressions = []
+    for key, result in results["results"].items():
+        base = baseline["results"].get(key)
+        if base is None:
+            continue
+        comparable = base["seconds"] >= MIN_COMPARABLE_SECONDS
+        for metric, threshold in thresholds.items():
+            value, base_value = result.get(metric), base.get(metric)
+            if value is None or not base_value:
+                continue
+            if metric != "peak_rss" and not comparable:
+                continue
+            # throughput regresses when it drops, everything else when it grows
+            if metric == "rows_per_second":
+                change = base_value / value - 1 if value else float("inf")
+            else:
+                change = value / base_value - 1
+            if change > threshold:
+                regressions.append(
+                    f"{key}: {metric} regressed by {change:.0%} "
+                    f"({base_value:.4g} -> {value:.4g}, threshold {threshold:.0%})"
+                )
+    return regressions
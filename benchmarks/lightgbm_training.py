@@ -0,0 +1,112 @@
+import logging
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+import lightgbm as lgb
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from benchmarks.harness import Recorder
+from relbench_utils.features import encode_categoricals, read_features, select_columns
+
+logger = logging.getLogger(__name__)
+
+SUITE = "lightgbm"
+
+RANDOM_SEED = 42
+
+"""
+Parameters of the fixed trial, a mid-sized configuration of the search space of
+the tuning scripts.
+"""
+TRIAL_PARAMS = {
+    "objective": "binary",
+    "metric": "auc",
+    "verbosity": -1,
+    "bagging_freq": 1,
+    "feature_pre_filter": False,
+    "seed": RANDOM_SEED,
+    "deterministic": True,
+    "max_depth": 7,
+    "learning_rate": 0.05,
+    "num_leaves": 127,
+    "subsample": 0.8,
+    "colsample_bytree": 0.8,
+    "min_data_in_leaf": 20,
+}
+TRIAL_NUM_BOOST_ROUND = 100
+
+
+def synthetic_features(
+    path: Union[str, Path],
+    n_rows: int = 1_000_000,
+    n_numerical: int = 100,
+    n_categorical: int = 5,
+    n_categories: int = 50,
+    label: str = "label",
+) -> Path:
+    """
+    Write a deterministic feature file shaped like the exported getML features:
+    float features, string categoricals and a binary label.
+    """
+    rng = np.random.default_rng(RANDOM_SEED)
+    columns = {f"feature_{i}": rng.standard_normal(n_rows) for i in range(n_numerical)}
+    categories = np.array([f"category_{i}" for i in range(n_categories)])
+    for i in range(n_categorical):
+        columns[f"categorical_{i}"] = pa.array(
+            categories[rng.integers(0, n_categories, n_rows)]
+        ).dictionary_encode()
+    columns[label] = (columns["feature_0"] + rng.standard_normal(n_rows) > 0).astype(
+        np.int8
+    )
+    pq.write_table(pa.table(columns), path)
+    return Path(path)
+
+
+def run(
+    recorder: Recorder,
+    path: Union[str, Path],
+    label: str = "label",
+    drop_cols: Sequence[str] = (),
+    num_threads: Optional[int] = None,
+) -> None:
+    """
+    Benchmark the LightGBM side of the tuning scripts on a feature file: reading it,
+    encoding categoricals and selecting columns, constructing the LightGBM dataset
+    and training with fixed parameters.
+    """
+    case = Path(path).stem
+
+    with recorder.measure(SUITE, case, "read") as stage:
+        table = read_features(path)
+        stage.rows = table.num_rows
+
+    with recorder.measure(SUITE, case, "encode") as stage:
+        y = table.column(label)
+        encoded = encode_categoricals(
+            table.drop_columns(
+                [
+                    name
+                    for name in table.column_names
+                    if name == label or name in drop_cols
+                ]
+            )
+        )
+        X = select_columns(encoded.X)
+        stage.rows = X.num_rows
+
+    params = {**TRIAL_PARAMS, "num_threads": num_threads or 0}
+    with recorder.measure(SUITE, case, "dataset") as stage:
+        train = lgb.Dataset(
+            X,
+            label=y.to_numpy(),
+            categorical_feature=encoded.categorical_cols,
+            params=params,
+            free_raw_data=False,
+        ).construct()
+        stage.rows = X.num_rows
+
+    with recorder.measure(SUITE, case, "trial") as stage:
+        lgb.train(params, train, num_boost_round=TRIAL_NUM_BOOST_ROUND)
+        stage.rows = X.num_rows * TRIAL_NUM_BOOST_ROUND
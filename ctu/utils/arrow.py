@@ -0,0 +1,84 @@
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+INTEGER_TYPES = (pa.int8(), pa.int16(), pa.int32(), pa.int64())
+
+"""
+Strings are only dictionary-encoded if the dictionary holds less than this share of
+the values, otherwise the dictionary only adds overhead.
+"""
+MAX_DICTIONARY_SHARE = 0.5
+
+
+def downcast_integers(array: pa.ChunkedArray) -> pa.ChunkedArray:
+    """
+    Cast an integer array to the smallest signed integer type that holds all values.
+    """
+    min_max = pc.min_max(array)
+    low, high = min_max["min"].as_py(), min_max["max"].as_py()
+    if low is None:
+        return array
+    for type_ in INTEGER_TYPES:
+        info = np.iinfo(type_.to_pandas_dtype())
+        if info.min <= low and high <= info.max:
+            return (
+                array.cast(type_) if type_.bit_width < array.type.bit_width else array
+            )
+    return array
+
+
+def downcast_floats(array: pa.ChunkedArray) -> pa.ChunkedArray:
+    """
+    Cast a double array to single precision if no value loses precision.
+    """
+    if not pa.types.is_float64(array.type):
+        return array
+    downcast = array.cast(pa.float32(), safe=False)
+    lossless = pc.or_kleene(
+        pc.equal(downcast.cast(pa.float64()), array), pc.is_nan(array)
+    )
+    if pc.all(lossless).as_py() is False:
+        return array
+    return downcast
+
+
+def encode_strings(array: pa.ChunkedArray) -> pa.ChunkedArray:
+    """
+    Dictionary-encode a string array unless it has too many distinct values.
+    """
+    encoded = pc.dictionary_encode(array.combine_chunks())
+    if len(encoded.dictionary) > MAX_DICTIONARY_SHARE * max(len(encoded), 1):
+        return array
+    return pa.chunked_array([encoded])
+
+
+def compact_table(table: pa.Table) -> pa.Table:
+    """
+    Losslessly shrink a table: downcast numerical columns and dictionary-encode
+    string columns.
+    """
+    columns = []
+    for column in table.columns:
+        if pa.types.is_integer(column.type):
+            column = downcast_integers(column)
+        elif pa.types.is_floating(column.type):
+            column = downcast_floats(column)
+        elif pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            column = encode_strings(column)
+        columns.append(column)
+    return pa.table(columns, names=table.column_names)
+
+
+def frame_to_arrow(df: pd.DataFrame, exclude: Sequence[str] = ()) -> pa.Table:
+    """
+    Convert a pandas data frame to a compacted arrow table, dropping the index and
+    the columns in `exclude`.
+    """
+    columns = [column for column in df.columns if column not in exclude]
+    return compact_table(
+        pa.Table.from_pandas(df, columns=columns, preserve_index=False)
+    )
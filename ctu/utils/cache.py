@@ -0,0 +1,525 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from copy import copy
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+CTU_CACHE_DIR = Path(
+    os.environ.get("CTU_CACHE_DIR", f"{tempfile.gettempdir()}/ctu_cache")
+)
+
+CACHE_FORMAT_VERSION = 1
+
+SESSION_CACHE_MAX_ENTRIES = int(os.environ.get("CTU_SESSION_CACHE_MAX_ENTRIES", 16))
+SESSION_CACHE_MAX_BYTES = int(
+    os.environ.get("CTU_SESSION_CACHE_MAX_BYTES", 8 * 1024**3)
+)
+
+RESPONSE_CACHE_DIR = Path(
+    os.environ.get("CTU_RESPONSE_CACHE_DIR", CTU_CACHE_DIR / "responses")
+)
+RESPONSE_CACHE_TTL = float(os.environ.get("CTU_RESPONSE_CACHE_TTL", 30 * 24 * 3600))
+RESPONSE_CACHE_MAX_BYTES = int(
+    os.environ.get("CTU_RESPONSE_CACHE_MAX_BYTES", 512 * 1024**2)
+)
+
+ROLE_CACHE_DIR = Path(os.environ.get("CTU_ROLE_CACHE_DIR", CTU_CACHE_DIR / "roles"))
+
+"""
+Serve network responses only from the response cache and fail on a miss.
+"""
+OFFLINE = os.environ.get("CTU_OFFLINE", "").lower() in ("1", "true", "yes")
+
+_CURRENT = "CURRENT"
+_MANIFEST = "manifest.json"
+_META = "meta.pkl"
+
+
+def schema_fingerprint(schema: Any, db: Any) -> str:
+    """
+    Fingerprint the schema of a dataset together with the column layout of its tables.
+    """
+    layout = {
+        name: [(str(column), str(dtype)) for column, dtype in table.df.dtypes.items()]
+        for name, table in sorted(db.table_dict.items())
+    }
+    digest = hashlib.sha256()
+    digest.update(pickle.dumps(schema, protocol=4))
+    digest.update(json.dumps(layout, sort_keys=True).encode())
+    digest.update(str(CACHE_FORMAT_VERSION).encode())
+    return digest.hexdigest()[:16]
+
+
+def _write_frame(df: pd.DataFrame, path: Path) -> str:
+    try:
+        table = pa.Table.from_pandas(df)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # mixed-type object columns can't be represented in arrow
+        df.to_pickle(path.with_suffix(".pkl"))
+        return path.with_suffix(".pkl").name
+    # uncompressed feather files can be memory-mapped on load
+    feather.write_feather(table, path.with_suffix(".arrow"), compression="uncompressed")
+    return path.with_suffix(".arrow").name
+
+
+def _read_frame(path: Path) -> pd.DataFrame:
+    if path.suffix == ".pkl":
+        return pd.read_pickle(path)
+    return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+
+
+class DatasetCache:
+    """
+    A persistent, columnar on-disk cache for CTU datasets.
+
+    Every table is stored as an uncompressed Arrow file next to the schema, the
+    task defaults and the split indices. Entries live in
+    `<root>/<dataset>/<fingerprint>`, where the fingerprint is derived from the
+    schema; `<root>/<dataset>/CURRENT` points to the active entry.
+    """
+
+    def __init__(self, root: Path = CTU_CACHE_DIR):
+        self.root = Path(root)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(root={str(self.root)!r})"
+
+    def entry_dir(self, name: str) -> Optional[Path]:
+        current = self.root / name / _CURRENT
+        if not current.exists():
+            return None
+        entry_dir = self.root / name / current.read_text().strip()
+        if not (entry_dir / _MANIFEST).exists():
+            return None
+        return entry_dir
+
+    def load(self, name: str) -> Optional[Tuple[Any, Any, Any]]:
+        """
+        Load schema, defaults and database of a cached dataset. Returns `None` on a
+        cache miss.
+        """
+        meta = self.load_meta(name)
+        if meta is None:
+            return None
+        schema, defaults, db = meta
+        self.load_frames(name, db)
+        return schema, defaults, db
+
+    def load_meta(self, name: str) -> Optional[Tuple[Any, Any, Any]]:
+        """
+        Load schema, defaults and the database of a cached dataset without reading
+        any table data. Returns `None` on a cache miss.
+        """
+        entry_dir = self.entry_dir(name)
+        if entry_dir is None:
+            return None
+
+        manifest = json.loads((entry_dir / _MANIFEST).read_text())
+        if manifest["format_version"] != CACHE_FORMAT_VERSION:
+            return None
+
+        with open(entry_dir / _META, "rb") as f:
+            meta = pickle.load(f)
+
+        return meta["schema"], meta["defaults"], meta["db"]
+
+    def load_frames(
+        self, name: str, db: Any, tables: Optional[Iterable[str]] = None
+    ) -> None:
+        """
+        Read the frames of `tables` (all tables by default) into `db`; tables that
+        aren't read are dropped from `db`.
+        """
+        entry_dir = self.entry_dir(name)
+        manifest = json.loads((entry_dir / _MANIFEST).read_text())
+        tables = manifest["tables"] if tables is None else set(tables)
+        db.table_dict = {
+            table_name: table
+            for table_name, table in db.table_dict.items()
+            if table_name in tables
+        }
+        for table_name, table in db.table_dict.items():
+            table.df = _read_frame(
+                entry_dir / "tables" / manifest["tables"][table_name]
+            )
+
+    def store(self, name: str, schema: Any, defaults: Any, db: Any) -> Path:
+        """
+        Store a dataset and make it the current entry for `name`.
+        """
+        fingerprint = schema_fingerprint(schema, db)
+        dataset_dir = self.root / name
+        dataset_dir.mkdir(parents=True, exist_ok=True)
+        entry_dir = dataset_dir / fingerprint
+
+        if not (entry_dir / _MANIFEST).exists():
+            tmp_dir = Path(tempfile.mkdtemp(dir=dataset_dir, prefix=".tmp-"))
+            try:
+                (tmp_dir / "tables").mkdir()
+                tables = {
+                    table_name: _write_frame(table.df, tmp_dir / "tables" / f"{i:03d}")
+                    for i, (table_name, table) in enumerate(
+                        sorted(db.table_dict.items())
+                    )
+                }
+
+                # frames are stored separately, only pickle the table metadata
+                stripped_db = copy(db)
+                stripped_db.table_dict = {}
+                for table_name, table in db.table_dict.items():
+                    stripped_db.table_dict[table_name] = copy(table)
+                    stripped_db.table_dict[table_name].df = None
+                with open(tmp_dir / _META, "wb") as f:
+                    pickle.dump(
+                        {"schema": schema, "defaults": defaults, "db": stripped_db}, f
+                    )
+
+                manifest = {
+                    "format_version": CACHE_FORMAT_VERSION,
+                    "dataset": name,
+                    "fingerprint": fingerprint,
+                    "target_table": defaults.target_table,
+                    "target_column": defaults.target_column,
+                    "task": str(defaults.task),
+                    "tables": tables,
+                }
+                (tmp_dir / _MANIFEST).write_text(json.dumps(manifest, indent=2))
+
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.replace(tmp_dir, entry_dir)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        _atomic_write_text(dataset_dir / _CURRENT, fingerprint)
+        return entry_dir
+
+    def load_split(
+        self, name: str, share_val: float, share_test: float, method: str
+    ) -> Optional[pd.DataFrame]:
+        entry_dir = self.entry_dir(name)
+        if entry_dir is None:
+            return None
+        path = entry_dir / "splits" / _split_file_name(share_val, share_test, method)
+        if not path.exists():
+            return None
+        return _read_frame(path)
+
+    def store_split(
+        self,
+        name: str,
+        share_val: float,
+        share_test: float,
+        split: pd.DataFrame,
+        method: str,
+    ) -> None:
+        entry_dir = self.entry_dir(name)
+        if entry_dir is None:
+            return
+        split_dir = entry_dir / "splits"
+        split_dir.mkdir(exist_ok=True)
+        tmp_path = split_dir / f".tmp-{os.getpid()}"
+        feather.write_feather(
+            pa.Table.from_pandas(split), tmp_path, compression="uncompressed"
+        )
+        os.replace(
+            tmp_path, split_dir / _split_file_name(share_val, share_test, method)
+        )
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """
+        Remove the cached entries of a dataset, or of all datasets if `name` is `None`.
+        """
+        shutil.rmtree(
+            self.root if name is None else self.root / name, ignore_errors=True
+        )
+
+    def info(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Summarize the current cache entries by dataset name.
+        """
+        info = {}
+        if not self.root.exists():
+            return info
+        for dataset_dir in sorted(self.root.iterdir()):
+            entry_dir = self.entry_dir(dataset_dir.name)
+            if entry_dir is None:
+                continue
+            manifest = json.loads((entry_dir / _MANIFEST).read_text())
+            info[dataset_dir.name] = {
+                "fingerprint": manifest["fingerprint"],
+                "path": str(entry_dir),
+                "n_tables": len(manifest["tables"]),
+                "size_bytes": sum(
+                    f.stat().st_size for f in entry_dir.rglob("*") if f.is_file()
+                ),
+            }
+        return info
+
+
+def _split_file_name(share_val: float, share_test: float, method: str) -> str:
+    return f"split-{method}-{share_val!r}-{share_test!r}.arrow"
+
+
+def _atomic_write_text(path: Path, text: str) -> None:
+    tmp_path = path.with_name(f".tmp-{path.name}-{os.getpid()}")
+    tmp_path.write_text(text)
+    os.replace(tmp_path, path)
+
+
+_MISSING = object()
+
+
+class SessionCache:
+    """
+    A process-wide LRU cache for loaded datasets and objects derived from them.
+
+    Keys are tuples whose first element is the dataset name. The least recently used
+    entries are evicted as soon as there are more than `max_entries` entries or their
+    estimated size exceeds `max_bytes`. The most recently inserted entry is always
+    kept, even if it exceeds `max_bytes` on its own. Sizes are re-estimated whenever
+    an entry is accessed, as values like lazy mappings grow after insertion.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SESSION_CACHE_MAX_ENTRIES,
+        max_bytes: int = SESSION_CACHE_MAX_BYTES,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[Hashable, Tuple[Any, int, Callable[[Any], int]]] = (
+            OrderedDict()
+        )
+        self._lock = threading.RLock()
+        self._key_locks: Dict[Hashable, threading.RLock] = {}
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(entries={len(self._entries)}, "
+            f"nbytes={self.nbytes}, max_entries={self.max_entries}, "
+            f"max_bytes={self.max_bytes})"
+        )
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    @property
+    def nbytes(self) -> int:
+        return sum(nbytes for _, nbytes, _ in self._entries.values())
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Return the cached value for `key`, or `default` on a miss.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, _, size = self._entries[key]
+            self._entries[key] = (value, size(value), size)
+            self._entries.move_to_end(key)
+            self._evict()
+            return value
+
+    def put(
+        self, key: Hashable, value: Any, size: Callable[[Any], int] = lambda _: 0
+    ) -> None:
+        """
+        Cache `value` under `key`. `size` estimates its memory footprint in bytes.
+        """
+        with self._lock:
+            self._entries[key] = (value, size(value), size)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def _evict(self) -> None:
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self.nbytes > self.max_bytes
+        ):
+            self._entries.popitem(last=False)
+
+    def get_or_create(
+        self,
+        key: Hashable,
+        create: Callable[[], Any],
+        size: Callable[[Any], int] = lambda _: 0,
+    ) -> Any:
+        """
+        Return the cached value for `key`, creating and caching it on a miss. `size`
+        estimates the memory footprint of the value in bytes.
+
+        Only concurrent calls for the same key wait for each other, values of other
+        keys are created in parallel.
+        """
+        with self._lock:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+            key_lock = self._key_locks.setdefault(key, threading.RLock())
+        with key_lock:
+            try:
+                value = self.get(key, _MISSING)
+                if value is _MISSING:
+                    value = create()
+                    self.put(key, value, size)
+                return value
+            finally:
+                with self._lock:
+                    if self._key_locks.get(key) is key_lock:
+                        del self._key_locks[key]
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """
+        Drop all entries of a dataset, or all entries if `name` is `None`.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if name is None or key[0] == name:
+                    del self._entries[key]
+
+    def info(self) -> Dict[Hashable, int]:
+        """
+        Return the estimated size in bytes by key, least recently used first.
+        """
+        return {key: nbytes for key, (_, nbytes, _) in self._entries.items()}
+
+
+class OfflineCacheMiss(LookupError):
+    """
+    Raised in offline mode if a response is not in the response cache.
+    """
+
+
+def response_key(*parts: Any) -> str:
+    """
+    Derive a cache key from JSON-serializable parts, e.g. a URL or a model name and
+    a prompt.
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    A persistent on-disk cache for network responses (HTTP bodies, LLM completions).
+
+    Every response is stored as `<root>/<key>.bin`. Entries older than `ttl` seconds
+    are refetched; in `offline` mode they are served regardless of their age and a
+    miss raises `OfflineCacheMiss`. The least recently used entries are evicted once
+    the cache exceeds `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        root: Path = RESPONSE_CACHE_DIR,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        offline: bool = OFFLINE,
+    ):
+        self.root = Path(root)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(root={str(self.root)!r}, ttl={self.ttl}, "
+            f"max_bytes={self.max_bytes}, offline={self.offline})"
+        )
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.bin"
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Return the cached response for `key`, `None` on a miss or if the entry has
+        expired (unless offline).
+        """
+        path = self._path(key)
+        try:
+            stat = path.stat()
+            if not self.offline and time.time() - stat.st_mtime > self.ttl:
+                return None
+            value = path.read_bytes()
+            # the modification time is the fetch time, the access time tracks the
+            # last use for the eviction
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            return None
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.root / f".tmp-{key}-{os.getpid()}-{threading.get_ident()}"
+        tmp_path.write_bytes(value)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], bytes]) -> bytes:
+        """
+        Return the cached response for `key`, fetching and caching it on a miss.
+        """
+        value = self.get(key)
+        if value is None:
+            if self.offline:
+                raise OfflineCacheMiss(f"no cached response for {key} in {self.root}")
+            value = fetch()
+            self.put(key, value)
+        return value
+
+    def _stat_entries(self) -> List[Tuple[Path, os.stat_result]]:
+        """
+        Stat all entries, skipping files removed by another process meanwhile.
+        """
+        entries = []
+        for path in self.root.glob("*.bin"):
+            try:
+                entries.append((path, path.stat()))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = sorted(self._stat_entries(), key=lambda entry: entry[1].st_atime)
+            nbytes = sum(stat.st_size for _, stat in entries)
+            for path, stat in entries[:-1]:
+                if nbytes <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                nbytes -= stat.st_size
+
+    def invalidate(self) -> None:
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def info(self) -> Dict[str, Any]:
+        entries = self._stat_entries() if self.root.exists() else []
+        return {
+            "path": str(self.root),
+            "n_entries": len(entries),
+            "size_bytes": sum(stat.st_size for _, stat in entries),
+            "offline": self.offline,
+        }
+
+
+DATASET_CACHE = DatasetCache()
+
+SESSION_CACHE = SessionCache()
+
+RESPONSE_CACHE = ResponseCache()
+
+"""
+Inferred getML roles of sampled tables by their fingerprints (see `infer_roles`).
+Roles are derived from the data and never expire.
+"""
+ROLE_CACHE = ResponseCache(ROLE_CACHE_DIR, ttl=float("inf"), offline=False)
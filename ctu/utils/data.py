@@ -1,16 +1,35 @@
+import hashlib
+import logging
 import os
+import pickle
 import random
 import tempfile
 import warnings
+from collections import defaultdict, deque
 from contextlib import redirect_stdout
 from enum import StrEnum
-from functools import lru_cache
-from typing import Dict, Literal, Tuple, Union, overload
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    overload,
+)
 from unittest.mock import patch
 
 import getml
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 import torch
 import torch_geometric.transforms as T
 from db_transformer import data  # type: ignore # noqa: E402
@@ -21,21 +40,117 @@ from experiments.getml_xgboost import (  # type: ignore # noqa: E402
 )
 from pydantic.alias_generators import to_snake
 
+from ctu.utils.arrow import frame_to_arrow
+from ctu.utils.cache import (
+    DATASET_CACHE,
+    ROLE_CACHE,
+    SESSION_CACHE,
+    ResponseCache,
+    response_key,
+)
+from ctu.utils.extract import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_WORKERS,
+    extract_tables,
+    serve_extracted,
+)
+from ctu.utils.profiling import stage, table_event
+
+logger = logging.getLogger(__name__)
+
 RANDOM_SEED = 42
 
 
 RELDB_IP = "35.195.45.191"
 
+"""
+Database URL template overriding the relational database server, e.g.
+`sqlite:////data/synthetic/{dataset}.sqlite` for databases written by
+`ctu.utils.synthetic`.
+"""
+DATABASE_URL = os.environ.get("CTU_DATABASE_URL")
+
+"""
+Compact pandas frames before they are handed to getML (see `compact_frame`).
+"""
+COMPACT_FRAMES = os.environ.get("CTU_COMPACT_FRAMES", "0").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+"""
+Maximum number of distinct values of a string column turned into a categorical by
+`compact_frame`.
+"""
+COMPACT_MAX_CATEGORIES = 1024
+
+"""
+Default number of rows per sample used to infer the roles of a table when
+sampling (see `infer_roles`), and the number of equally sized row ranges the
+samples are stratified over.
+"""
+ROLE_SAMPLE_SIZE = 10_000
+ROLE_SAMPLE_STRATA = 10
+
 
 class RelDBDataset(data.CTUDataset):
     @classmethod
     def get_url(cls, dataset: data.CTUDatasetName) -> str:
+        if DATABASE_URL is not None:
+            return DATABASE_URL.format(dataset=dataset)
         connector = "mysql+mysqlconnector"
         port = 3306
         if dataset == "tpcd":
             return f"{connector}://guest:relational@{RELDB_IP}:{port}/{dataset}"
         return super().get_url(dataset)
 
+    @classmethod
+    def extract_tables(
+        cls,
+        dataset: data.CTUDatasetName,
+        tables: Union[List[str], None] = None,
+        workers: int = DEFAULT_WORKERS,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> Dict[str, pa.Table]:
+        """
+        Extract the raw tables of a dataset from the relational database server as
+        arrow tables, reading several tables and key ranges at once over a bounded
+        connection pool (see `ctu.utils.extract`).
+        """
+        return extract_tables(cls.get_url(dataset), tables, workers, chunk_size)
+
+    @classmethod
+    def from_cache(
+        cls,
+        name: str,
+        tables: Union[List[str], None] = None,
+        max_depth: Union[int, None] = None,
+    ) -> Union["RelDBDataset", None]:
+        """
+        Restore a dataset from the on-disk cache without touching the remote database.
+        Only the tables selected by `tables` or `max_depth` are read (see
+        `select_tables`). Returns `None` on a cache miss.
+        """
+        meta = DATASET_CACHE.load_meta(name)
+        if meta is None:
+            return None
+        schema, defaults, db = meta
+        DATASET_CACHE.load_frames(
+            name, db, select_tables(schema, defaults.target_table, tables, max_depth)
+        )
+        # bypass __init__, which connects to the remote database
+        dataset = cls.__new__(cls)
+        vars(dataset).update(
+            name=name, schema=schema, defaults=defaults, db=db, is_cached=True
+        )
+        return dataset
+
+
+SplitMethod = Literal["permutation", "hetero_data"]
+
+Backend = Literal["pandas", "arrow"]
+
 
 class TaskType(StrEnum):
     CLASSIFICATION = "classification"
@@ -48,10 +163,353 @@ def load_data_from_reldb_dataset(
     share_val: float = 0.3,
     share_test: float = 0.0,
     as_pandas: bool = False,
+    split_method: SplitMethod = "hetero_data",
+    backend: Backend = "pandas",
+    tables: Union[List[str], None] = None,
+    max_depth: Union[int, None] = None,
 ) -> Union[
-    Tuple[getml.data.DataFrame, Dict[str, getml.data.DataFrame]],
-    Tuple[pd.DataFrame, Dict[str, pd.DataFrame]],
+    Tuple[getml.data.DataFrame, Mapping[str, getml.data.DataFrame]],
+    Tuple[pd.DataFrame, Mapping[str, pd.DataFrame]],
 ]:
+    """
+    Split the population table of `dataset` and return it together with a lazy
+    mapping of the peripheral tables, restricted to `tables` or to the tables within
+    `max_depth` of the population table.
+
+    getML data frames are kept in the session cache, so repeated calls return the
+    same data frames until the dataset is invalidated (see `invalidate_dataset`).
+    """
+    load = partial(
+        _load_data_from_reldb_dataset,
+        dataset,
+        share_val,
+        share_test,
+        as_pandas,
+        split_method,
+        backend,
+        tables,
+        max_depth,
+    )
+    if as_pandas:
+        return load()
+    return SESSION_CACHE.get_or_create(
+        (
+            dataset.name,
+            "getml",
+            share_val,
+            share_test,
+            split_method,
+            backend,
+            _tables_key(tables),
+            max_depth,
+        ),
+        load,
+        size=_nbytes,
+    )
+
+
+def _load_data_from_reldb_dataset(
+    dataset: RelDBDataset,
+    share_val: float,
+    share_test: float,
+    as_pandas: bool,
+    split_method: SplitMethod,
+    backend: Backend,
+    tables: Union[List[str], None],
+    max_depth: Union[int, None],
+) -> Union[
+    Tuple[getml.data.DataFrame, Mapping[str, getml.data.DataFrame]],
+    Tuple[pd.DataFrame, Mapping[str, pd.DataFrame]],
+]:
+    population_name = dataset.defaults.target_table
+
+    with stage("split", dataset=dataset.name, method=split_method) as split_stage:
+        split = DATASET_CACHE.load_split(
+            dataset.name, share_val, share_test, split_method
+        )
+        if split is None:
+            if split_method == "permutation":
+                split = permutation_split(
+                    len(dataset.db.table_dict[population_name].df),
+                    share_val,
+                    share_test,
+                )
+            elif getattr(dataset, "is_cached", False):
+                # the graph can only be built from a dataset backed by the database
+                split = split_population(
+                    build_reldb_dataset(dataset.name, use_cache=False),
+                    share_val,
+                    share_test,
+                )
+            else:
+                split = split_population(dataset, share_val, share_test)
+            if split_method == "hetero_data":
+                _compare_permutation_split(dataset.name, split, share_val, share_test)
+            DATASET_CACHE.store_split(
+                dataset.name, share_val, share_test, split, split_method
+            )
+        split_stage.add(rows=len(split))
+
+    selected = select_tables(dataset.schema, population_name, tables, max_depth)
+    peripheral_names = [
+        name
+        for name in dataset.db.table_dict
+        if name != population_name and name in selected
+    ]
+
+    if as_pandas:
+        with stage("join_split", dataset=dataset.name, table=population_name):
+            population = _drop_filler(dataset, population_name).join(split)
+        table_event("join_split", population_name, population)
+        return population, LazyFrameMapping(
+            {name: partial(_drop_filler, dataset, name) for name in peripheral_names}
+        )
+
+    population_df = dataset.db.table_dict[population_name].df
+
+    if (
+        dataset.defaults.task is data.dataset_defaults.utils.TaskType.CLASSIFICATION
+        and population_df[dataset.defaults.target_column].nunique() > 2
+    ):
+        target_role = getml.data.roles.unused_string
+    else:
+        target_role = getml.data.roles.target
+
+    with stage(
+        "to_getml", dataset=dataset.name, table=population_name, backend=backend
+    ):
+        if backend == "arrow":
+            population_arrow = frame_to_arrow(population_df, exclude=["__filler"])
+            population_arrow = population_arrow.append_column(
+                "split",
+                pa.array(
+                    split["split"].reindex(population_df.index).to_numpy(),
+                    pa.string(),
+                ).dictionary_encode(),
+            )
+            population_getml = arrow_to_getml(
+                population_arrow,
+                name=population_name,
+                roles={target_role: [dataset.defaults.target_column]},
+            )
+        else:
+            with stage("join_split", dataset=dataset.name, table=population_name):
+                population = _drop_filler(dataset, population_name).join(split)
+            population = _compact(
+                dataset,
+                population_name,
+                population,
+                keep=[dataset.defaults.target_column, "split"],
+            )
+            population_getml = getml.data.DataFrame.from_pandas(
+                population,
+                name=population_name,
+                roles={target_role: [dataset.defaults.target_column]},
+            )
+    table_event("to_getml", population_name, population_getml)
+
+    return population_getml, LazyFrameMapping(
+        {
+            to_snake(name): partial(_peripheral_to_getml, dataset, name, backend)
+            for name in sorted(peripheral_names)
+        }
+    )
+
+
+class LazyFrameMapping(Mapping):
+    """
+    A read-only mapping of table names to data frames that materializes every data
+    frame on first access.
+    """
+
+    def __init__(self, loaders: Dict[str, Callable[[], Any]]):
+        self._loaders = loaders
+        self._frames: Dict[str, Any] = {}
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self._frames:
+            self._frames[name] = self._loaders[name]()
+        return self._frames[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._loaders)
+
+    def __len__(self) -> int:
+        return len(self._loaders)
+
+    def __repr__(self) -> str:
+        tables = ", ".join(
+            f"{name}{'' if name in self._frames else ' (lazy)'}"
+            for name in self._loaders
+        )
+        return f"{self.__class__.__name__}({tables})"
+
+    @property
+    def materialized(self) -> List[str]:
+        return list(self._frames)
+
+
+def reachable_tables(schema: Any, target_table: str, max_depth: int) -> List[str]:
+    """
+    Return the tables reachable from `target_table` within `max_depth` foreign key
+    hops in either direction, the tables `bfs` considers in `retrieve_auto_datamodel`.
+    """
+    neighbors = defaultdict(set)
+    for name, table_schema in schema.items():
+        for foreign_key in table_schema.foreign_keys:
+            neighbors[name].add(foreign_key.ref_table)
+            neighbors[foreign_key.ref_table].add(name)
+
+    depths = {target_table: 0}
+    queue = deque([target_table])
+    while queue:
+        name = queue.popleft()
+        if depths[name] >= max_depth:
+            continue
+        for neighbor in sorted(neighbors[name]):
+            if neighbor not in depths:
+                depths[neighbor] = depths[name] + 1
+                queue.append(neighbor)
+
+    return sorted(depths)
+
+
+def select_tables(
+    schema: Any,
+    target_table: str,
+    tables: Union[List[str], None] = None,
+    max_depth: Union[int, None] = None,
+) -> List[str]:
+    """
+    Resolve the tables to load: either an explicit list of `tables` or all tables
+    within `max_depth` of the target table. The target table is always included.
+    """
+    if tables is not None:
+        return sorted({target_table, *tables})
+    if max_depth is not None:
+        return reachable_tables(schema, target_table, max_depth)
+    return sorted(schema)
+
+
+def _drop_filler(dataset: RelDBDataset, name: str) -> pd.DataFrame:
+    return dataset.db.table_dict[name].df.drop("__filler", axis=1, errors="ignore")
+
+
+def key_columns(dataset: RelDBDataset, name: str) -> Set[str]:
+    """
+    Return the primary and foreign key columns of a table, the columns tables are
+    joined on.
+    """
+    table = dataset.db.table_dict[name]
+    keys = {table.pkey_col, *table.fkey_col_to_pkey_table}
+    # original key columns, if the dataset keeps them next to the re-indexed ones
+    for table_name, table_schema in dataset.schema.items():
+        for foreign_key in table_schema.foreign_keys:
+            if table_name == name:
+                keys.update(getattr(foreign_key, "columns", ()))
+            if foreign_key.ref_table == name:
+                keys.update(getattr(foreign_key, "ref_columns", ()))
+    return {key for key in keys if key is not None}
+
+
+def _compact_float(column: pd.Series) -> pd.Series:
+    downcast = column.astype(np.float32)
+    lossless = (downcast.astype(np.float64) == column) | column.isna()
+    return downcast if lossless.all() else column
+
+
+def _compact_object(column: pd.Series) -> pd.Series:
+    values = column.dropna()
+    if not len(values) or not values.map(lambda value: isinstance(value, str)).all():
+        # mixed types are left to getML
+        return column
+    if values.nunique() <= COMPACT_MAX_CATEGORIES:
+        return column.astype("category")
+    return column
+
+
+def compact_frame(df: pd.DataFrame, keep: Sequence[str] = ()) -> pd.DataFrame:
+    """
+    Shrink a data frame without losing information: downcast integers and floats
+    where all values are preserved and turn strings with at most
+    `COMPACT_MAX_CATEGORIES` distinct values into categoricals. Columns in `keep`,
+    e.g. join keys and the target, are left unchanged.
+    """
+    columns = {}
+    for name, column in df.items():
+        if name in keep:
+            columns[name] = column
+        elif pd.api.types.is_integer_dtype(column.dtype) and not isinstance(
+            column.dtype, pd.api.extensions.ExtensionDtype
+        ):
+            columns[name] = pd.to_numeric(column, downcast="integer")
+        elif column.dtype == np.float64:
+            columns[name] = _compact_float(column)
+        elif column.dtype == object or isinstance(column.dtype, pd.StringDtype):
+            columns[name] = _compact_object(column)
+        else:
+            columns[name] = column
+    return pd.DataFrame(columns, index=df.index)
+
+
+def _compact(
+    dataset: RelDBDataset, name: str, df: pd.DataFrame, keep: Sequence[str] = ()
+) -> pd.DataFrame:
+    """
+    Compact a table of a dataset before it is handed to getML, keeping its key
+    columns and `keep` unchanged, and report the memory before and after.
+    """
+    if not COMPACT_FRAMES:
+        return df
+    with stage("compact", dataset=dataset.name, table=name) as compact_stage:
+        before = int(df.memory_usage(index=True, deep=True).sum())
+        df = compact_frame(df, keep=[*key_columns(dataset, name), *keep])
+        after = int(df.memory_usage(index=True, deep=True).sum())
+        compact_stage.add(bytes_before=before, bytes_after=after)
+    logger.info(
+        f"Compacted {name!r}: {before / 1024**2:.1f} MiB -> "
+        f"{after / 1024**2:.1f} MiB ({after / max(before, 1):.0%})"
+    )
+    return df
+
+
+def _peripheral_to_getml(
+    dataset: RelDBDataset, name: str, backend: Backend
+) -> getml.data.DataFrame:
+    with stage("to_getml", dataset=dataset.name, table=name, backend=backend):
+        if backend == "arrow":
+            df = arrow_to_getml(
+                frame_to_arrow(dataset.db.table_dict[name].df, exclude=["__filler"]),
+                name=name,
+            )
+        else:
+            df = getml.data.DataFrame.from_pandas(
+                _compact(dataset, name, _drop_filler(dataset, name)), name=name
+            )
+    table_event("to_getml", name, df)
+    return df
+
+
+def arrow_to_getml(
+    table: pa.Table, name: str, roles: Union[Dict, None] = None
+) -> getml.data.DataFrame:
+    """
+    Hand an arrow table to the getML engine and report the transferred bytes.
+    """
+    logger.info(
+        f"Transferring {name!r} to getML: {table.num_rows} rows, {table.nbytes} bytes"
+    )
+    return getml.data.DataFrame.from_arrow(table, name=name, roles=roles)
+
+
+def split_population(
+    dataset: RelDBDataset, share_val: float = 0.3, share_test: float = 0.0
+) -> pd.DataFrame:
+    """
+    Split the population table into train, validation and test sets by building the
+    hetero graph of the dataset. Returns a data frame with a `split` column indexed
+    by the row index of the population table.
+    """
     np.random.seed(RANDOM_SEED)
     torch.manual_seed(RANDOM_SEED)
     random.seed(RANDOM_SEED)
@@ -64,7 +522,8 @@ def load_data_from_reldb_dataset(
         with open(os.devnull, "w") as devnull:
             with redirect_stdout(devnull), warnings.catch_warnings():
                 warnings.simplefilter("ignore")
-                hetero_data, _ = dataset.build_hetero_data()
+                with stage("build_hetero_data", dataset=dataset.name):
+                    hetero_data, _ = dataset.build_hetero_data()
 
     population_name = dataset.defaults.target_table
 
@@ -76,72 +535,199 @@ def load_data_from_reldb_dataset(
     )(hetero_data)
     population_hetero_data = splitted[population_name]
 
-    train_mask, train_indices = population_hetero_data.train_mask.sort(descending=True)
-    train_indices = train_indices[train_mask]
+    return _masks_to_split(
+        population_hetero_data.train_mask,
+        population_hetero_data.val_mask,
+        population_hetero_data.test_mask,
+    )
 
-    val_mask, val_indices = population_hetero_data.val_mask.sort(descending=True)
-    val_indices = val_indices[val_mask]
 
-    test_mask, test_indices = population_hetero_data.test_mask.sort(descending=True)
-    test_indices = test_indices[test_mask]
+def permutation_split(
+    n_total: int, share_val: float = 0.3, share_test: float = 0.0
+) -> pd.DataFrame:
+    """
+    Split a population table of `n_total` rows into train, validation and test sets
+    without building the hetero graph.
+
+    Draws the seeded permutation `T.RandomNodeSplit` draws for the population table
+    in `split_population`. The splits only agree if building the hetero graph
+    doesn't consume random numbers of torch before the split, which isn't
+    guaranteed; check a dataset with `verify_permutation_split`. The first
+    `hetero_data` split of every dataset is compared as well and the result logged.
+    """
+    np.random.seed(RANDOM_SEED)
+    torch.manual_seed(RANDOM_SEED)
+    random.seed(RANDOM_SEED)
 
-    index = torch.cat([train_indices, val_indices, test_indices], dim=0).numpy()
-    subset = np.array(["train", "val", "test"]).repeat(
-        [len(train_indices), len(val_indices), len(test_indices)]
-    )
+    num_val = int(share_val * n_total)
+    num_test = share_test * n_total
+    # RandomNodeSplit treats float arguments as ratios of the number of nodes
+    if isinstance(num_test, float):
+        num_test = round(n_total * num_test)
 
-    split = pd.DataFrame({"split": subset, "index": index}).set_index("index")
+    perm = torch.randperm(n_total)
 
-    dfs = {
-        name: table.df.drop("__filler", axis=1, errors="ignore")
-        for name, table in dataset.db.table_dict.items()
-    }
+    train_mask = torch.zeros(n_total, dtype=torch.bool)
+    val_mask = torch.zeros(n_total, dtype=torch.bool)
+    test_mask = torch.zeros(n_total, dtype=torch.bool)
+    val_mask[perm[:num_val]] = True
+    test_mask[perm[num_val : num_val + num_test]] = True
+    train_mask[perm[num_val + num_test :]] = True
 
-    population = dfs.pop(population_name).join(split)
-    peripheral = dfs
+    return _masks_to_split(train_mask, val_mask, test_mask)
 
-    if as_pandas:
-        return population, peripheral
 
-    if (
-        dataset.defaults.task is data.dataset_defaults.utils.TaskType.CLASSIFICATION
-        and population[dataset.defaults.target_column].nunique() > 2
-    ):
-        target_role = getml.data.roles.unused_string
+def verify_permutation_split(
+    dataset: RelDBDataset, share_val: float = 0.3, share_test: float = 0.0
+) -> None:
+    """
+    Check that `permutation_split` reproduces the split obtained from the hetero
+    graph of `dataset`. Raises an `AssertionError` if the splits differ.
+    """
+    expected = split_population(dataset, share_val, share_test)
+    n_total = len(dataset.db.table_dict[dataset.defaults.target_table].df)
+    pd.testing.assert_frame_equal(
+        permutation_split(n_total, share_val, share_test), expected
+    )
+
+
+def _compare_permutation_split(
+    name: str, split: pd.DataFrame, share_val: float, share_test: float
+) -> None:
+    try:
+        pd.testing.assert_frame_equal(
+            permutation_split(len(split), share_val, share_test), split
+        )
+    except AssertionError:
+        logger.warning(f"The permutation split of {name!r} differs from its split.")
     else:
-        target_role = getml.data.roles.target
+        logger.info(f"The permutation split of {name!r} matches its split.")
+
 
-    population_getml = getml.data.DataFrame.from_pandas(
-        population,
-        name=population_name,
-        roles={target_role: [dataset.defaults.target_column]},
+def _masks_to_split(
+    train_mask: torch.Tensor, val_mask: torch.Tensor, test_mask: torch.Tensor
+) -> pd.DataFrame:
+    train_mask, train_indices = train_mask.sort(descending=True)
+    train_indices = train_indices[train_mask]
+
+    val_mask, val_indices = val_mask.sort(descending=True)
+    val_indices = val_indices[val_mask]
+
+    test_mask, test_indices = test_mask.sort(descending=True)
+    test_indices = test_indices[test_mask]
+
+    index = torch.cat([train_indices, val_indices, test_indices], dim=0).numpy()
+    subset = np.array(["train", "val", "test"]).repeat(
+        [len(train_indices), len(val_indices), len(test_indices)]
     )
 
-    return population_getml, {
-        to_snake(name): getml.data.DataFrame.from_pandas(
-            peripheral[name],
-            name=name,
-        )
-        for name in sorted(peripheral)
-    }
+    return pd.DataFrame({"split": subset, "index": index}).set_index("index")
 
 
 def build_reldb_dataset(
-    name: str, share_val: float = 0.3, share_test: float = 0.0, as_pandas: bool = False
+    name: str,
+    share_val: float = 0.3,
+    share_test: float = 0.0,
+    as_pandas: bool = False,
+    use_cache: bool = True,
+    tables: Union[List[str], None] = None,
+    max_depth: Union[int, None] = None,
 ) -> RelDBDataset:
+    """
+    Build a dataset from the relational database server. With `use_cache`, the
+    dataset is shared through the session cache and served from the on-disk cache
+    (see `ctu.utils.cache`) if available, otherwise it is stored there after the
+    download. Cached datasets only hold the tables selected by `tables` or
+    `max_depth`.
+    """
     if not share_val:
         raise ValueError("share_val must be greater than 0")
 
-    with patch(
-        "db_transformer.helpers.progress.is_notebook",
-        lambda: getml.utilities.progress._is_jupyter()
-        and not getml.utilities.progress._is_emacs_kernel(),
+    if not use_cache:
+        return _download_reldb_dataset(name)
+
+    return SESSION_CACHE.get_or_create(
+        (name, "dataset", _tables_key(tables), max_depth),
+        partial(_restore_or_download_reldb_dataset, name, tables, max_depth),
+        size=_nbytes,
+    )
+
+
+def _restore_or_download_reldb_dataset(
+    name: str, tables: Union[List[str], None], max_depth: Union[int, None]
+) -> RelDBDataset:
+    with stage("restore", dataset=name):
+        dataset = RelDBDataset.from_cache(name, tables, max_depth)
+    if dataset is None:
+        with stage("download", dataset=name):
+            dataset = _download_reldb_dataset(name)
+        with stage("store", dataset=name):
+            DATASET_CACHE.store(name, dataset.schema, dataset.defaults, dataset.db)
+    for table_name, table in sorted(dataset.db.table_dict.items()):
+        table_event("dataset", table_name, table.df)
+    return dataset
+
+
+def _download_reldb_dataset(name: str) -> RelDBDataset:
+    """
+    Download a dataset. The tables are extracted in parallel first (see
+    `ctu.utils.extract`) and the dataset class reads them from there instead of
+    fetching them one by one; its schema queries still go to the database.
+    """
+    with stage("extract", dataset=name) as extract_stage:
+        tables = RelDBDataset.extract_tables(name)
+        extract_stage.add(rows=sum(table.num_rows for table in tables.values()))
+    with (
+        patch(
+            "db_transformer.helpers.progress.is_notebook",
+            lambda: getml.utilities.progress._is_jupyter()
+            and not getml.utilities.progress._is_emacs_kernel(),
+        ),
+        serve_extracted(tables) as served,
     ):
-        return RelDBDataset(
+        dataset = RelDBDataset(
             name,
             data_dir=f"{tempfile.gettempdir()}/ctu_data",
-            save_db=False,  # serialization is broken
+            save_db=False,  # serialization is broken, we use our own cache instead
+        )
+    if len(served) < len(tables):
+        logger.info(
+            f"Read {len(tables) - len(served)} of {len(tables)} tables of {name!r} "
+            "from the database again."
         )
+    return dataset
+
+
+def invalidate_dataset(name: Union[str, None] = None, on_disk: bool = False) -> None:
+    """
+    Drop a dataset, or all datasets if `name` is `None`, from the session cache. With
+    `on_disk`, the on-disk cache entries are removed as well.
+    """
+    SESSION_CACHE.invalidate(name)
+    if on_disk:
+        DATASET_CACHE.invalidate(name)
+
+
+def _tables_key(tables: Union[List[str], None]) -> Union[Tuple[str, ...], None]:
+    return None if tables is None else tuple(sorted(tables))
+
+
+def _nbytes(value: Any) -> int:
+    """
+    Estimate the memory footprint of a cached value. Python-side sizes are shallow,
+    getML data frames report the size they occupy in the engine.
+    """
+    if isinstance(value, RelDBDataset):
+        return sum(_nbytes(table.df) for table in value.db.table_dict.values())
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, getml.data.DataFrame):
+        return int(value.nbytes())
+    if isinstance(value, LazyFrameMapping):
+        return sum(_nbytes(value[name]) for name in value.materialized)
+    if isinstance(value, tuple):
+        return sum(_nbytes(item) for item in value)
+    return 0
 
 
 @overload
@@ -150,7 +736,11 @@ def load_ctu_dataset(
     share_val: float = 0.3,
     share_test: float = 0.0,
     as_pandas: Literal[False] = False,
-) -> Tuple[getml.data.DataFrame, Dict[str, getml.data.DataFrame]]: ...
+    split_method: SplitMethod = "hetero_data",
+    backend: Backend = "pandas",
+    tables: Union[List[str], None] = None,
+    max_depth: Union[int, None] = None,
+) -> Tuple[getml.data.DataFrame, Mapping[str, getml.data.DataFrame]]: ...
 
 
 @overload
@@ -159,7 +749,11 @@ def load_ctu_dataset(
     share_val: float = 0.3,
     share_test: float = 0.0,
     as_pandas: Literal[True] = True,
-) -> Tuple[pd.DataFrame, Dict[str, pd.DataFrame]]: ...
+    split_method: SplitMethod = "hetero_data",
+    backend: Backend = "pandas",
+    tables: Union[List[str], None] = None,
+    max_depth: Union[int, None] = None,
+) -> Tuple[pd.DataFrame, Mapping[str, pd.DataFrame]]: ...
 
 
 def load_ctu_dataset(
@@ -167,17 +761,43 @@ def load_ctu_dataset(
     share_val: float = 0.3,
     share_test: float = 0.0,
     as_pandas: bool = False,
+    split_method: SplitMethod = "hetero_data",
+    backend: Backend = "pandas",
+    tables: Union[List[str], None] = None,
+    max_depth: Union[int, None] = None,
 ) -> Union[
-    Tuple[getml.data.DataFrame, Dict[str, getml.data.DataFrame]],
-    Tuple[pd.DataFrame, Dict[str, pd.DataFrame]],
+    Tuple[getml.data.DataFrame, Mapping[str, getml.data.DataFrame]],
+    Tuple[pd.DataFrame, Mapping[str, pd.DataFrame]],
 ]:
     """
     Load a CTU dataset as a getML data frame and split it into train, validation, and test sets.
 
-    The split reproduces the original split from the "Transformers meets Relational Databases" paper.
+    The split reproduces the original split from the "Transformers meets Relational Databases" paper
+    by building the hetero graph of the dataset. `split_method="permutation"` draws it
+    from the length of the population table instead, which is much faster but not
+    verified to give the same split (see `permutation_split`).
+
+    With `backend="arrow"`, tables are handed to the getML engine as compacted arrow
+    tables (downcast numerics, dictionary-encoded strings) instead of going through
+    `getml.data.DataFrame.from_pandas`.
+
+    Peripheral tables are returned as a lazy mapping and only converted on first
+    access. Pass an explicit list of `tables` or a `max_depth` to skip tables that
+    aren't reachable from the population table altogether.
     """
-    dataset = build_reldb_dataset(name, share_val, share_test, as_pandas)
-    return load_data_from_reldb_dataset(dataset, share_val, share_test, as_pandas)
+    dataset = build_reldb_dataset(
+        name, share_val, share_test, as_pandas, tables=tables, max_depth=max_depth
+    )
+    return load_data_from_reldb_dataset(
+        dataset,
+        share_val,
+        share_test,
+        as_pandas,
+        split_method,
+        backend,
+        tables=tables,
+        max_depth=max_depth,
+    )
 
 
 def infer_task_type(
@@ -191,21 +811,174 @@ def infer_task_type(
     return TaskType.REGRESSION
 
 
-def retrieve_auto_annotated_data(dataset: RelDBDataset) -> dict[str, getml.data.Roles]:
-    schema = dataset.schema
-    data_df = label_getml_roles(
-        {n: t.df for n, t in dataset.db.table_dict.items()}, schema, dataset.defaults
+def stratified_rows(
+    n_rows: int,
+    size: int,
+    seed: int = RANDOM_SEED,
+    exclude: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Sample the positions of `size` rows spread evenly over `ROLE_SAMPLE_STRATA` row
+    ranges of a table, so that every part of the table (e.g. old and new rows) is
+    represented. Positions in `exclude` are never drawn.
+    """
+    rng = np.random.default_rng(seed)
+    bounds = np.linspace(0, n_rows, ROLE_SAMPLE_STRATA + 1).astype(int)
+    per_stratum = max(size // ROLE_SAMPLE_STRATA, 1)
+    strata = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        candidates = np.arange(start, stop)
+        if exclude is not None:
+            candidates = np.setdiff1d(candidates, exclude, assume_unique=True)
+        strata.append(
+            rng.choice(candidates, min(per_stratum, len(candidates)), replace=False)
+        )
+    return np.sort(np.concatenate(strata))
+
+
+def table_fingerprint(dataset: RelDBDataset, name: str, sample: pd.DataFrame) -> str:
+    """
+    Fingerprint a table for the role cache by its schema, task defaults, shape,
+    dtypes and the values of its sample.
+    """
+    df = dataset.db.table_dict[name].df
+    digest = hashlib.sha256()
+    digest.update(pickle.dumps(dataset.schema[name], protocol=4))
+    digest.update(pickle.dumps(dataset.defaults, protocol=4))
+    digest.update(repr((name, df.shape, list(df.dtypes.astype(str)))).encode())
+    digest.update(
+        pd.util.hash_pandas_object(sample.astype(str), index=True).to_numpy().tobytes()
+    )
+    return digest.hexdigest()
+
+
+def _label_roles(
+    dataset: RelDBDataset, frames: Mapping[str, pd.DataFrame]
+) -> Dict[str, getml.data.Roles]:
+    return label_getml_roles(dict(frames), dataset.schema, dataset.defaults)
+
+
+def infer_roles(
+    dataset: RelDBDataset,
+    sample_size: Optional[int] = None,
+    cache: Optional[ResponseCache] = ROLE_CACHE,
+) -> Dict[str, getml.data.Roles]:
+    """
+    Infer the getML roles of all tables of a dataset in one pass, so that roles
+    depending on other tables (e.g. join keys) see all of them.
+
+    With `sample_size`, tables with more than twice as many rows are represented by
+    stratified samples: the roles are inferred on two disjoint sets of samples and
+    tables whose roles disagree are inferred again on all their rows. The sampled
+    roles are cached on disk by the fingerprints of the tables. Sampled roles are
+    not guaranteed to equal the roles of the full tables, check a dataset with
+    `verify_sampled_roles` before relying on them.
+    """
+    frames = {name: table.df for name, table in sorted(dataset.db.table_dict.items())}
+    if sample_size is None:
+        return _label_roles(dataset, frames)
+
+    first_rows = {
+        name: stratified_rows(len(df), sample_size)
+        for name, df in frames.items()
+        if len(df) > 2 * sample_size
+    }
+    first = {
+        name: df.iloc[first_rows[name]] if name in first_rows else df
+        for name, df in frames.items()
+    }
+
+    def infer() -> bytes:
+        second = {
+            name: (
+                df.iloc[
+                    stratified_rows(
+                        len(df), sample_size, RANDOM_SEED + 1, first_rows[name]
+                    )
+                ]
+                if name in first_rows
+                else df
+            )
+            for name, df in frames.items()
+        }
+        roles = _label_roles(dataset, first)
+        second_roles = _label_roles(dataset, second)
+        ambiguous = [name for name in first_rows if roles[name] != second_roles[name]]
+        if ambiguous:
+            logger.info(
+                f"Roles of {ambiguous} are ambiguous on samples, scanning them."
+            )
+            scanned = _label_roles(
+                dataset, {**first, **{name: frames[name] for name in ambiguous}}
+            )
+            roles.update({name: scanned[name] for name in ambiguous})
+        return pickle.dumps(roles)
+
+    if cache is None:
+        return pickle.loads(infer())
+    key = response_key(
+        sample_size,
+        [table_fingerprint(dataset, name, sample) for name, sample in first.items()],
+    )
+    return pickle.loads(cache.get_or_fetch(key, infer))
+
+
+def verify_sampled_roles(
+    dataset: RelDBDataset, sample_size: int = ROLE_SAMPLE_SIZE
+) -> Dict[str, Tuple[getml.data.Roles, getml.data.Roles]]:
+    """
+    Compare the roles inferred on samples (see `infer_roles`) with those inferred on
+    the full tables. Returns the sampled and the full roles of the tables where they
+    differ, an empty dict if sampling is exact for the dataset.
+    """
+    sampled = infer_roles(dataset, sample_size, cache=None)
+    full = infer_roles(dataset)
+    return {
+        name: (sampled[name], full[name])
+        for name in full
+        if sampled.get(name) != full[name]
+    }
+
+
+def retrieve_auto_annotated_data(
+    dataset: RelDBDataset, sample_size: Optional[int] = None
+) -> dict[str, getml.data.Roles]:
+    """
+    Infer the getML roles of all tables of a dataset from all their rows, or from
+    row samples of large tables with `sample_size` (see `infer_roles`).
+    """
+
+    def annotate() -> dict[str, getml.data.Roles]:
+        with stage("annotate", dataset=dataset.name) as annotate_stage:
+            annotated = infer_roles(dataset, sample_size)
+            annotate_stage.add(tables=len(annotated))
+        return annotated
+
+    return SESSION_CACHE.get_or_create(
+        (dataset.name, "roles", _tables_key(list(dataset.db.table_dict)), sample_size),
+        annotate,
     )
-    return data_df
 
 
 def retrieve_auto_datamodel(dataset_name: str, max_depth: int) -> getml.data.DataModel:
-    dataset = build_reldb_dataset(dataset_name)
+    """
+    Build the data model of the tables within `max_depth` of the population table.
+    Only these tables are restored from the on-disk cache and loaded into the
+    engine; a cold load still downloads the whole dataset, as the dataset class
+    reads all tables of the database (and the on-disk cache stores all of them).
+    """
+    dataset = build_reldb_dataset(dataset_name, max_depth=max_depth)
     schema = dataset.schema
-    population, peripheral = load_data_from_reldb_dataset(dataset)
+    target_table = dataset.defaults.target_table
+    population, peripheral = load_data_from_reldb_dataset(dataset, max_depth=max_depth)
 
-    data_df = {"__target_table": population, population.name: population, **peripheral}
+    nodes, edges = bfs(schema, target_table, max_depth)
 
-    nodes, edges = bfs(schema, dataset.defaults.target_table, max_depth)
+    # the peripheral tables are already restricted to the tables bfs visits
+    data_df = {
+        "__target_table": population,
+        population.name: population,
+        **peripheral,
+    }
 
     return build_getml_datamodel(data_df, nodes, edges)
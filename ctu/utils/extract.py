@@ -0,0 +1,274 @@
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from unittest.mock import patch
+
+import pandas as pd
+import pyarrow as pa
+import sqlalchemy as sa
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_CHUNK_SIZE = 100_000
+
+KeyRange = Tuple[Optional[int], Optional[int]]
+
+"""
+Backends connectorx reads from (it's an optional dependency).
+"""
+_CONNECTORX_BACKENDS = ("mysql", "postgresql", "sqlite", "mssql")
+
+_IDENTIFIER = r"[`\"\[]?(\w+)[`\"\]]?"
+_SELECT_TABLE = re.compile(
+    rf"^\s*SELECT\s+(?P<columns>.+?)\s+FROM\s+{_IDENTIFIER}\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def create_pooled_engine(url: str, workers: int = DEFAULT_WORKERS) -> sa.Engine:
+    """
+    Create an engine whose connection pool is bounded by the number of workers.
+    """
+    return sa.create_engine(url, pool_size=workers, max_overflow=0, pool_pre_ping=True)
+
+
+def integer_primary_key(sql_table: sa.Table) -> Optional[str]:
+    """
+    Return the name of the primary key column if it is a single integer column,
+    `None` otherwise.
+    """
+    pk_columns = list(sql_table.primary_key.columns)
+    if len(pk_columns) != 1 or not isinstance(pk_columns[0].type, sa.types.Integer):
+        return None
+    return pk_columns[0].name
+
+
+def key_ranges(
+    engine: sa.Engine, sql_table: sa.Table, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> List[KeyRange]:
+    """
+    Partition a table into half-open primary key ranges of roughly `chunk_size` rows.
+    Tables without an integer primary key are read as a single range.
+    """
+    key = integer_primary_key(sql_table)
+    if key is None:
+        return [(None, None)]
+
+    with engine.connect() as conn:
+        low, high, n_rows = conn.execute(
+            sa.select(
+                sa.func.min(sql_table.c[key]),
+                sa.func.max(sql_table.c[key]),
+                sa.func.count(),
+            )
+        ).one()
+
+    if not n_rows:
+        return [(None, None)]
+
+    n_chunks = -(-n_rows // chunk_size)
+    step = max(1, -(-(high - low + 1) // n_chunks))
+    return [(start, start + step) for start in range(low, high + 1, step)]
+
+
+def _select(sql_table: sa.Table, key_range: KeyRange) -> sa.Select:
+    statement = sa.select(sql_table)
+    key = integer_primary_key(sql_table)
+    if key is not None:
+        start, stop = key_range
+        if start is not None:
+            statement = statement.where(sql_table.c[key] >= start)
+        if stop is not None:
+            statement = statement.where(sql_table.c[key] < stop)
+        statement = statement.order_by(sql_table.c[key])
+    return statement
+
+
+def connectorx_url(engine: sa.Engine) -> Optional[str]:
+    """
+    Return the URL of the database for connectorx, `None` if connectorx isn't
+    installed or doesn't support the database.
+    """
+    try:
+        import connectorx  # noqa: F401
+    except ImportError:
+        return None
+    backend = engine.url.get_backend_name()
+    if backend not in _CONNECTORX_BACKENDS:
+        return None
+    return engine.url.set(drivername=backend).render_as_string(hide_password=False)
+
+
+def iter_table_batches(
+    engine: sa.Engine,
+    sql_table: sa.Table,
+    key_range: KeyRange = (None, None),
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Stream the rows of a table, optionally restricted to a primary key range, through
+    a server-side cursor as arrow record batches of at most `chunk_size` rows.
+
+    The DBAPI driver returns rows of Python objects, so every value is converted
+    once; `read_key_range` reads columnar with connectorx where available.
+    """
+    statement = _select(sql_table, key_range)
+    with engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=chunk_size
+        ).execute(statement)
+        columns = list(result.keys())
+        for rows in result.partitions():
+            yield pa.RecordBatch.from_arrays(
+                [pa.array(values) for values in zip(*rows)], names=columns
+            )
+
+
+def read_key_range(
+    engine: sa.Engine,
+    sql_table: sa.Table,
+    key_range: KeyRange = (None, None),
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> pa.Table:
+    """
+    Read the rows of a primary key range into an arrow table, straight from the
+    database's wire format with connectorx if it is installed and supports the
+    database, through the DBAPI driver otherwise.
+    """
+    url = connectorx_url(engine)
+    if url is not None:
+        import connectorx
+
+        query = _select(sql_table, key_range).compile(
+            engine, compile_kwargs={"literal_binds": True}
+        )
+        return connectorx.read_sql(url, str(query), return_type="arrow")
+
+    batches = list(iter_table_batches(engine, sql_table, key_range, chunk_size))
+    if not batches:
+        return pa.table({column.name: pa.nulls(0) for column in sql_table.columns})
+    return pa.concat_tables(
+        [pa.Table.from_batches([batch]) for batch in batches],
+        promote_options="default",
+    )
+
+
+def extract_tables(
+    url: str,
+    tables: Optional[Iterable[str]] = None,
+    workers: int = DEFAULT_WORKERS,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Dict[str, pa.Table]:
+    """
+    Extract tables from a relational database into arrow tables in parallel.
+
+    Tables are partitioned into primary key ranges of roughly `chunk_size` rows. The
+    ranges of all tables are read concurrently by `workers` threads sharing a
+    connection pool of the same size, so large tables are spread over several
+    connections and small tables don't queue up behind large ones.
+    """
+    engine = create_pooled_engine(url, workers)
+    try:
+        metadata = sa.MetaData()
+        metadata.reflect(bind=engine, only=None if tables is None else list(tables))
+        sql_tables = {
+            name: metadata.tables[name]
+            for name in (metadata.tables if tables is None else tables)
+        }
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            ranges = {
+                name: executor.submit(key_ranges, engine, sql_table, chunk_size)
+                for name, sql_table in sql_tables.items()
+            }
+            parts = {
+                name: [
+                    executor.submit(
+                        read_key_range, engine, sql_table, key_range, chunk_size
+                    )
+                    for key_range in ranges[name].result()
+                ]
+                for name, sql_table in sql_tables.items()
+            }
+            return {
+                name: pa.concat_tables(
+                    [part.result() for part in table_parts],
+                    promote_options="default",
+                )
+                for name, table_parts in parts.items()
+            }
+    finally:
+        engine.dispose()
+
+
+def _selected_table(query: Any) -> Optional[Tuple[str, List[str]]]:
+    """
+    Return the table and columns of a query selecting whole columns of a single
+    table without any condition, `None` for any other query.
+    """
+    match = _SELECT_TABLE.match(str(query))
+    if match is None or re.search(
+        r"\b(WHERE|JOIN|GROUP|ORDER|LIMIT|DISTINCT|UNION)\b",
+        match.group("columns"),
+        re.IGNORECASE,
+    ):
+        return None
+    if match.group("columns").strip() == "*":
+        return match.group(2), ["*"]
+    columns = []
+    for column in match.group("columns").split(","):
+        # strip the table qualifier and the quotes
+        column_match = re.fullmatch(rf"\s*(?:{_IDENTIFIER}\.)?{_IDENTIFIER}\s*", column)
+        if column_match is None:
+            return None
+        columns.append(column_match.group(2))
+    return match.group(2), columns
+
+
+@contextmanager
+def serve_extracted(tables: Dict[str, pa.Table]) -> Iterator[Set[str]]:
+    """
+    Answer pandas queries reading whole tables (`SELECT <columns> FROM <table>`)
+    from already extracted arrow tables instead of the database, e.g. while a
+    dataset class downloads its tables one by one. Other queries, and tables whose
+    values can't be converted to the requested dtypes, go to the database. Yields
+    the names of the tables served.
+    """
+    served: Set[str] = set()
+
+    def read_extracted(
+        read_sql: Any, sql: Any, con: Any, *args: Any, **kwargs: Any
+    ) -> Any:
+        selected = _selected_table(sql)
+        if (
+            selected is None
+            or selected[0] not in tables
+            or args
+            or set(kwargs) - {"dtype"}
+        ):
+            return read_sql(sql, con, *args, **kwargs)
+        name, columns = selected
+        if columns == ["*"]:
+            columns = tables[name].column_names
+        df = (
+            tables[name]
+            .select(columns)
+            .to_pandas(date_as_object=True, timestamp_as_object=True)
+        )
+        try:
+            df = df.astype(kwargs.get("dtype") or {})
+        except (TypeError, ValueError):
+            logger.info(f"Reading {name!r} from the database, dtypes don't match.")
+            return read_sql(sql, con, *args, **kwargs)
+        served.add(name)
+        return df
+
+    with (
+        patch("pandas.read_sql", partial(read_extracted, pd.read_sql)),
+        patch("pandas.read_sql_query", partial(read_extracted, pd.read_sql_query)),
+    ):
+        yield served
@@ -1,5 +1,243 @@
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
 import numpy as np
 
+LOG_LOSS_EPS = 1e-15
+
+Chunk = Tuple[np.ndarray, np.ndarray]
+
+
+def iter_chunks(
+    actual: Union[np.ndarray, Iterable[Chunk]], predicted: Optional[np.ndarray] = None
+) -> Iterator[Chunk]:
+    """
+    Iterate over `(actual, predicted)` chunks. Full arrays are passed as `actual` and
+    `predicted`; an iterable of `(actual, predicted)` chunks is passed as `actual`
+    alone.
+    """
+    if predicted is not None:
+        yield np.asarray(actual), np.asarray(predicted)
+        return
+    for actual_chunk, predicted_chunk in actual:
+        yield np.asarray(actual_chunk), np.asarray(predicted_chunk)
+
+
+def _label_indices(labels: np.ndarray, class_label: np.ndarray) -> np.ndarray:
+    """
+    Map labels to their column index in `class_label`.
+    """
+    order = np.argsort(class_label)
+    positions = np.searchsorted(class_label, labels, sorter=order)
+    indices = order[np.minimum(positions, len(order) - 1)]
+    if not np.array_equal(class_label[indices], labels):
+        raise ValueError("actual labels contain values not present in class_label")
+    return indices
+
+
+def _squeeze(predicted: np.ndarray) -> np.ndarray:
+    """
+    Flatten single-column predictions, as returned by getML for binary targets.
+    """
+    if predicted.ndim == 2 and predicted.shape[1] == 1:
+        return predicted[:, 0]
+    return predicted
+
+
+class Accuracy:
+    """
+    Streaming accuracy. Predictions are either labels or class probabilities of
+    shape `(n, len(class_label))`.
+    """
+
+    def __init__(self, class_label: Optional[np.ndarray] = None):
+        self.class_label = None if class_label is None else np.asarray(class_label)
+        self.n_correct = 0
+        self.n_total = 0
+
+    def update(self, actual: np.ndarray, predicted: np.ndarray) -> None:
+        if predicted.ndim == 2:
+            predicted = self.class_label[np.argmax(predicted, axis=1)]
+        self.n_correct += int(np.count_nonzero(actual == predicted))
+        self.n_total += len(actual)
+
+    def result(self) -> float:
+        return self.n_correct / self.n_total
+
+
+class MeanAbsoluteError:
+    """
+    Streaming mean absolute error.
+    """
+
+    def __init__(self):
+        self.sum = 0.0
+        self.n_total = 0
+
+    def update(self, actual: np.ndarray, predicted: np.ndarray) -> None:
+        self.sum += float(np.abs(actual - predicted.reshape(actual.shape)).sum())
+        self.n_total += len(actual)
+
+    def result(self) -> float:
+        return self.sum / self.n_total
+
+
+class LogLoss:
+    """
+    Streaming log-loss. Binary predictions are probabilities of the positive class,
+    multiclass predictions are class probabilities of shape `(n, len(class_label))`.
+    """
+
+    def __init__(
+        self, class_label: Optional[np.ndarray] = None, eps: float = LOG_LOSS_EPS
+    ):
+        self.class_label = None if class_label is None else np.asarray(class_label)
+        self.eps = eps
+        self.sum = 0.0
+        self.n_total = 0
+
+    def update(self, actual: np.ndarray, predicted: np.ndarray) -> None:
+        predicted = np.clip(_squeeze(predicted), self.eps, 1 - self.eps)
+        if predicted.ndim == 2:
+            indices = _label_indices(actual, self.class_label)
+            predicted = predicted / predicted.sum(axis=1, keepdims=True)
+            likelihood = predicted[np.arange(len(actual)), indices]
+        else:
+            likelihood = np.where(actual == 1, predicted, 1 - predicted)
+        self.sum -= float(np.log(likelihood).sum())
+        self.n_total += len(actual)
+
+    def result(self) -> float:
+        return self.sum / self.n_total
+
+
+def _merge_counts(
+    counts: List[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Merge `(scores, positives, negatives)` counts into counts per distinct score,
+    sorted by score.
+    """
+    if len(counts) == 1:
+        return counts[0]
+    scores, inverse = np.unique(
+        np.concatenate([scores for scores, _, _ in counts]), return_inverse=True
+    )
+    positives = np.bincount(
+        inverse, np.concatenate([positives for _, positives, _ in counts])
+    )
+    negatives = np.bincount(
+        inverse, np.concatenate([negatives for _, _, negatives in counts])
+    )
+    return scores, positives.astype(np.int64), negatives.astype(np.int64)
+
+
+class AUROC:
+    """
+    Exact streaming AUROC. Keeps the number of positive and negative examples per
+    distinct score of every chunk and merges them once they outgrow the counts
+    merged so far, so every example is merged a logarithmic number of times and
+    memory is bounded by twice the number of distinct scores. Binary predictions are
+    probabilities of the positive class (or any other scores), multiclass
+    predictions are class probabilities of shape `(n, len(class_label))`, scored
+    one-vs-rest and macro-averaged.
+    """
+
+    def __init__(self, class_label: Optional[np.ndarray] = None):
+        self.class_label = None if class_label is None else np.asarray(class_label)
+        self.counts: List[List[Tuple[np.ndarray, np.ndarray, np.ndarray]]] = []
+        self.n_merged: List[int] = []
+
+    def update(self, actual: np.ndarray, predicted: np.ndarray) -> None:
+        predicted = _squeeze(predicted)
+        if predicted.ndim == 1:
+            predicted = predicted[:, None]
+            is_positive = (actual == 1)[:, None]
+        else:
+            is_positive = (
+                _label_indices(actual, self.class_label)[:, None]
+                == np.arange(predicted.shape[1])[None, :]
+            )
+
+        if not self.counts:
+            self.counts = [[] for _ in range(predicted.shape[1])]
+            self.n_merged = [0] * predicted.shape[1]
+
+        for i, counts in enumerate(self.counts):
+            scores, inverse = np.unique(predicted[:, i], return_inverse=True)
+            positives = np.bincount(
+                inverse, is_positive[:, i], minlength=len(scores)
+            ).astype(np.int64)
+            counts.append((scores, positives, np.bincount(inverse) - positives))
+            if sum(len(scores) for scores, _, _ in counts) >= 2 * self.n_merged[i]:
+                counts[:] = [_merge_counts(counts)]
+                self.n_merged[i] = len(counts[0][0])
+
+    def result(self) -> float:
+        aurocs = []
+        for counts in self.counts:
+            _, positives, negatives = _merge_counts(counts)
+            n_positives, n_negatives = positives.sum(), negatives.sum()
+            if not (n_positives and n_negatives):
+                continue
+            # negatives scored strictly below each score, ties count half
+            negatives_below = np.cumsum(negatives) - negatives
+            wins = (positives * (negatives_below + 0.5 * negatives)).sum()
+            aurocs.append(wins / (n_positives * n_negatives))
+        return float(np.mean(aurocs))
+
+
+def _score(
+    metric: Union[Accuracy, MeanAbsoluteError, LogLoss, AUROC],
+    actual: Union[np.ndarray, Iterable[Chunk]],
+    predicted: Optional[np.ndarray],
+) -> float:
+    for actual_chunk, predicted_chunk in iter_chunks(actual, predicted):
+        metric.update(actual_chunk, predicted_chunk)
+    return metric.result()
+
+
+def accuracy(
+    actual: Union[np.ndarray, Iterable[Chunk]],
+    predicted: Optional[np.ndarray] = None,
+    class_label: Optional[np.ndarray] = None,
+) -> float:
+    """
+    Calculate the accuracy of predicted labels or class probabilities.
+    """
+    return _score(Accuracy(class_label), actual, predicted)
+
+
+def mean_absolute_error(
+    actual: Union[np.ndarray, Iterable[Chunk]], predicted: Optional[np.ndarray] = None
+) -> float:
+    """
+    Calculate the mean absolute error of a regression model.
+    """
+    return _score(MeanAbsoluteError(), actual, predicted)
+
+
+def log_loss(
+    actual: Union[np.ndarray, Iterable[Chunk]],
+    predicted: Optional[np.ndarray] = None,
+    class_label: Optional[np.ndarray] = None,
+) -> float:
+    """
+    Calculate the log-loss of a binary or multiclass classification model.
+    """
+    return _score(LogLoss(class_label), actual, predicted)
+
+
+def auroc(
+    actual: Union[np.ndarray, Iterable[Chunk]],
+    predicted: Optional[np.ndarray] = None,
+    class_label: Optional[np.ndarray] = None,
+) -> float:
+    """
+    Calculate the (one-vs-rest, macro-averaged) AUROC of a binary or multiclass
+    classification model.
+    """
+    return _score(AUROC(class_label), actual, predicted)
+
 
 def prob_to_acc(
     prob: np.ndarray, actual_labels: np.ndarray, class_label: np.ndarray
@@ -7,6 +245,4 @@ def prob_to_acc(
     """
     Calculate the accuracy of a classification model with multiple target classes.
     """
-    ix_max = np.argmax(prob, axis=1)
-    predicted_labels = np.asarray([class_label[ix] for ix in ix_max])
-    return (actual_labels == predicted_labels).sum() / len(actual_labels)
+    return accuracy(actual_labels, prob, class_label)
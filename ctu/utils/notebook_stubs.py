@@ -1,15 +1,19 @@
+import asyncio
 import base64
+import hashlib
+import json
+import multiprocessing
 import os
+from concurrent.futures import Executor, ProcessPoolExecutor
 from functools import lru_cache
 from pathlib import Path
-from typing import Annotated
+from typing import Annotated, Any, Dict, Iterable, List, Union
 from unittest.mock import patch
 
 import cairosvg
 import getml
 import jinja2
 import jupytext
-import requests
 from db_transformer.data import CTUDataset
 from db_transformer.data.dataset_defaults import (
     CTU_REPOSITORY_DEFAULTS,
@@ -23,10 +27,13 @@ from markdownify import markdownify as md
 from nbconvert.preprocessors import ExecutePreprocessor
 from pydantic.alias_generators import to_snake
 
+from ctu.utils.cache import RESPONSE_CACHE, ResponseCache, response_key
 from ctu.utils.data import (
+    TaskType,
     infer_task_type,
     load_ctu_dataset,
 )
+from ctu.utils.responses import fetch_url
 
 UTILS_ROOT = Path(__file__).parent
 OUTPUT_PATH = UTILS_ROOT / "../stubs"
@@ -68,9 +75,7 @@ def retrieve_dataset_description(
     """
     dataset_url = dataset.replace("_", "").replace("-", "")
     url = f"https://relational.fel.cvut.cz/dataset/{dataset_url}"
-    response = requests.get(url)
-    response.raise_for_status()
-    return md(response.text)
+    return md(fetch_url(url).decode())
 
 
 PROMPT = """
@@ -90,79 +95,266 @@ THE TEXT WILL BE EMBEDDED IN A NOTEBOOK STUB FOR THE DATASET. SO PLEASE DO NOT G
 TOP-LEVEL MARKUP (HEADLINES, ETC.). JUST THE TEXT CONTENT. THANK YOU!
 """
 
-llm = OpenAIChat(
-    api_key=os.environ["OPENAI_API_KEY"], model=ChatModel.GPT_4O, temperature=0
-)
-session = Session(
-    llm=llm,
-    system_message=PROMPT,
-    functions=[retrieve_dataset_description],
-)
+LLM_MODEL = ChatModel.GPT_4O
 
 
-def create_notebook_stub(dataset: str, output_path: Path = OUTPUT_PATH):
-    with open(UTILS_ROOT / "assets/notebook_template.jinja2") as f:
-        template = jinja2.Template(f.read())
+@lru_cache
+def get_llm() -> OpenAIChat:
+    # created lazily, so that stubs can be rendered offline without an API key
+    return OpenAIChat(
+        api_key=os.environ["OPENAI_API_KEY"], model=LLM_MODEL, temperature=0
+    )
 
-    dataset_defaults = CTU_REPOSITORY_DEFAULTS[dataset]
 
-    dataset_er_diagram_url = (
-        f"https://relational.fel.cvut.cz/assets/img/datasets-generated/{dataset}.svg"
-    )
-    diagram_svg = requests.get(dataset_er_diagram_url).content
-    diagram_png = cairosvg.svg2png(bytestring=diagram_svg)
-
-    diagram_png_base64 = base64.b64encode(diagram_png).decode("utf-8")
-
-    diagram_message = UserMessage(
-        content=[
-            {
-                "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{diagram_png_base64}"},
-            },
-        ]
+STATE_DIR_NAME = ".stub_state"
+
+
+def create_session() -> Session:
+    """
+    Create a fresh LLM session, so that the conversations about different datasets
+    don't leak into each other.
+    """
+    return Session(
+        llm=get_llm(),
+        system_message=PROMPT,
+        functions=[retrieve_dataset_description],
     )
-    session.messages.add(diagram_message)
+
+
+def er_diagram_url(dataset: str) -> str:
+    return f"https://relational.fel.cvut.cz/assets/img/datasets-generated/{dataset}.svg"
+
+
+def fetch_er_diagram(dataset: str) -> bytes:
+    """
+    Download the ER diagram of a dataset and convert it to PNG.
+    """
+    diagram_svg = fetch_url(er_diagram_url(dataset))
+    return cairosvg.svg2png(bytestring=diagram_svg)
+
+
+def inspect_dataset(dataset: str) -> Dict[str, Any]:
+    """
+    Load a dataset and collect the information needed to render its stub.
+    """
+    dataset_defaults = CTU_REPOSITORY_DEFAULTS[dataset]
 
     population, peripheral = load_ctu_dataset(dataset, as_pandas=True)
-    population_name = to_snake(dataset_defaults.target_table).replace(" ", "_")
-    peripheral_names = [to_snake(name).lower() for name in sorted(peripheral)]
 
-    task_type = infer_task_type(dataset_defaults, population)
+    return {
+        "task_type": str(infer_task_type(dataset_defaults, population)),
+        "population_name": to_snake(dataset_defaults.target_table).replace(" ", "_"),
+        "peripheral_names": [to_snake(name).lower() for name in sorted(peripheral)],
+    }
+
 
-    dataset_description = session(
+def describe_dataset(
+    dataset: str,
+    diagram_png: bytes,
+    task_type: str,
+    cache: ResponseCache = RESPONSE_CACHE,
+) -> str:
+    """
+    Let the LLM write a description of the dataset based on its ER diagram. The
+    completion is cached by model, prompts and diagram.
+    """
+    prompt = (
         f"Use the datamodel above to create a dataset description for the '{dataset}' dataset, "
         "first retrieve additonal information through the `retrieve_dataset_description` function. "
         "Particularly, describe the target column and the task (classification, regression) of the dataset. "
-        f"The task type for this dataset is: {task_type!r}."
-    ).content
+        f"The task type for this dataset is: {TaskType(task_type)!r}."
+    )
+    key = response_key(
+        "llm",
+        str(LLM_MODEL),
+        PROMPT,
+        prompt,
+        hashlib.sha256(diagram_png).hexdigest(),
+    )
+
+    def complete() -> bytes:
+        session = create_session()
+
+        diagram_png_base64 = base64.b64encode(diagram_png).decode("utf-8")
+
+        diagram_message = UserMessage(
+            content=[
+                {
+                    "type": "image_url",
+                    "image_url": {"url": f"data:image/png;base64,{diagram_png_base64}"},
+                },
+            ]
+        )
+        session.messages.add(diagram_message)
+
+        return session(prompt).content.encode()
+
+    return cache.get_or_fetch(key, complete).decode()
+
+
+def render_notebook_stub(
+    dataset: str,
+    dataset_description: str,
+    task_type: str,
+    population_name: str,
+    peripheral_names: List[str],
+) -> str:
+    """
+    Render the notebook stub of a dataset in the py:percent format.
+    """
+    with open(UTILS_ROOT / "assets/notebook_template.jinja2") as f:
+        template = jinja2.Template(f.read())
 
-    py_percent_rendered = template.render(
+    return template.render(
         project_name=f"{to_snake(dataset)}",
         dataset=dataset,
         dataset_description=dataset_description,
-        dataset_er_diagram_url=dataset_er_diagram_url,
-        target_column=dataset_defaults.target_column,
-        task_type=task_type,
+        dataset_er_diagram_url=er_diagram_url(dataset),
+        target_column=CTU_REPOSITORY_DEFAULTS[dataset].target_column,
+        task_type=TaskType(task_type),
         population_name=population_name,
         peripheral_names=peripheral_names,
     )
 
+
+def execute_notebook_stub(py_percent_rendered: str, path: Path) -> None:
+    """
+    Execute a rendered notebook stub to populate its output cells and write it.
+    """
     notebook = jupytext.reads(py_percent_rendered, fmt="py:percent")
 
-    # execute the notebook to populate output cells
     exec_proc = ExecutePreprocessor(timeout=None)
     exec_proc.preprocess(notebook)
 
-    jupytext.write(notebook, output_path / f"{to_snake(dataset)}.ipynb")
+    jupytext.write(notebook, path)
+
+
+def create_notebook_stub(dataset: str, output_path: Path = OUTPUT_PATH):
+    diagram_png = fetch_er_diagram(dataset)
+    info = inspect_dataset(dataset)
+    dataset_description = describe_dataset(dataset, diagram_png, info["task_type"])
+    py_percent_rendered = render_notebook_stub(dataset, dataset_description, **info)
+    execute_notebook_stub(
+        py_percent_rendered, output_path / f"{to_snake(dataset)}.ipynb"
+    )
+
+
+class _StubState:
+    """
+    The intermediate results of a dataset's stub generation, persisted so that an
+    interrupted or failed run resumes after the last completed stage.
+    """
+
+    def __init__(self, dataset: str, output_path: Path):
+        self.path = output_path / STATE_DIR_NAME / f"{to_snake(dataset)}.json"
+        self.values = json.loads(self.path.read_text()) if self.path.exists() else {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.values
+
+    def __getitem__(self, key: str) -> Any:
+        return self.values[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.values[key] = value
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self.values, indent=2))
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
 
 
-def create_notebook_stubs():
-    output_path = OUTPUT_PATH
-    for dataset in PAPER_DATASETS:
-        print(f"Creating notebook stub for {dataset}... ")
-        if Path(output_path / f"{to_snake(dataset)}.ipynb").exists():
-            print("Already exists. ")
-        else:
-            create_notebook_stub(dataset, output_path)
-            print("Done.")
+async def _create_notebook_stub_async(
+    dataset: str,
+    output_path: Path,
+    executor: Executor,
+    requests_semaphore: asyncio.Semaphore,
+) -> None:
+    loop = asyncio.get_running_loop()
+    state = _StubState(dataset, output_path)
+
+    async def fetch_diagram() -> bytes:
+        async with requests_semaphore:
+            return await asyncio.to_thread(fetch_er_diagram, dataset)
+
+    # the diagram download overlaps with loading the dataset in a worker process
+    diagram_task = asyncio.create_task(fetch_diagram())
+    if "info" not in state:
+        state["info"] = await loop.run_in_executor(executor, inspect_dataset, dataset)
+    diagram_png = await diagram_task
+
+    if "description" not in state:
+        async with requests_semaphore:
+            state["description"] = await asyncio.to_thread(
+                describe_dataset, dataset, diagram_png, state["info"]["task_type"]
+            )
+
+    py_percent_rendered = render_notebook_stub(
+        dataset, state["description"], **state["info"]
+    )
+    await loop.run_in_executor(
+        executor,
+        execute_notebook_stub,
+        py_percent_rendered,
+        output_path / f"{to_snake(dataset)}.ipynb",
+    )
+    state.clear()
+
+
+async def create_notebook_stubs_async(
+    datasets: Iterable[str] = PAPER_DATASETS,
+    output_path: Path = OUTPUT_PATH,
+    max_workers: int = 4,
+    max_concurrent_requests: int = 8,
+) -> Dict[str, Union[BaseException, None]]:
+    """
+    Create the notebook stubs of several datasets concurrently.
+
+    Network-bound stages (ER diagram download, LLM calls) run as asyncio tasks
+    limited by `max_concurrent_requests`; CPU-bound stages (loading the dataset,
+    executing the notebook) run in a pool of `max_workers` processes. Existing stubs
+    are skipped and completed stages of unfinished stubs are resumed from the state
+    stored in `output_path`. Returns the exception by dataset, `None` on success.
+    """
+    requests_semaphore = asyncio.Semaphore(max_concurrent_requests)
+    pending = [
+        dataset
+        for dataset in datasets
+        if not (output_path / f"{to_snake(dataset)}.ipynb").exists()
+    ]
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        results = await asyncio.gather(
+            *(
+                _create_notebook_stub_async(
+                    dataset, output_path, executor, requests_semaphore
+                )
+                for dataset in pending
+            ),
+            return_exceptions=True,
+        )
+
+    for dataset, result in zip(pending, results):
+        print(f"{dataset}: {'Done.' if result is None else f'Failed: {result!r}'}")
+
+    return dict(zip(pending, results))
+
+
+def create_notebook_stubs(
+    datasets: Iterable[str] = PAPER_DATASETS,
+    output_path: Path = OUTPUT_PATH,
+    max_workers: int = 4,
+    max_concurrent_requests: int = 8,
+) -> Dict[str, Union[BaseException, None]]:
+    """
+    Create the notebook stubs of all paper datasets, see `create_notebook_stubs_async`.
+    Inside a running event loop (e.g. a notebook), await `create_notebook_stubs_async`
+    instead.
+    """
+    return asyncio.run(
+        create_notebook_stubs_async(
+            datasets, output_path, max_workers, max_concurrent_requests
+        )
+    )
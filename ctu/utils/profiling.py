@@ -0,0 +1,290 @@
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Union,
+)
+
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+"""
+Interval in seconds at which the resident set size is sampled while a stage runs.
+"""
+RSS_SAMPLING_INTERVAL = 0.01
+
+Event = Dict[str, Any]
+Sink = Callable[[Event], None]
+
+
+class LoggerSink:
+    """
+    Emits events as log records.
+    """
+
+    def __init__(self, logger: logging.Logger = logger, level: int = logging.INFO):
+        self.logger = logger
+        self.level = level
+
+    def __call__(self, event: Event) -> None:
+        details = ", ".join(
+            f"{key}={value}"
+            for key, value in event.items()
+            if key not in ("event", "stage", "pid", "start")
+        )
+        self.logger.log(self.level, f"{event['event']} {event['stage']}: {details}")
+
+
+class JsonLinesSink:
+    """
+    Appends events as JSON lines to a file, e.g. to correlate them with a py-spy
+    recording by their `pid` and `start` (unix time) fields.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._file: Optional[TextIO] = None
+
+    def __call__(self, event: Event) -> None:
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a")
+            self._file.write(json.dumps(event, default=str) + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class CallbackSink:
+    """
+    Passes events to a callback, e.g. `events.append`.
+    """
+
+    def __init__(self, callback: Callable[[Event], Any]):
+        self.callback = callback
+
+    def __call__(self, event: Event) -> None:
+        self.callback(event)
+
+
+_sinks: List[Sink] = []
+_profile_dir: Optional[Path] = None
+_local = threading.local()
+
+
+def enabled() -> bool:
+    return bool(_sinks)
+
+
+def enable(*sinks: Sink, profile_dir: Optional[Union[str, Path]] = None) -> None:
+    """
+    Emit profiling events to `sinks` (a `LoggerSink` by default). With
+    `profile_dir`, every outermost stage is also run under cProfile and its stats
+    are dumped to `<profile_dir>/<stage>-<pid>-<n>.prof`.
+    """
+    global _profile_dir
+    _sinks[:] = list(sinks) or [LoggerSink()]
+    _profile_dir = None if profile_dir is None else Path(profile_dir)
+    if _profile_dir is not None:
+        _profile_dir.mkdir(parents=True, exist_ok=True)
+
+
+def disable() -> None:
+    global _profile_dir
+    for sink in _sinks:
+        if hasattr(sink, "close"):
+            sink.close()
+    _sinks.clear()
+    _profile_dir = None
+
+
+@contextmanager
+def profiling(
+    *sinks: Sink, profile_dir: Optional[Union[str, Path]] = None
+) -> Iterator[None]:
+    """
+    Enable profiling within a block (see `enable`).
+    """
+    enable(*sinks, profile_dir=profile_dir)
+    try:
+        yield
+    finally:
+        disable()
+
+
+def emit(event: str, stage: str, **fields: Any) -> None:
+    if not _sinks:
+        return
+    record = {"event": event, "stage": stage, "pid": os.getpid(), **fields}
+    for sink in _sinks:
+        try:
+            sink(record)
+        except Exception:
+            logger.exception(f"Profiling sink {sink!r} failed.")
+
+
+def _rss() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+class _PeakRSS(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.start_rss = _rss()
+        self.peak = self.start_rss
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        if self.start_rss is None:
+            return
+        while not self.stopped.wait(RSS_SAMPLING_INTERVAL):
+            self.peak = max(self.peak, _rss())
+
+    def stop(self) -> Dict[str, Optional[int]]:
+        self.stopped.set()
+        self.join()
+        if self.start_rss is None:
+            return {"peak_rss": None, "rss_delta": None}
+        self.peak = max(self.peak, _rss())
+        return {"peak_rss": self.peak, "rss_delta": self.peak - self.start_rss}
+
+
+class Stage:
+    """
+    A running stage. Counts added with `add` are reported with the stage.
+    """
+
+    def __init__(self, name: str, fields: Dict[str, Any]):
+        self.name = name
+        self.fields = fields
+
+    def add(self, **counts: int) -> None:
+        for key, value in counts.items():
+            self.fields[key] = self.fields.get(key, 0) + value
+
+
+class _NullStage:
+    def add(self, **counts: int) -> None:
+        pass
+
+    def __enter__(self) -> "_NullStage":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+@contextmanager
+def _stage(name: str, fields: Dict[str, Any]) -> Iterator[Stage]:
+    current = Stage(name, fields)
+    depth = getattr(_local, "depth", 0)
+    profiler = None
+    if _profile_dir is not None and depth == 0:
+        profiler = cProfile.Profile()
+    sampler = _PeakRSS()
+    sampler.start()
+    start, wall_start = time.perf_counter(), time.time()
+    _local.depth = depth + 1
+    if profiler is not None:
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is active, e.g. in a concurrent stage
+            profiler = None
+    error = None
+    try:
+        yield current
+    except BaseException as exc:
+        error = type(exc).__name__
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        seconds = time.perf_counter() - start
+        _local.depth = depth
+        memory = sampler.stop()
+        if profiler is not None:
+            _local.n_profiles = getattr(_local, "n_profiles", 0) + 1
+            profile_path = (
+                _profile_dir / f"{name}-{os.getpid()}-{_local.n_profiles}.prof"
+            )
+            profiler.dump_stats(profile_path)
+            current.fields["profile"] = str(profile_path)
+        emit(
+            "stage",
+            name,
+            start=wall_start,
+            seconds=seconds,
+            depth=depth,
+            **memory,
+            **current.fields,
+            **({} if error is None else {"error": error}),
+        )
+
+
+def stage(name: str, **fields: Any) -> ContextManager[Union[Stage, _NullStage]]:
+    """
+    Time a named stage and report its wall time, peak memory and the counts added
+    to it (`with stage("split") as s: ...; s.add(rows=n)`). Costs a single check
+    while profiling is disabled.
+    """
+    if not _sinks:
+        return _NULL_STAGE
+    return _stage(name, fields)
+
+
+def nbytes(table: Any) -> Optional[int]:
+    """
+    Return the memory footprint of a pandas, arrow or getML table.
+    """
+    if isinstance(table, pd.DataFrame):
+        return int(table.memory_usage(index=True, deep=True).sum())
+    if isinstance(table, pa.Table):
+        return table.nbytes
+    if hasattr(table, "nbytes"):
+        return int(table.nbytes())
+    return None
+
+
+def nrows(table: Any) -> Optional[int]:
+    if isinstance(table, (pd.DataFrame, pa.Table)):
+        return len(table)
+    if hasattr(table, "nrows"):
+        return int(table.nrows())
+    return None
+
+
+def table_event(stage: str, name: str, table: Any) -> None:
+    """
+    Report the number of rows and bytes of a table produced by a stage.
+    """
+    if not _sinks:
+        return
+    emit("table", stage, table=name, rows=nrows(table), bytes=nbytes(table))
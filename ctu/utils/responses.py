@@ -0,0 +1,107 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Mapping, Optional, Union
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+
+from ctu.utils.cache import RESPONSE_CACHE, ResponseCache, response_key
+
+"""
+Send all requests made through `fetch_url` to this origin instead, e.g. a
+`StandInServer`. Cache keys still use the original URL.
+"""
+HTTP_BASE_URL = os.environ.get("CTU_HTTP_BASE_URL")
+
+
+def rebase_url(url: str, base_url: Optional[str]) -> str:
+    """
+    Replace scheme and host of `url` with those of `base_url`.
+    """
+    if base_url is None:
+        return url
+    base = urlsplit(base_url)
+    return urlunsplit(urlsplit(url)._replace(scheme=base.scheme, netloc=base.netloc))
+
+
+def fetch_url(
+    url: str,
+    cache: ResponseCache = RESPONSE_CACHE,
+    base_url: Optional[str] = HTTP_BASE_URL,
+) -> bytes:
+    """
+    GET the body of `url` through the response cache.
+    """
+
+    def fetch() -> bytes:
+        response = requests.get(rebase_url(url, base_url))
+        response.raise_for_status()
+        return response.content
+
+    return cache.get_or_fetch(response_key("GET", url), fetch)
+
+
+class StandInServer:
+    """
+    A local HTTP server answering GET requests from a mapping of paths to bodies,
+    standing in for remote hosts in tests. Unknown paths are answered with 404.
+
+    >>> import tempfile
+    >>> with (
+    ...     tempfile.TemporaryDirectory() as cache_dir,
+    ...     StandInServer({"/dataset/financial": "<p>...</p>"}) as server,
+    ... ):
+    ...     fetch_url(
+    ...         "https://relational.fel.cvut.cz/dataset/financial",
+    ...         cache=ResponseCache(cache_dir),
+    ...         base_url=server.url,
+    ...     )
+    b'<p>...</p>'
+    """
+
+    def __init__(self, responses: Mapping[str, Union[bytes, str]]):
+        self.responses = {
+            path: body.encode() if isinstance(body, str) else body
+            for path, body in responses.items()
+        }
+        self.requested = []
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.requested.append(self.path)
+                body = stand_in.responses.get(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StandInServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StandInServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
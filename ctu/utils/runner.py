@@ -0,0 +1,434 @@
+"""
+Run getML FastProp pipelines over several CTU datasets concurrently, e.g. a full
+sweep over the paper datasets:
+
+    python -m ctu.utils.runner --cores 32 --threads-per-run 4 --output sweep
+
+Runs are scheduled within a core and an advisory memory budget (the memory of
+the getML engine isn't measured), every finished run is checkpointed to
+`<output>/runs` and an interrupted sweep resumes with the runs that haven't
+succeeded yet. The consolidated scores and runtimes are written to
+`<output>/results.csv`.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import time
+import traceback
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+import getml
+import numpy as np
+import pandas as pd
+from pydantic.alias_generators import to_snake
+
+from ctu.utils.cache import DATASET_CACHE
+from ctu.utils.data import (
+    TaskType,
+    build_reldb_dataset,
+    infer_task_type,
+    load_ctu_dataset,
+    retrieve_auto_annotated_data,
+    retrieve_auto_datamodel,
+)
+from ctu.utils.metrics import auroc, mean_absolute_error, prob_to_acc
+from ctu.utils.notebook_stubs import PAPER_DATASETS
+
+logger = logging.getLogger(__name__)
+
+RUNS_DIR_NAME = "runs"
+RESULTS_FILE_NAME = "results.csv"
+
+PROJECT_PREFIX = "runner_"
+
+DEFAULT_THREADS_PER_RUN = 2
+DEFAULT_MAX_DEPTH = 2
+DEFAULT_NUM_FEATURES = 200
+
+"""
+Share of the physical memory the concurrent runs may use by default.
+"""
+MEMORY_SHARE = 0.8
+
+"""
+Memory estimate of a run per byte of the dataset in the dataset cache (pandas
+frames, their copies in the getML engine and the learned features), and the
+estimate for datasets that haven't been cached yet.
+"""
+MEMORY_PER_CACHED_BYTE = 20
+DEFAULT_MEMORY_ESTIMATE = 4 * 1024**3
+
+"""
+Factor on the memory estimate of a run whose process crashed, e.g. killed by the
+OOM killer, applied again on every further crash.
+"""
+CRASH_MEMORY_FACTOR = 2
+
+METRICS = {
+    TaskType.CLASSIFICATION: "auroc",
+    TaskType.MULTICLASS_CLASSIFICATION: "accuracy",
+    TaskType.REGRESSION: "mae",
+}
+
+
+def _apply_roles(
+    frame: getml.data.DataFrame, roles: Any, exclude: Iterable[str] = ()
+) -> None:
+    for role, columns in roles.to_dict().items():
+        columns = [
+            column
+            for column in columns
+            if column in frame.colnames and column not in exclude
+        ]
+        if columns:
+            frame.set_role(columns, role)
+
+
+def run_dataset(
+    name: str,
+    num_threads: int = DEFAULT_THREADS_PER_RUN,
+    max_depth: int = DEFAULT_MAX_DEPTH,
+    num_features: int = DEFAULT_NUM_FEATURES,
+) -> Dict[str, Any]:
+    """
+    Fit a FastProp pipeline on the automatically annotated tables and data model of
+    a dataset and score it on the validation split. Returns the score and the
+    runtimes of the stages.
+    """
+    getml.set_project(f"{PROJECT_PREFIX}{to_snake(name)}")
+    start = time.perf_counter()
+
+    dataset = build_reldb_dataset(name)
+    # the data model loads the same frames, share them through the session cache so
+    # that the roles are applied to the frames the pipeline is fitted on
+    population, peripheral = load_ctu_dataset(name, max_depth=max_depth)
+    target = dataset.defaults.target_column
+    task_type = infer_task_type(
+        dataset.defaults, dataset.db.table_dict[dataset.defaults.target_table].df
+    )
+    roles = retrieve_auto_annotated_data(dataset)
+    frames = {population.name: population, **peripheral}
+    for frame in frames.values():
+        if frame.name in roles:
+            _apply_roles(frame, roles[frame.name], exclude=[target, "split"])
+    data_model = retrieve_auto_datamodel(name, max_depth)
+    load_seconds = time.perf_counter() - start
+
+    if task_type is TaskType.MULTICLASS_CLASSIFICATION:
+        population_targets = getml.data.make_target_columns(population, target)
+        # the predicted probabilities are in the order of the target columns, which
+        # are named `<target>=<class>`
+        class_label = np.array(
+            [column[len(target) + 1 :] for column in population_targets.roles.target]
+        )
+    else:
+        population_targets = population
+    container = getml.data.Container(
+        population=population_targets, split=population["split"]
+    )
+    container.add(**{table: frames[table] for table in data_model.peripheral})
+
+    if task_type is TaskType.REGRESSION:
+        loss_function = getml.feature_learning.loss_functions.SquareLoss
+        predictor = getml.predictors.XGBoostRegressor
+    else:
+        loss_function = getml.feature_learning.loss_functions.CrossEntropyLoss
+        predictor = getml.predictors.XGBoostClassifier
+    pipe = getml.pipeline.Pipeline(
+        tags=["runner"],
+        data_model=data_model,
+        feature_learners=getml.feature_learning.FastProp(
+            loss_function=loss_function,
+            num_features=num_features,
+            num_threads=num_threads,
+        ),
+        predictors=predictor(n_jobs=num_threads),
+    )
+
+    start = time.perf_counter()
+    pipe.fit(container.train)
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predicted = pipe.predict(container.val)
+    actual = population[population["split"] == "val"][target].to_numpy()
+    if task_type is TaskType.CLASSIFICATION:
+        score = auroc(actual, predicted)
+    elif task_type is TaskType.MULTICLASS_CLASSIFICATION:
+        score = prob_to_acc(predicted, actual, class_label)
+    else:
+        score = mean_absolute_error(actual, predicted)
+    score_seconds = time.perf_counter() - start
+
+    return {
+        "task": str(task_type),
+        "metric": METRICS[task_type],
+        "score": float(score),
+        "n_features": num_features,
+        "load_seconds": load_seconds,
+        "fit_seconds": fit_seconds,
+        "score_seconds": score_seconds,
+        "pipeline": pipe.id,
+    }
+
+
+def checkpoint_path(output_path: Path, name: str) -> Path:
+    return output_path / RUNS_DIR_NAME / f"{to_snake(name)}.json"
+
+
+def read_checkpoint(output_path: Path, name: str) -> Optional[Dict[str, Any]]:
+    path = checkpoint_path(output_path, name)
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def write_checkpoint(output_path: Path, name: str, record: Dict[str, Any]) -> None:
+    path = checkpoint_path(output_path, name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".tmp-{os.getpid()}")
+    tmp_path.write_text(json.dumps(record, indent=2, default=str))
+    os.replace(tmp_path, path)
+
+
+def _run_and_checkpoint(
+    name: str, output_path: Path, run_kwargs: Dict[str, Any]
+) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(message)s")
+    start = time.perf_counter()
+    record: Dict[str, Any] = {"dataset": name, **run_kwargs}
+    try:
+        record.update(run_dataset(name, **run_kwargs), status="ok")
+    except Exception as exc:
+        logger.exception(f"Run of {name!r} failed.")
+        record.update(
+            status="failed", error=repr(exc), traceback=traceback.format_exc()
+        )
+    # the getML engine runs in a separate process and isn't included
+    record["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    record["seconds"] = time.perf_counter() - start
+    write_checkpoint(output_path, name, record)
+
+
+def estimate_memory(
+    name: str,
+    previous: Optional[Dict[str, Any]] = None,
+    cache_info: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> int:
+    """
+    Estimate the memory of a run from the size of the dataset in the dataset cache
+    (see `DatasetCache.info`) and the peak memory of a previous run. If the previous
+    run crashed, its estimate is multiplied by `CRASH_MEMORY_FACTOR`.
+    """
+    if cache_info is None:
+        cache_info = DATASET_CACHE.info()
+    cached = cache_info.get(name)
+    if cached is None:
+        estimate = DEFAULT_MEMORY_ESTIMATE
+    else:
+        estimate = cached["size_bytes"] * MEMORY_PER_CACHED_BYTE
+    if previous is not None and previous.get("peak_rss"):
+        estimate = max(estimate, int(previous["peak_rss"]))
+    if previous is not None and previous.get("status") == "crashed":
+        estimate = max(
+            estimate,
+            int(previous.get("memory_estimate", estimate)) * CRASH_MEMORY_FACTOR,
+        )
+    return estimate
+
+
+def physical_memory() -> int:
+    return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def collect_results(output_path: Path, datasets: Iterable[str]) -> pd.DataFrame:
+    """
+    Consolidate the checkpointed runs of `datasets` into a table and write it to
+    `<output_path>/results.csv`.
+    """
+    records = [
+        record
+        for record in (read_checkpoint(output_path, name) for name in datasets)
+        if record is not None
+    ]
+    results = pd.DataFrame.from_records(records).drop(
+        columns="traceback", errors="ignore"
+    )
+    results.to_csv(output_path / RESULTS_FILE_NAME, index=False)
+    return results
+
+
+def run_datasets(
+    datasets: Iterable[str] = PAPER_DATASETS,
+    output_path: Union[str, Path] = "runner",
+    cores: Optional[int] = None,
+    threads_per_run: int = DEFAULT_THREADS_PER_RUN,
+    memory_budget: Optional[int] = None,
+    timeout: Optional[float] = None,
+    retry_failed: bool = True,
+    max_depth: int = DEFAULT_MAX_DEPTH,
+    num_features: int = DEFAULT_NUM_FEATURES,
+) -> pd.DataFrame:
+    """
+    Run `run_dataset` for several datasets, each in its own process.
+
+    Runs start as long as the `cores` (all cores by default) and the
+    `memory_budget` (`MEMORY_SHARE` of the physical memory by default) allow, every
+    run gets `threads_per_run` of the cores as `num_threads`. Larger datasets are
+    started first, a dataset exceeding the memory budget on its own runs alone.
+    Runs exceeding `timeout` seconds are killed.
+
+    The memory budget is advisory: runs are admitted by their estimates (see
+    `estimate_memory`), and the measured peak memory of a run only covers its own
+    process, not the getML engine all runs share. Runs that crashed are retried
+    with a larger estimate when the sweep is restarted.
+
+    Every finished run is checkpointed. Successful runs (and with `retry_failed=False`
+    also failed ones) are skipped when a sweep is restarted. Returns the
+    consolidated results, see `collect_results`.
+    """
+    output_path = Path(output_path)
+    datasets = list(datasets)
+    cores = cores or os.cpu_count() or 1
+    threads_per_run = min(threads_per_run, cores)
+    memory_budget = memory_budget or int(physical_memory() * MEMORY_SHARE)
+    run_kwargs = {
+        "num_threads": threads_per_run,
+        "max_depth": max_depth,
+        "num_features": num_features,
+    }
+
+    if not getml.engine.is_monitor_alive():
+        getml.engine.launch()
+
+    cache_info = DATASET_CACHE.info()
+    estimates = {}
+    for name in datasets:
+        previous = read_checkpoint(output_path, name)
+        if previous is not None and (previous["status"] == "ok" or not retry_failed):
+            logger.info(
+                f"Skipping {name!r}, it is checkpointed as {previous['status']}."
+            )
+            continue
+        estimates[name] = estimate_memory(name, previous, cache_info)
+    pending = sorted(estimates, key=estimates.get, reverse=True)
+
+    context = multiprocessing.get_context("spawn")
+    running: Dict[str, Tuple[Any, float]] = {}
+    while pending or running:
+        used_memory = sum(estimates[name] for name in running)
+        for name in list(pending):
+            if threads_per_run * (len(running) + 1) > cores:
+                break
+            if running and used_memory + estimates[name] > memory_budget:
+                continue
+            checkpoint_path(output_path, name).unlink(missing_ok=True)
+            process = context.Process(
+                target=_run_and_checkpoint,
+                args=(name, output_path, run_kwargs),
+                name=f"runner-{to_snake(name)}",
+            )
+            process.start()
+            running[name] = (process, time.monotonic())
+            used_memory += estimates[name]
+            pending.remove(name)
+            logger.info(
+                f"Started {name!r} ({estimates[name] / 1024**3:.1f} GiB estimated, "
+                f"{len(running)} running, {len(pending)} pending)."
+            )
+
+        wait_timeout = None
+        if timeout is not None:
+            first_started = min(started for _, started in running.values())
+            wait_timeout = max(first_started + timeout - time.monotonic(), 0)
+        wait([process.sentinel for process, _ in running.values()], wait_timeout)
+
+        for name, (process, started) in list(running.items()):
+            if process.is_alive():
+                if timeout is None or time.monotonic() - started < timeout:
+                    continue
+                process.kill()
+                status = "timeout"
+            else:
+                status = "crashed"
+            process.join()
+            del running[name]
+            if read_checkpoint(output_path, name) is None:
+                # the process died (e.g. killed by the OOM killer) or timed out
+                # before it could checkpoint
+                write_checkpoint(
+                    output_path,
+                    name,
+                    {
+                        "dataset": name,
+                        **run_kwargs,
+                        "status": status,
+                        "error": f"exit code {process.exitcode}",
+                        # the peak memory of the process is unknown
+                        "memory_estimate": estimates[name],
+                        "seconds": time.monotonic() - started,
+                    },
+                )
+            logger.info(
+                f"Finished {name!r}: {read_checkpoint(output_path, name)['status']}."
+            )
+
+    return collect_results(output_path, datasets)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m ctu.utils.runner")
+    parser.add_argument("--datasets", nargs="+", default=PAPER_DATASETS)
+    parser.add_argument("--output", default="runner")
+    parser.add_argument("--cores", type=int, help="all cores by default")
+    parser.add_argument("--threads-per-run", type=int, default=DEFAULT_THREADS_PER_RUN)
+    parser.add_argument(
+        "--memory-gb",
+        type=float,
+        help=f"{MEMORY_SHARE:.0%} of the physical memory by default",
+    )
+    parser.add_argument("--timeout", type=float, help="per run, in seconds")
+    parser.add_argument(
+        "--no-retry-failed",
+        dest="retry_failed",
+        action="store_false",
+        help="skip datasets whose last run failed",
+    )
+    parser.add_argument("--max-depth", type=int, default=DEFAULT_MAX_DEPTH)
+    parser.add_argument("--num-features", type=int, default=DEFAULT_NUM_FEATURES)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(message)s")
+
+    results = run_datasets(
+        args.datasets,
+        args.output,
+        cores=args.cores,
+        threads_per_run=args.threads_per_run,
+        memory_budget=None if args.memory_gb is None else int(args.memory_gb * 1024**3),
+        timeout=args.timeout,
+        retry_failed=args.retry_failed,
+        max_depth=args.max_depth,
+        num_features=args.num_features,
+    )
+    with pd.option_context("display.width", None, "display.max_columns", None):
+        print(
+            results[
+                [
+                    column
+                    for column in ("dataset", "status", "metric", "score", "seconds")
+                    if column in results
+                ]
+            ].to_string(index=False)
+        )
+    logger.info(f"Results written to {str(Path(args.output) / RESULTS_FILE_NAME)!r}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import logging
+import sqlite3
+from contextlib import closing
+from copy import copy
+from pathlib import Path
+from typing import Any, List, Literal, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from ctu.utils.cache import DATASET_CACHE, DatasetCache
+from ctu.utils.data import permutation_split
+
+logger = logging.getLogger(__name__)
+
+RANDOM_SEED = 42
+
+Output = Literal["cache", "sqlite"]
+
+"""
+Number of rows inserted into SQLite per `executemany` call.
+"""
+SQLITE_CHUNK_SIZE = 50_000
+
+_SQLITE_TYPES = {"i": "INTEGER", "u": "INTEGER", "b": "INTEGER", "f": "REAL"}
+_SQLITE_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def synthetic_name(name: str, scale: float) -> str:
+    """
+    Name under which a synthetic version of a dataset is stored in the dataset cache,
+    e.g. `financial_x10`.
+    """
+    return f"{name}_x{scale:g}"
+
+
+def sample_rows(n_template: int, scale: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Draw the template rows of a scaled table: every template row `floor(scale)`
+    times plus a random sample without replacement for the fractional part, so the
+    distribution of the template is preserved at any scale.
+    """
+    whole, fraction = divmod(scale, 1)
+    n_extra = round(fraction * n_template)
+    rows = np.concatenate(
+        [
+            np.tile(np.arange(n_template), int(whole)),
+            rng.choice(n_template, n_extra, replace=False),
+        ]
+    )
+    return np.sort(rows)
+
+
+def _remap_keys(
+    values: pd.Series,
+    template_keys: pd.Index,
+    ref_rows: np.ndarray,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """
+    Map foreign key values of the template to the keys of the scaled referenced
+    table: each value references a random copy of the referenced template row, or a
+    random row if that row wasn't drawn. Nulls stay null.
+    """
+    positions = template_keys.get_indexer(values)
+    copies = np.argsort(ref_rows, kind="stable")
+    first = np.searchsorted(ref_rows, positions, side="left", sorter=copies)
+    n_copies = np.searchsorted(ref_rows, positions, side="right", sorter=copies) - first
+    offset = np.floor(rng.random(len(values)) * n_copies).astype(np.int64)
+    remapped = np.where(
+        n_copies > 0,
+        copies[np.minimum(first + offset, len(copies) - 1)],
+        rng.integers(0, max(len(ref_rows), 1), len(values)),
+    ).astype(np.float64)
+    remapped[(positions < 0) | values.isna().to_numpy()] = np.nan
+    return remapped
+
+
+def generate_dataset(
+    name: str,
+    scale: float,
+    seed: int = RANDOM_SEED,
+    cache: DatasetCache = DATASET_CACHE,
+) -> Tuple[Any, Any, Any]:
+    """
+    Generate a synthetic version of a dataset at `scale` times its size from its
+    entry in the dataset cache. The dataset must have been loaded once with
+    `load_ctu_dataset` to be in the cache (the cache directory can be copied to
+    air-gapped machines). Returns schema, defaults and database like
+    `DatasetCache.load`.
+
+    Rows are resampled from the template tables, so schema, column distributions,
+    task type and target column are those of the original dataset. Primary keys are
+    renumbered and foreign keys remapped to the scaled referenced tables, so all
+    joins stay consistent. The output is deterministic for a given `seed`.
+    """
+    if scale <= 0:
+        raise ValueError("scale must be greater than 0")
+
+    loaded = cache.load(name)
+    if loaded is None:
+        raise LookupError(
+            f"Dataset {name!r} is not in the dataset cache at {str(cache.root)!r}, "
+            "load it once with load_ctu_dataset to use it as a template."
+        )
+    schema, defaults, db = loaded
+
+    rng = np.random.default_rng(seed)
+    rows = {
+        table_name: sample_rows(len(table.df), scale, rng)
+        for table_name, table in sorted(db.table_dict.items())
+    }
+
+    synthetic_db = copy(db)
+    synthetic_db.table_dict = {}
+    for table_name, table in sorted(db.table_dict.items()):
+        df = table.df.iloc[rows[table_name]].reset_index(drop=True)
+        if table.pkey_col is not None:
+            df[table.pkey_col] = np.arange(
+                len(df), dtype=table.df[table.pkey_col].dtype
+            )
+        for fkey_col, ref_table_name in sorted(table.fkey_col_to_pkey_table.items()):
+            ref_table = db.table_dict[ref_table_name]
+            remapped = _remap_keys(
+                df[fkey_col],
+                pd.Index(ref_table.df[ref_table.pkey_col]),
+                rows[ref_table_name],
+                rng,
+            )
+            dtype = table.df[fkey_col].dtype
+            if np.isnan(remapped).any() and dtype.kind in "iu":
+                # integer columns can't hold the nulls
+                dtype = "Int64"
+            df[fkey_col] = pd.Series(remapped).astype(dtype)
+        synthetic_db.table_dict[table_name] = copy(table)
+        synthetic_db.table_dict[table_name].df = df
+        logger.info(
+            f"Generated {len(df)} rows of {table_name!r} "
+            f"({len(table.df)} in the template)."
+        )
+
+    return schema, defaults, synthetic_db
+
+
+def _sqlite_type(series: pd.Series) -> str:
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "DATETIME"
+    return _SQLITE_TYPES.get(series.dtype.kind, "TEXT")
+
+
+def _sqlite_values(series: pd.Series) -> List[Any]:
+    """
+    Convert a column to Python values SQLite can bind, with `None` for nulls.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        series = series.dt.strftime(_SQLITE_DATETIME_FORMAT)
+    values = series.astype(object).tolist()
+    if series.hasnans:
+        return [None if pd.isna(value) else value for value in values]
+    return values
+
+
+def write_sqlite(db: Any, path: Union[str, Path]) -> Path:
+    """
+    Write the tables of a dataset to a SQLite database with primary and foreign key
+    constraints, so it can be reflected like the relational database server (see
+    `CTU_DATABASE_URL` in `ctu.utils.data`).
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.unlink(missing_ok=True)
+    with closing(sqlite3.connect(path)) as conn, conn:
+        for table_name, table in sorted(db.table_dict.items()):
+            df = table.df.drop(columns="__filler", errors="ignore")
+            columns = [
+                f'"{column}" '
+                # nullable foreign keys are floats in pandas
+                + (
+                    "INTEGER"
+                    if column in table.fkey_col_to_pkey_table
+                    else _sqlite_type(df[column])
+                )
+                + (" PRIMARY KEY" if column == table.pkey_col else "")
+                for column in df.columns
+            ]
+            columns += [
+                f'FOREIGN KEY ("{fkey_col}") REFERENCES "{ref_table_name}" '
+                f'("{db.table_dict[ref_table_name].pkey_col}")'
+                for fkey_col, ref_table_name in sorted(
+                    table.fkey_col_to_pkey_table.items()
+                )
+            ]
+            conn.execute(f'CREATE TABLE "{table_name}" ({", ".join(columns)})')
+
+            insert = f'INSERT INTO "{table_name}" VALUES ({", ".join("?" * len(df.columns))})'
+            for start in range(0, len(df), SQLITE_CHUNK_SIZE):
+                chunk = df.iloc[start : start + SQLITE_CHUNK_SIZE]
+                conn.executemany(
+                    insert, zip(*(_sqlite_values(chunk[column]) for column in df))
+                )
+    return path
+
+
+def generate(
+    name: str,
+    scale: float,
+    output: Output = "cache",
+    path: Optional[Union[str, Path]] = None,
+    seed: int = RANDOM_SEED,
+    cache: DatasetCache = DATASET_CACHE,
+    share_val: float = 0.3,
+    share_test: float = 0.0,
+) -> Union[str, Path]:
+    """
+    Generate a synthetic version of a cached dataset (see `generate_dataset`) and
+    write it to:
+
+    - `"cache"`: the dataset cache as `synthetic_name(name, scale)`, so it loads
+      with `load_ctu_dataset(synthetic_name(name, scale))` without any network
+      access. Returns the name. The synthetic dataset isn't on the database server,
+      so its hetero graph can't be built: the `permutation_split` for `share_val`
+      and `share_test` is stored for both split methods instead, load it with
+      these shares.
+    - `"sqlite"`: a SQLite database at `path` (`<name>.sqlite` by default), point
+      the loaders at it with `CTU_DATABASE_URL=sqlite:///<dir>/{dataset}.sqlite`.
+    """
+    schema, defaults, db = generate_dataset(name, scale, seed, cache)
+    if output == "cache":
+        target = synthetic_name(name, scale)
+        cache.store(target, schema, defaults, db)
+        split = permutation_split(
+            len(db.table_dict[defaults.target_table].df), share_val, share_test
+        )
+        for method in ("hetero_data", "permutation"):
+            cache.store_split(target, share_val, share_test, split, method)
+        return target
+    if output == "sqlite":
+        return write_sqlite(db, path or f"{name}.sqlite")
+    raise ValueError(f"Unknown output {output!r}")
@@ -1,12 +1,21 @@
-import gc
 import logging
-from pathlib import Path
+from functools import lru_cache
 
 import lightgbm as lgb
 import optuna
-import pyarrow as pa
-import pyarrow.parquet as pq
-from sklearn.metrics import mean_absolute_error
+
+from relbench_utils.datasets import create_binary_dataset, create_subsample_datasets
+from relbench_utils.features import load_features
+from relbench_utils.scoring import Scorer
+from relbench_utils.streaming import ParquetSequence
+from relbench_utils.tuning import (
+    MULTI_FIDELITY_FRACTIONS,
+    LightGBMPruningCallback,
+    create_multi_fidelity_pruner,
+    create_pruner,
+    evaluate_multi_fidelity,
+    optimize_parallel,
+)
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(message)s")
@@ -14,113 +23,69 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(message)s")
 FEATURES_PARQUET_PATH_TEMPLATE = "hm_item_pipe_refined_{subset}_features.parquet"
 FEATURES_LGBM_BIN_PATH_TEMPLATE = "hm_item_pipe_refined_{subset}_features.bin"
 FEATURES_DROP_COLS = ["sales", "article_id", "timestamp"]
+# stream the features from parquet in batches instead of loading them into memory
+FEATURES_STREAMING = False
+FEATURES_BATCH_SIZE = 65_536
 
 LGBM_NUM_BOOST_ROUND = 2000
 LGBM_EARLY_STOPPING_ROUNDS = 50
 LGBM_LOG_EVALUATION_PERIOD = 0
 LGBM_VERBOSE_EVAL = False
 
+# the finished study the final model is trained from
 OPTUNA_STUDY_NAME = "opt-hm-item"
 OPTUNA_STORAGE_URL = f"sqlite:///{OPTUNA_STUDY_NAME}.db"
 
-################################################################################
-# 1. Load data and preprocess
-# ##############################################################################
-
-train_arrow = pq.read_table(
-    FEATURES_PARQUET_PATH_TEMPLATE.format(subset="train"), memory_map=True
-)
-val_arrow = pq.read_table(
-    FEATURES_PARQUET_PATH_TEMPLATE.format(subset="val"), memory_map=True
+# run a new study instead of loading the finished one
+OPTUNA_RETUNE = False
+# the finished study was tuned on the integer and float columns only, use the
+# string and boolean columns as well only when retuning
+FEATURES_NUMERICAL_ONLY = not OPTUNA_RETUNE
+# evaluate configurations on growing row subsamples of the training data and only
+# promote the best ones to the full data (successive halving), instead of pruning
+# by boosting round on the full data
+OPTUNA_MULTI_FIDELITY = True
+# the intermediate values of both modes aren't comparable, keep them in separate
+# studies
+OPTUNA_RETUNE_STUDY_NAME = (
+    "opt-hm-item-mf" if OPTUNA_MULTI_FIDELITY else "opt-hm-item-retune"
 )
-test_arrow = pq.read_table(
-    FEATURES_PARQUET_PATH_TEMPLATE.format(subset="test"), memory_map=True
-)
-
-
-def encode_categoricals(table):
-    categical_cols = []
-    for name in table.column_names:
-        if pa.types.is_dictionary(table.column(name).type):
-            table = table.append_column(
-                f"{name}_encoded",
-                pa.chunked_array(chunk.indices for chunk in table.column(name).chunks),
-            )
-            categical_cols.append(f"{name}_encoded")
-    return table, categical_cols
-
-
-def select_columns(table):
-    return table.select(
-        [
-            name
-            for name in table.column_names
-            if (
-                pa.types.is_integer(table.column(name).type)
-                or pa.types.is_floating(table.column(name).type)
-            )
-            and name not in FEATURES_DROP_COLS
-        ]
-    )
-
-
-X_train, categorical_cols = encode_categoricals(select_columns(train_arrow))
-y_train = train_arrow["sales"]
-
-X_val, _ = encode_categoricals(select_columns(val_arrow))
-y_val = val_arrow["sales"]
-
-X_test, _ = encode_categoricals(select_columns(test_arrow))
-y_test = test_arrow["sales"]
+OPTUNA_RETUNE_STORAGE_PATH = f"{OPTUNA_RETUNE_STUDY_NAME}.journal"
+OPTUNA_N_WORKERS = 4
+OPTUNA_FIDELITY_FRACTIONS = MULTI_FIDELITY_FRACTIONS
+OPTUNA_N_TRIALS = 150 if OPTUNA_MULTI_FIDELITY else 50
+OPTUNA_PRUNER = "successive_halving" if OPTUNA_MULTI_FIDELITY else "median"
 
-
-###############################################################################
-# 2. Create LightGBM datasets
-###############################################################################
+################################################################################
+# 1. Define objective function, run in the tuning worker processes
+# ##############################################################################
 
 
-def create_binary_dataset(X, y, categorical_cols, file_name, reference=None):
+@lru_cache(maxsize=None)
+def load_tuning_datasets():
     """
-    Create a LightGBM dataset as a binary dataset file. Manually free up memory
-    and return a pointer to the dataset file.
+    Load the binary train and validation datasets (and the train subsamples) the
+    main process created, once per worker.
     """
-    dataset = lgb.Dataset(
-        X,
-        label=y,
-        categorical_feature=categorical_cols,
+    train = lgb.Dataset(
+        FEATURES_LGBM_BIN_PATH_TEMPLATE.format(subset="train"), free_raw_data=False
+    )
+    val = lgb.Dataset(
+        FEATURES_LGBM_BIN_PATH_TEMPLATE.format(subset="val"),
+        reference=train,
         free_raw_data=False,
-        reference=reference,
     )
-    path = Path(file_name)
-    if path.exists():
-        path.unlink()
-    dataset.save_binary(path)
-    del dataset
-    gc.collect()
-    return lgb.Dataset(path, free_raw_data=False)
-
-
-train = create_binary_dataset(
-    X_train,
-    y_train,
-    categorical_cols,
-    FEATURES_LGBM_BIN_PATH_TEMPLATE.format(subset="train"),
-)
-val = create_binary_dataset(
-    X_val,
-    y_val,
-    categorical_cols,
-    FEATURES_LGBM_BIN_PATH_TEMPLATE.format(subset="val"),
-    reference=train,
-)
+    train_subsamples = (
+        create_subsample_datasets(train, OPTUNA_FIDELITY_FRACTIONS)
+        if OPTUNA_MULTI_FIDELITY
+        else None
+    )
+    return train, val, train_subsamples
 
 
-###############################################################################
-# 3. Define objective function
-# ##############################################################################
+def objective(trial, num_threads):
+    train, val, train_subsamples = load_tuning_datasets()
 
-
-def objective(trial):
     params = {
         "two_round": False,  # enable two_round loading for dataset two save memory
         "objective": "regression_l1",
@@ -128,6 +93,7 @@ def objective(trial):
         "verbosity": -1,
         "bagging_freq": 1,
         "feature_pre_filter": False,
+        "num_threads": num_threads,
         "max_depth": trial.suggest_int("max_depth", 3, 11),
         "learning_rate": trial.suggest_float("learning_rate", 1e-3, 0.1, log=True),
         "num_leaves": trial.suggest_int("num_leaves", 2, 1024),
@@ -138,21 +104,29 @@ def objective(trial):
         "min_data_in_leaf": trial.suggest_int("min_data_in_leaf", 1, 100),
     }
 
-    model = lgb.train(
-        params,
-        train,
-        num_boost_round=LGBM_NUM_BOOST_ROUND,
-        valid_sets=[val],
-        callbacks=[
-            lgb.early_stopping(
-                stopping_rounds=LGBM_EARLY_STOPPING_ROUNDS, verbose=True
-            ),
-            lgb.log_evaluation(period=LGBM_LOG_EVALUATION_PERIOD),
-        ],
-    )
-
-    pred_val = model.predict(X_val, num_iteration=model.best_iteration)
-    mae_val = mean_absolute_error(y_val, pred_val)
+    def evaluate(dataset, callbacks=()):
+        model = lgb.train(
+            params,
+            dataset,
+            num_boost_round=LGBM_NUM_BOOST_ROUND,
+            valid_sets=[val],
+            callbacks=[
+                *callbacks,
+                lgb.early_stopping(
+                    stopping_rounds=LGBM_EARLY_STOPPING_ROUNDS, verbose=True
+                ),
+                lgb.log_evaluation(period=LGBM_LOG_EVALUATION_PERIOD),
+            ],
+        )
+        # the early stopping already evaluated the MAE on the validation set
+        return model.best_score["valid_0"]["l1"]
+
+    if OPTUNA_MULTI_FIDELITY:
+        mae_val = evaluate_multi_fidelity(
+            trial, OPTUNA_FIDELITY_FRACTIONS, train_subsamples, evaluate
+        )
+    else:
+        mae_val = evaluate(train, callbacks=[LightGBMPruningCallback(trial, "l1")])
 
     logger.info(
         f"Trial {trial.number} finished with MAE={mae_val:.6f}, params={trial.params}"
@@ -161,63 +135,150 @@ def objective(trial):
     return mae_val
 
 
-###############################################################################
-# 4. Create or load an Optuna study from SQLite for resuming
-# ##############################################################################
-
-study = optuna.create_study(
-    study_name=OPTUNA_STUDY_NAME,
-    storage=OPTUNA_STORAGE_URL,
-    load_if_exists=True,
-    direction="minimize",
-)
-logger.info(f"Starting Optuna study {OPTUNA_STUDY_NAME!r}...")
-
-###############################################################################
-# 5. Run optimization
-# ##############################################################################
-
-# study.optimize(objective, n_trials=50)
-
-best_params = study.best_params
-best_params["objective"] = "regression_l1"
-best_params["metric"] = "mae"
-best_params["feature_pre_filter"] = False
+def main():
+    ############################################################################
+    # 2. Load data and preprocess
+    # ##########################################################################
+
+    if FEATURES_STREAMING:
+        X_train = ParquetSequence(
+            FEATURES_PARQUET_PATH_TEMPLATE.format(subset="train"),
+            label="sales",
+            drop_cols=FEATURES_DROP_COLS,
+            batch_size=FEATURES_BATCH_SIZE,
+            numerical_only=FEATURES_NUMERICAL_ONLY,
+        )
+        X_val, X_test = (
+            ParquetSequence(
+                FEATURES_PARQUET_PATH_TEMPLATE.format(subset=subset),
+                label="sales",
+                drop_cols=FEATURES_DROP_COLS,
+                encodings=X_train.encodings,
+                batch_size=FEATURES_BATCH_SIZE,
+                numerical_only=FEATURES_NUMERICAL_ONLY,
+            )
+            for subset in ("val", "test")
+        )
+        y_train, y_val, y_test = (X.labels() for X in (X_train, X_val, X_test))
+        categorical_cols = X_train.categorical_cols
+        encodings = X_train.encodings
+    else:
+        X_train, y_train, categorical_cols, encodings = load_features(
+            FEATURES_PARQUET_PATH_TEMPLATE.format(subset="train"),
+            label="sales",
+            drop_cols=FEATURES_DROP_COLS,
+            numerical_only=FEATURES_NUMERICAL_ONLY,
+        )
+        X_val, y_val, _, _ = load_features(
+            FEATURES_PARQUET_PATH_TEMPLATE.format(subset="val"),
+            label="sales",
+            drop_cols=FEATURES_DROP_COLS,
+            encodings=encodings,
+            numerical_only=FEATURES_NUMERICAL_ONLY,
+        )
+        X_test, y_test, _, _ = load_features(
+            FEATURES_PARQUET_PATH_TEMPLATE.format(subset="test"),
+            label="sales",
+            drop_cols=FEATURES_DROP_COLS,
+            encodings=encodings,
+            numerical_only=FEATURES_NUMERICAL_ONLY,
+        )
+
+    ############################################################################
+    # 3. Create LightGBM datasets, reusing the binary dataset files of a previous
+    #    run if the features didn't change
+    ############################################################################
+
+    train = create_binary_dataset(
+        X_train,
+        y_train,
+        categorical_cols,
+        FEATURES_LGBM_BIN_PATH_TEMPLATE.format(subset="train"),
+        source=FEATURES_PARQUET_PATH_TEMPLATE.format(subset="train"),
+        encodings=encodings,
+    )
+    val = create_binary_dataset(
+        X_val,
+        y_val,
+        categorical_cols,
+        FEATURES_LGBM_BIN_PATH_TEMPLATE.format(subset="val"),
+        reference=train,
+        source=FEATURES_PARQUET_PATH_TEMPLATE.format(subset="val"),
+        encodings=encodings,
+    )
 
-logger.info(f"Best trial found: {study.best_trial.number}")
-logger.info(f"Best params: {best_params}")
+    if OPTUNA_RETUNE and OPTUNA_MULTI_FIDELITY:
+        # nested subsamples of the binary train dataset, reused across runs and
+        # loaded by the workers
+        create_subsample_datasets(train, OPTUNA_FIDELITY_FRACTIONS)
 
-###############################################################################
-# 6. Final model training with best parameters
-# ##############################################################################
-
-final_model = lgb.train(
-    best_params,
-    train,
-    num_boost_round=LGBM_NUM_BOOST_ROUND,
-    valid_sets=[val],
-    callbacks=[
-        lgb.early_stopping(stopping_rounds=LGBM_EARLY_STOPPING_ROUNDS, verbose=True),
-        lgb.log_evaluation(period=LGBM_LOG_EVALUATION_PERIOD),
-    ],
-)
+    scorer = Scorer(
+        {"train": (X_train, y_train), "val": (X_val, y_val), "test": (X_test, y_test)}
+    )
 
-pred_test = final_model.predict(X_test, num_iteration=final_model.best_iteration)
-test_mae = mean_absolute_error(y_test, pred_test)
+    ############################################################################
+    # 4. Load the finished Optuna study from SQLite, or run a new study in
+    #    parallel worker processes sharing a journal file for resuming
+    # ##########################################################################
+
+    if OPTUNA_RETUNE:
+        study = optimize_parallel(
+            objective,
+            study_name=OPTUNA_RETUNE_STUDY_NAME,
+            direction="minimize",
+            n_trials=OPTUNA_N_TRIALS,
+            n_workers=OPTUNA_N_WORKERS,
+            storage_path=OPTUNA_RETUNE_STORAGE_PATH,
+            pruner=(
+                create_multi_fidelity_pruner(OPTUNA_PRUNER, OPTUNA_FIDELITY_FRACTIONS)
+                if OPTUNA_MULTI_FIDELITY
+                else create_pruner(OPTUNA_PRUNER)
+            ),
+        )
+    else:
+        study = optuna.load_study(
+            study_name=OPTUNA_STUDY_NAME, storage=OPTUNA_STORAGE_URL
+        )
+        logger.info(f"Loaded Optuna study {OPTUNA_STUDY_NAME!r}.")
+
+    best_params = study.best_params
+    best_params["objective"] = "regression_l1"
+    best_params["metric"] = "mae"
+    best_params["feature_pre_filter"] = False
+
+    logger.info(f"Best trial found: {study.best_trial.number}")
+    logger.info(f"Best params: {best_params}")
+
+    ############################################################################
+    # 5. Final model training with best parameters
+    # ##########################################################################
+
+    final_model = lgb.train(
+        best_params,
+        train,
+        num_boost_round=LGBM_NUM_BOOST_ROUND,
+        valid_sets=[val],
+        callbacks=[
+            lgb.early_stopping(
+                stopping_rounds=LGBM_EARLY_STOPPING_ROUNDS, verbose=True
+            ),
+            lgb.log_evaluation(period=LGBM_LOG_EVALUATION_PERIOD),
+        ],
+    )
 
-pred_val = final_model.predict(X_val, num_iteration=final_model.best_iteration)
-val_mae = mean_absolute_error(y_val, pred_val)
+    final_mae = scorer.scores(final_model, "l1")
 
-pred_train = final_model.predict(X_train, num_iteration=final_model.best_iteration)
-train_mae = mean_absolute_error(y_train, pred_train)
+    # Print final result to log
+    logger.info(f"Final model Train MAE: {final_mae['train']:.6f}")
+    logger.info(f"Final model Val MAE: {final_mae['val']:.6f}")
+    logger.info(f"Final model Test MAE: {final_mae['test']:.6f}")
 
+    ############################################################################
+    # 6. Script end
+    # ##########################################################################
+    logger.info("Study completed.")
 
-# Print final result to log
-logger.info(f"Final model Train MAE: {train_mae:.6f}")
-logger.info(f"Final model Val MAE: {val_mae:.6f}")
-logger.info(f"Final model Test MAE: {test_mae:.6f}")
 
-###############################################################################
-# 7. Script end
-# ##############################################################################
-logger.info("Study completed.")
+# the tuning workers import this script again, only the main process runs it
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+import gc
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from relbench_utils.features import Encodings
+
+logger = logging.getLogger(__name__)
+
+RANDOM_SEED = 42
+
+"""
+Features in memory or a sequence streaming them, which must provide `schema` and
+`feature_names` (see `relbench_utils.streaming.ParquetSequence`).
+"""
+Features = Union[pa.Table, pd.DataFrame, lgb.Sequence]
+Labels = Union[pa.ChunkedArray, pd.Series, np.ndarray]
+
+
+def source_fingerprint(path: Union[str, Path]) -> List[Tuple[str, int, int]]:
+    """
+    Identify a feature file (or a directory of part files) by the names, sizes and
+    modification times of its files.
+    """
+    path = Path(path)
+    files = (
+        sorted(f for f in path.rglob("*") if f.is_file()) if path.is_dir() else [path]
+    )
+    return [
+        (
+            str(f.relative_to(path) if path.is_dir() else f.name),
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
+        for f, stat in ((f, f.stat()) for f in files)
+    ]
+
+
+def _schema(X: Features) -> List[Tuple[str, str]]:
+    if isinstance(X, (pa.Table, lgb.Sequence)):
+        return [(field.name, str(field.type)) for field in X.schema]
+    return [(str(name), str(dtype)) for name, dtype in X.dtypes.items()]
+
+
+def data_fingerprint(X: Features, y: Labels) -> str:
+    """
+    Hash the values of features and labels, identifying data that wasn't read from
+    a feature file.
+    """
+    digest = hashlib.sha256()
+    if isinstance(X, pa.Table):
+        for batch in X.to_batches():
+            digest.update(batch.serialize())
+    elif isinstance(X, pd.DataFrame):
+        digest.update(pd.util.hash_pandas_object(X, index=False).to_numpy())
+    elif hasattr(X, "iter_batches"):
+        for batch in X.iter_batches():
+            digest.update(np.ascontiguousarray(batch))
+    else:
+        for start in range(0, len(X), X.batch_size):
+            digest.update(np.ascontiguousarray(X[start : start + X.batch_size]))
+    digest.update(pd.util.hash_array(np.asarray(y)))
+    return digest.hexdigest()
+
+
+def _encodings_spec(encodings: Optional[Encodings]) -> Optional[Dict[str, Any]]:
+    if encodings is None:
+        return None
+    return {
+        name: [
+            encoding.kind,
+            None if encoding.dictionary is None else encoding.dictionary.to_pylist(),
+        ]
+        for name, encoding in encodings.items()
+    }
+
+
+def binary_dataset_fingerprint(
+    X: Features,
+    y: Labels,
+    categorical_cols: Sequence[str],
+    source: Optional[Union[str, Path]] = None,
+    params: Optional[Dict[str, Any]] = None,
+    reference: Optional[str] = None,
+    encodings: Optional[Encodings] = None,
+) -> str:
+    """
+    Fingerprint the inputs of a LightGBM dataset: the source feature file (or the
+    values of the data if there is none), the selected columns and their types, the
+    categorical encodings, the dataset params and the fingerprint of the reference
+    dataset (for val/test).
+    """
+    spec = {
+        "source": (
+            data_fingerprint(X, y) if source is None else source_fingerprint(source)
+        ),
+        "schema": _schema(X),
+        "n_rows": len(X),
+        "label": [str(getattr(y, "name", None)), str(getattr(y, "type", None)), len(y)],
+        "categorical_cols": list(categorical_cols),
+        "encodings": _encodings_spec(encodings),
+        "params": params or {},
+        "reference": reference,
+        "lightgbm": lgb.__version__,
+    }
+    return hashlib.sha256(
+        json.dumps(spec, sort_keys=True, default=str).encode()
+    ).hexdigest()[:16]
+
+
+def _sidecar_path(path: Path) -> Path:
+    return path.with_name(f"{path.name}.json")
+
+
+def read_fingerprint(path: Union[str, Path]) -> Optional[str]:
+    """
+    Return the fingerprint of a binary dataset file, `None` if there is none.
+    """
+    path = Path(path)
+    sidecar = _sidecar_path(path)
+    if not path.exists() or not sidecar.exists():
+        return None
+    return json.loads(sidecar.read_text())["fingerprint"]
+
+
+def _save_binary(dataset: lgb.Dataset, path: Path, meta: Dict[str, Any]) -> None:
+    """
+    Save a dataset as a binary dataset file atomically, followed by its sidecar.
+    """
+    _sidecar_path(path).unlink(missing_ok=True)
+    tmp_path = path.with_name(f".tmp-{path.name}-{os.getpid()}")
+    dataset.save_binary(tmp_path)
+    os.replace(tmp_path, path)
+    _sidecar_path(path).write_text(json.dumps(meta, indent=2))
+
+
+def create_binary_dataset(
+    X: Features,
+    y: Labels,
+    categorical_cols: Sequence[str],
+    file_name: Union[str, Path],
+    reference: Optional[lgb.Dataset] = None,
+    source: Optional[Union[str, Path]] = None,
+    params: Optional[Dict[str, Any]] = None,
+    encodings: Optional[Encodings] = None,
+) -> lgb.Dataset:
+    """
+    Create a LightGBM dataset as a binary dataset file and return a dataset backed
+    by that file.
+
+    The file is reused as long as the fingerprint of its inputs (see
+    `binary_dataset_fingerprint`), stored in a `<file_name>.json` sidecar, matches.
+    `source` is the feature file `X` was read from, `reference` a dataset returned
+    by this function whose bin mappers are reused (the train dataset for val/test)
+    and `encodings` the categorical encodings `X` was encoded with (taken from `X`
+    for a `ParquetSequence`).
+    """
+    path = Path(file_name)
+    reference_fingerprint = (
+        read_fingerprint(reference.data)
+        if reference is not None and isinstance(reference.data, (str, Path))
+        else None
+    )
+    if encodings is None:
+        encodings = getattr(X, "encodings", None)
+    fingerprint = binary_dataset_fingerprint(
+        X, y, categorical_cols, source, params, reference_fingerprint, encodings
+    )
+
+    if read_fingerprint(path) == fingerprint:
+        logger.info(f"Reusing binary dataset {str(path)!r} ({fingerprint}).")
+    else:
+        logger.info(f"Creating binary dataset {str(path)!r} ({fingerprint})...")
+        dataset = lgb.Dataset(
+            X,
+            label=y,
+            feature_name=getattr(X, "feature_names", "auto"),
+            categorical_feature=list(categorical_cols),
+            params=params,
+            free_raw_data=False,
+            reference=reference,
+        )
+        _save_binary(
+            dataset,
+            path,
+            {
+                "fingerprint": fingerprint,
+                "source": str(source),
+                "reference": reference_fingerprint,
+            },
+        )
+        # manually free up the memory of the constructed dataset
+        del dataset
+        gc.collect()
+
+    return lgb.Dataset(path, params=params, reference=reference, free_raw_data=False)
+
+
+def subsample_rows(n_rows: int, fraction: float, seed: int = RANDOM_SEED) -> np.ndarray:
+    """
+    Draw the sorted row indices of a `fraction` of `n_rows` rows. Subsamples drawn
+    with the same seed are nested: a smaller fraction is a subset of a larger one.
+    """
+    permutation = np.random.default_rng(seed).permutation(n_rows)
+    return np.sort(permutation[: max(1, round(fraction * n_rows))])
+
+
+def subsample_path(path: Union[str, Path], fraction: float) -> Path:
+    path = Path(path)
+    return path.with_name(f"{path.stem}.{fraction:.4g}{path.suffix}")
+
+
+def create_subsample_datasets(
+    dataset: lgb.Dataset,
+    fractions: Sequence[float],
+    seed: int = RANDOM_SEED,
+    params: Optional[Dict[str, Any]] = None,
+) -> List[lgb.Dataset]:
+    """
+    Create LightGBM datasets of nested row subsamples (see `subsample_rows`) of a
+    dataset returned by `create_binary_dataset`, one per fraction. A fraction of 1
+    returns the dataset itself.
+
+    The subsamples share the bin mappers of the full dataset, so validation sets
+    created with the full dataset as reference can be used with all of them. They
+    are stored as binary dataset files next to the full one
+    (`<stem>.<fraction><suffix>`) and reused as long as the full dataset and the
+    seed are unchanged.
+    """
+    path = Path(dataset.data) if isinstance(dataset.data, (str, Path)) else None
+    fingerprint = None if path is None else read_fingerprint(path)
+    if fingerprint is None:
+        raise ValueError("dataset must be backed by a file from create_binary_dataset")
+
+    datasets = []
+    for fraction in fractions:
+        if fraction >= 1:
+            datasets.append(dataset)
+            continue
+        subset_path = subsample_path(path, fraction)
+        subset_fingerprint = hashlib.sha256(
+            json.dumps([fingerprint, fraction, seed]).encode()
+        ).hexdigest()[:16]
+        if read_fingerprint(subset_path) == subset_fingerprint:
+            logger.info(f"Reusing subsample {str(subset_path)!r} ({fraction:.4g}).")
+        else:
+            logger.info(f"Creating subsample {str(subset_path)!r} ({fraction:.4g})...")
+            dataset.construct()
+            subset = dataset.subset(
+                subsample_rows(dataset.num_data(), fraction, seed)
+            ).construct()
+            _save_binary(
+                subset,
+                subset_path,
+                {
+                    "fingerprint": subset_fingerprint,
+                    "source": str(path),
+                    "fraction": fraction,
+                    "seed": seed,
+                },
+            )
+            del subset
+            gc.collect()
+        datasets.append(
+            lgb.Dataset(
+                subset_path, params=params, reference=dataset, free_raw_data=False
+            )
+        )
+    return datasets
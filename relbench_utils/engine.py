@@ -0,0 +1,178 @@
+import logging
+import os
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Union
+
+import getml
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+"""
+Bytes per value of a column in the engine: numerical columns and time stamps are
+stored as doubles, categoricals and join keys as encoded integers. The strings
+behind the codes (and text columns) come on top, see `TableFootprint`.
+"""
+BYTES_PER_VALUE = 8
+
+DEFAULT_NUM_FEATURES = 200
+
+"""
+Factor on the estimated footprint covering intermediate results of the feature
+learners and predictors.
+"""
+MEMORY_HEADROOM = 1.5
+
+_CGROUP_MEMORY_MAX = Path("/sys/fs/cgroup/memory.max")
+
+
+class TableFootprint(NamedTuple):
+    """
+    Size of a table: `BYTES_PER_VALUE` per value plus `string_bytes`, the size of
+    the data of its string columns, if known.
+    """
+
+    name: str
+    rows: int
+    columns: int
+    string_bytes: int = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.rows * self.columns * BYTES_PER_VALUE + self.string_bytes
+
+
+class EngineFootprint(NamedTuple):
+    tables: int
+    features: int
+
+    @property
+    def nbytes(self) -> int:
+        return int((self.tables + self.features) * MEMORY_HEADROOM)
+
+
+Table = Union[str, Path, TableFootprint]
+
+
+def parquet_footprint(path: Union[str, Path]) -> TableFootprint:
+    """
+    Read the number of rows and columns of a Parquet file from its metadata, and the
+    uncompressed size of its string columns, which bounds the size of their
+    dictionaries (or text) in the engine.
+    """
+    metadata = pq.ParquetFile(path).metadata
+    string_columns = [
+        i
+        for i in range(metadata.num_columns)
+        if metadata.schema.column(i).physical_type == "BYTE_ARRAY"
+    ]
+    string_bytes = sum(
+        metadata.row_group(row_group).column(i).total_uncompressed_size
+        for row_group in range(metadata.num_row_groups)
+        for i in string_columns
+    )
+    return TableFootprint(
+        Path(path).stem, metadata.num_rows, metadata.num_columns, string_bytes
+    )
+
+
+def reldb_footprints(
+    url: str, tables: Optional[Iterable[str]] = None
+) -> List[TableFootprint]:
+    """
+    Count the rows and columns of the tables of a relational database, e.g. the CTU
+    database server (see `RelDBDataset.get_url` in `ctu.utils.data`). The size of
+    string data isn't known without scanning the tables, string columns count with
+    `BYTES_PER_VALUE` like all others.
+    """
+    import sqlalchemy as sa
+
+    engine = sa.create_engine(url)
+    metadata = sa.MetaData()
+    metadata.reflect(engine, only=None if tables is None else list(tables))
+    footprints = []
+    with engine.connect() as conn:
+        for name, sql_table in sorted(metadata.tables.items()):
+            rows = conn.execute(sa.select(sa.func.count()).select_from(sql_table))
+            footprints.append(
+                TableFootprint(name, rows.scalar_one(), len(sql_table.columns))
+            )
+    engine.dispose()
+    return footprints
+
+
+def _footprint(table: Table) -> TableFootprint:
+    if isinstance(table, TableFootprint):
+        return table
+    return parquet_footprint(table)
+
+
+def estimate_footprint(
+    population: Sequence[Table],
+    peripheral: Sequence[Table] = (),
+    num_features: int = DEFAULT_NUM_FEATURES,
+) -> EngineFootprint:
+    """
+    Estimate the memory the engine needs for the population (e.g. the train,
+    validation and test tables) and peripheral tables, given as Parquet files or
+    row and column counts, plus the `num_features` FastProp features generated for
+    every population row.
+    """
+    population = [_footprint(table) for table in population]
+    peripheral = [_footprint(table) for table in peripheral]
+    return EngineFootprint(
+        tables=sum(table.nbytes for table in population + peripheral),
+        features=sum(table.rows for table in population)
+        * num_features
+        * BYTES_PER_VALUE,
+    )
+
+
+def available_memory() -> int:
+    """
+    Return the memory available to new processes, limited by the cgroup of the
+    process (e.g. a docker container).
+    """
+    available = os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass
+    try:
+        limit = _CGROUP_MEMORY_MAX.read_text().strip()
+    except OSError:
+        limit = "max"
+    if limit != "max":
+        available = min(available, int(limit))
+    return available
+
+
+def launch_engine(
+    population: Sequence[Table],
+    peripheral: Sequence[Table] = (),
+    num_features: int = DEFAULT_NUM_FEATURES,
+    available: Optional[int] = None,
+    **launch_kwargs,
+) -> bool:
+    """
+    Launch the getML engine in memory if the estimated footprint (see
+    `estimate_footprint`) fits into the available memory, memory-mapped otherwise.
+    Returns whether the engine runs in memory.
+    """
+    footprint = estimate_footprint(population, peripheral, num_features)
+    if available is None:
+        available = available_memory()
+    in_memory = footprint.nbytes <= available
+    logger.info(
+        f"Estimated engine footprint: {footprint.nbytes / 1024**3:.1f} GiB "
+        f"({footprint.tables / 1024**3:.1f} GiB tables, "
+        f"{footprint.features / 1024**3:.1f} GiB features), "
+        f"{available / 1024**3:.1f} GiB available: launching "
+        f"{'in memory' if in_memory else 'memory-mapped'}."
+    )
+    getml.engine.launch(in_memory=in_memory, **launch_kwargs)
+    return in_memory
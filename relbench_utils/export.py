@@ -0,0 +1,195 @@
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Union,
+)
+
+import getml
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100_000
+DEFAULT_ROW_GROUP_SIZE = 500_000
+DEFAULT_COMPRESSION = "snappy"
+
+"""
+Number of batches buffered between two stages of the export. Bounds the memory
+used by batches that were retrieved from the engine but not written yet.
+"""
+DEFAULT_QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+class ExportReport(NamedTuple):
+    path: Path
+    rows: int
+    nbytes: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else float("inf")
+
+    def __str__(self) -> str:
+        return (
+            f"Exported {self.rows} rows ({self.nbytes / 1024**2:.1f} MiB) to "
+            f"{str(self.path)!r} in {self.seconds:.1f}s "
+            f"({self.rows_per_second:.0f} rows/s)."
+        )
+
+
+class _Stage(threading.Thread):
+    """
+    A pipeline stage applying `fn` to the items of an iterable and putting the
+    results into a bounded queue. Exceptions are passed on to the consumer.
+    """
+
+    def __init__(self, items: Iterable[Any], fn: Callable[[Any], Any], maxsize: int):
+        super().__init__(daemon=True)
+        self.items = items
+        self.fn = fn
+        self.queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        try:
+            for item in self.items:
+                if self.stopped.is_set():
+                    return
+                self.queue.put(self.fn(item))
+            self.queue.put(_DONE)
+        except BaseException as exc:
+            self.queue.put(exc)
+
+    def __iter__(self) -> Iterator[Any]:
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    def stop(self) -> None:
+        self.stopped.set()
+        # unblock a producer waiting on a full queue
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+
+def _iter_row_groups(
+    tables: Iterable[pa.Table], row_group_size: int
+) -> Iterator[pa.Table]:
+    """
+    Regroup a stream of tables into tables of `row_group_size` rows.
+    """
+    buffer, n_rows = [], 0
+    for table in tables:
+        buffer.append(table)
+        n_rows += table.num_rows
+        while n_rows >= row_group_size:
+            combined = pa.concat_tables(buffer)
+            yield combined.slice(0, row_group_size)
+            rest = combined.slice(row_group_size)
+            buffer, n_rows = [rest], rest.num_rows
+    if n_rows:
+        yield pa.concat_tables(buffer)
+
+
+def export_features(
+    pipe: getml.Pipeline,
+    population: Any,
+    name: str,
+    path: Optional[Union[str, Path]] = None,
+    peripheral: Optional[Dict[str, Any]] = None,
+    columns: Optional[Sequence[str]] = None,
+    metadata: Optional[pa.Table] = None,
+    join_keys: Optional[Sequence[str]] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    compression: Optional[str] = DEFAULT_COMPRESSION,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+) -> ExportReport:
+    """
+    Transform a population (e.g. a container subset) with a fitted pipeline and
+    export the features to a Parquet file (`<name>.parquet` by default). Pass
+    `peripheral` to transform a population data frame or view with explicit
+    peripheral tables instead of a container subset.
+
+    Retrieving batches from the engine, joining `metadata` on `join_keys` and
+    writing run as pipelined stages connected by queues of `queue_size` batches, so
+    the engine doesn't wait for the disk and memory stays bounded. `columns`
+    restricts the exported feature columns. The file is written to a temporary
+    path and renamed when complete, so readers never see a partial export.
+    """
+    if metadata is not None and not join_keys:
+        raise ValueError("join_keys are required to join metadata")
+
+    path = Path(path or f"{name}.parquet")
+    tmp_path = path.with_name(f".tmp-{path.name}-{os.getpid()}")
+    start = time.perf_counter()
+
+    logger.info(f"Transforming {name!r}...")
+    if peripheral is None:
+        features = pipe.transform(population, df_name=name)
+    else:
+        features = pipe.transform(population, peripheral, df_name=name)
+
+    def retrieve(batch: Any) -> pa.Table:
+        table = batch.to_arrow()
+        return table if columns is None else table.select(columns)
+
+    def join(table: pa.Table) -> pa.Table:
+        if metadata is None:
+            return table
+        return table.join(metadata, list(join_keys))
+
+    retrieved = _Stage(
+        features.iter_batches(batch_size=batch_size), retrieve, queue_size
+    )
+    joined = _Stage(retrieved, join, queue_size)
+    retrieved.start()
+    joined.start()
+
+    writer, rows = None, 0
+    try:
+        for row_group in _iter_row_groups(joined, row_group_size):
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    tmp_path, row_group.schema, compression=compression
+                )
+            writer.write_table(row_group.cast(writer.schema), row_group_size)
+            rows += row_group.num_rows
+        if writer is None:
+            # nothing to export, still write a file with the feature schema
+            writer = pq.ParquetWriter(
+                tmp_path, join(retrieve(features[:0])).schema, compression=compression
+            )
+        writer.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        joined.stop()
+        retrieved.stop()
+        if writer is not None:
+            writer.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    report = ExportReport(path, rows, path.stat().st_size, time.perf_counter() - start)
+    logger.info(str(report))
+    return report
@@ -0,0 +1,482 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import getml
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from relbench_utils.export import export_features
+
+logger = logging.getLogger(__name__)
+
+FEATURE_STORE_DIR = Path(os.environ.get("RELBENCH_FEATURE_STORE_DIR", "feature_store"))
+
+FEATURE_STORE_FORMAT_VERSION = 2
+
+"""
+Number of rows retrieved from the engine at once when hashing the data of a frame.
+"""
+FINGERPRINT_BATCH_SIZE = 100_000
+
+_META = "meta.json"
+
+# content hashes by data frame and time of its last change, so a data frame is only
+# hashed once per session while it doesn't change
+_content_hashes: Dict[Any, str] = {}
+
+
+def _decode(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """
+    Decode dictionary columns, whose codes depend on the order in which the engine
+    encountered the categories.
+    """
+    return pa.RecordBatch.from_arrays(
+        [
+            column.dictionary_decode()
+            if pa.types.is_dictionary(column.type)
+            else column
+            for column in batch.columns
+        ],
+        names=batch.schema.names,
+    )
+
+
+def content_hash(df: Any, batch_size: int = FINGERPRINT_BATCH_SIZE) -> str:
+    """
+    Hash the values of a getML data frame or view, retrieved from the engine in
+    batches of `batch_size` rows.
+    """
+    # views (e.g. container subsets) don't identify their rows by name, only data
+    # frames are memoized
+    memo_key = (
+        (df.name, df.last_change, repr(df.roles))
+        if isinstance(df, getml.data.DataFrame)
+        else None
+    )
+    if memo_key in _content_hashes:
+        return _content_hashes[memo_key]
+
+    digest = hashlib.sha256()
+    n_rows = df.shape[0]
+    for start in range(0, n_rows, batch_size):
+        for batch in (
+            df[start : min(start + batch_size, n_rows)].to_arrow().to_batches()
+        ):
+            digest.update(_decode(batch).serialize())
+    content = digest.hexdigest()
+
+    if memo_key is not None:
+        _content_hashes[memo_key] = content
+    return content
+
+
+def frame_fingerprint(df: Any) -> Dict[str, Any]:
+    """
+    Identify the data of a getML data frame or view by its name, shape, roles and a
+    hash of its values (see `content_hash`), so frames rebuilt from the same data
+    in a new session have the same fingerprint.
+    """
+    return {
+        "name": getattr(df, "name", None),
+        "shape": list(df.shape),
+        "roles": repr(getattr(df, "roles", None)),
+        "data": content_hash(df),
+    }
+
+
+def population_fingerprint(population: Any) -> Dict[str, Any]:
+    """
+    Fingerprint a population: a container subset with its peripheral tables or a
+    single data frame.
+    """
+    if hasattr(population, "peripheral"):
+        return {
+            "population": frame_fingerprint(population.population),
+            "peripheral": {
+                name: frame_fingerprint(df)
+                for name, df in sorted(population.peripheral.items())
+            },
+        }
+    return {"population": frame_fingerprint(population), "peripheral": {}}
+
+
+def pipeline_definition(pipe: getml.Pipeline) -> Dict[str, str]:
+    """
+    Describe what a pipeline learns, independent of whether and when it was fitted.
+    """
+    return {
+        attr: repr(getattr(pipe, attr, None))
+        for attr in (
+            "data_model",
+            "preprocessors",
+            "feature_learners",
+            "feature_selectors",
+            "predictors",
+            "loss_function",
+            "share_selected_features",
+            "include_categorical",
+        )
+    }
+
+
+def pipeline_key(pipe: getml.Pipeline, population: Any) -> str:
+    """
+    Derive the cache key of a fitted pipeline from its definition and the data it
+    is fitted on.
+    """
+    return _hash(
+        {
+            "format_version": FEATURE_STORE_FORMAT_VERSION,
+            "definition": pipeline_definition(pipe),
+            "data": population_fingerprint(population),
+        }
+    )
+
+
+def _export_spec(pipe: getml.Pipeline, export_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "format_version": FEATURE_STORE_FORMAT_VERSION,
+        "pipeline": pipe.id,
+        "data_model": repr(pipe.data_model),
+        "export": {
+            name: value
+            for name, value in export_kwargs.items()
+            if name in ("columns", "join_keys")
+        },
+        "metadata": (
+            None
+            if export_kwargs.get("metadata") is None
+            else export_kwargs["metadata"].schema.to_string()
+        ),
+    }
+
+
+def _hash(spec: Dict[str, Any]) -> str:
+    return hashlib.sha256(
+        json.dumps(spec, sort_keys=True, default=str).encode()
+    ).hexdigest()[:16]
+
+
+def feature_key(pipe: getml.Pipeline, population: Any, **export_kwargs: Any) -> str:
+    """
+    Derive the cache key of a transformed population from the pipeline, its data
+    model, the data and the export options.
+    """
+    return _hash(
+        {
+            **_export_spec(pipe, export_kwargs),
+            "data": population_fingerprint(population),
+        }
+    )
+
+
+def incremental_key(pipe: getml.Pipeline, **export_kwargs: Any) -> str:
+    """
+    Derive the cache key of incrementally transformed features. Unlike
+    `feature_key`, it doesn't depend on the data, which grows between runs.
+    """
+    return "incremental-" + _hash(_export_spec(pipe, export_kwargs))
+
+
+def _part_name(index: int) -> str:
+    return f"part-{index:05d}.parquet"
+
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def _write_meta(entry_dir: Path, meta: Dict[str, Any]) -> None:
+    tmp_path = entry_dir / f".tmp-{_META}-{os.getpid()}"
+    tmp_path.write_text(json.dumps(meta, indent=2, default=str))
+    os.replace(tmp_path, entry_dir / _META)
+
+
+class FeatureStore:
+    """
+    A persistent cache of fitted pipelines and transformed feature tables.
+
+    Fitted pipelines are recorded in `<root>/pipelines/<key>.json` by their
+    definition and training data (see `pipeline_key`) and reloaded from the getML
+    project, so unchanged pipelines are not refitted.
+
+    Feature tables live in `<root>/features/<name>/<key>`, where the key is derived
+    from the pipeline id, the data model and a fingerprint of the population and
+    peripheral tables (see `feature_key`). An entry holds the features as Parquet
+    part files (`part-NNNNN.parquet`) and a `meta.json` recording how they were
+    produced.
+
+    Incrementally transformed feature tables (see `transform_incremental`) live in
+    `<root>/features/<name>/incremental-<key>` and grow by one part file per run.
+    """
+
+    def __init__(self, root: Union[str, Path] = FEATURE_STORE_DIR):
+        self.root = Path(root)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(root={str(self.root)!r})"
+
+    def entry_dir(self, name: str, key: str) -> Path:
+        return self.root / "features" / name / key
+
+    def fit(
+        self, pipe: getml.Pipeline, population: Any, **fit_kwargs: Any
+    ) -> getml.Pipeline:
+        """
+        Fit a pipeline on a population, unless a pipeline with the same definition
+        was already fitted on the same data and is still in the getML project, and
+        return the fitted pipeline.
+        """
+        record_path = self.root / "pipelines" / f"{pipeline_key(pipe, population)}.json"
+        if record_path.exists():
+            pipeline_id = json.loads(record_path.read_text())["pipeline"]
+            if getml.pipeline.exists(pipeline_id):
+                logger.info(f"Reusing fitted pipeline {pipeline_id!r}.")
+                return getml.pipeline.load(pipeline_id)
+            logger.info(f"Fitted pipeline {pipeline_id!r} no longer exists, refitting.")
+
+        pipe.fit(population, **fit_kwargs)
+        record = {
+            "pipeline": pipe.id,
+            "definition": pipeline_definition(pipe),
+            "data": population_fingerprint(population),
+            "created": _now(),
+        }
+        record_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = record_path.with_name(f".tmp-{record_path.name}-{os.getpid()}")
+        tmp_path.write_text(json.dumps(record, indent=2, default=str))
+        os.replace(tmp_path, record_path)
+        return pipe
+
+    def get(
+        self, pipe: getml.Pipeline, population: Any, name: str, **export_kwargs: Any
+    ) -> Optional[Path]:
+        """
+        Return the entry of a transformed population, `None` on a cache miss.
+        """
+        entry_dir = self.entry_dir(name, feature_key(pipe, population, **export_kwargs))
+        if not (entry_dir / _META).exists():
+            return None
+        return entry_dir
+
+    def transform(
+        self,
+        pipe: getml.Pipeline,
+        population: Any,
+        name: str,
+        path: Optional[Union[str, Path]] = None,
+        **export_kwargs: Any,
+    ) -> Path:
+        """
+        Transform a population with a fitted pipeline (see `export_features`),
+        unless the features are already cached, and return the entry directory.
+        With `path`, the features are also materialized as a single Parquet file
+        there.
+        """
+        key = feature_key(pipe, population, **export_kwargs)
+        entry_dir = self.entry_dir(name, key)
+
+        if (entry_dir / _META).exists():
+            logger.info(f"Reusing features {name!r} from {str(entry_dir)!r}.")
+        else:
+            entry_dir.parent.mkdir(parents=True, exist_ok=True)
+            tmp_dir = entry_dir.with_name(f".tmp-{key}-{os.getpid()}")
+            tmp_dir.mkdir()
+            try:
+                report = export_features(
+                    pipe,
+                    population,
+                    name,
+                    path=tmp_dir / _part_name(0),
+                    **export_kwargs,
+                )
+                meta = {
+                    "format_version": FEATURE_STORE_FORMAT_VERSION,
+                    "name": name,
+                    "key": key,
+                    "pipeline": pipe.id,
+                    "data_model": repr(pipe.data_model),
+                    "data": population_fingerprint(population),
+                    "created": _now(),
+                    "rows": report.rows,
+                }
+                _write_meta(tmp_dir, meta)
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.replace(tmp_dir, entry_dir)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        if path is not None:
+            self.materialize(entry_dir, path)
+        return entry_dir
+
+    def transform_incremental(
+        self,
+        pipe: getml.Pipeline,
+        population: Any,
+        name: str,
+        time_stamp: str,
+        peripheral: Dict[str, Any],
+        peripheral_time_stamps: Dict[str, str],
+        memory: float,
+        path: Optional[Union[str, Path]] = None,
+        **export_kwargs: Any,
+    ) -> Path:
+        """
+        Transform only the rows of a population data frame whose `time_stamp` is
+        newer than the newest row of the previous run and append their features to
+        the entry as a new part file. The first run transforms all rows.
+
+        Peripheral tables with a time stamp column in `peripheral_time_stamps` are
+        restricted to the rows inside the `memory` window (in seconds, e.g.
+        `getml.data.time.weeks(6)`) of the new population rows, the data model's
+        memory of the joins on these tables must not be longer. Other peripheral
+        tables are passed on unchanged.
+
+        Population rows arriving later with a time stamp that is not newer than the
+        previous run are not transformed, so snapshots must be appended in order.
+        """
+        entry_dir = self.entry_dir(name, incremental_key(pipe, **export_kwargs))
+        meta_path = entry_dir / _META
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+        else:
+            entry_dir.mkdir(parents=True, exist_ok=True)
+            meta = {
+                "format_version": FEATURE_STORE_FORMAT_VERSION,
+                "name": name,
+                "key": entry_dir.name,
+                "pipeline": pipe.id,
+                "data_model": repr(pipe.data_model),
+                "created": _now(),
+                "rows": 0,
+                "watermark": None,
+                "runs": [],
+            }
+
+        new_rows = population
+        if meta["watermark"] is not None:
+            new_rows = population[population[time_stamp] > meta["watermark"]]
+        n_rows = new_rows.nrows()
+        if not n_rows:
+            logger.info(f"No population rows newer than the last run of {name!r}.")
+        else:
+            start = new_rows[time_stamp].min() - memory
+            windowed = {
+                table_name: (
+                    df[df[peripheral_time_stamps[table_name]] >= start]
+                    if table_name in peripheral_time_stamps
+                    else df
+                )
+                for table_name, df in peripheral.items()
+            }
+            logger.info(
+                f"Transforming {n_rows} new population rows of {name!r} with the "
+                f"peripheral rows since {start}."
+            )
+
+            part_name = _part_name(len(meta["runs"]))
+            report = export_features(
+                pipe,
+                new_rows,
+                name,
+                path=entry_dir / part_name,
+                peripheral=windowed,
+                **export_kwargs,
+            )
+            watermark = new_rows[time_stamp].max()
+            meta["runs"].append(
+                {
+                    "part": part_name,
+                    "created": _now(),
+                    "rows": report.rows,
+                    "since": meta["watermark"],
+                    "watermark": watermark,
+                    "data": {
+                        "population": frame_fingerprint(population),
+                        "peripheral": {
+                            table_name: frame_fingerprint(df)
+                            for table_name, df in sorted(peripheral.items())
+                        },
+                    },
+                }
+            )
+            meta["rows"] += report.rows
+            meta["watermark"] = watermark
+            # the part only counts once it is recorded, a crash before leaves an
+            # unrecorded part that is overwritten by the next run
+            _write_meta(entry_dir, meta)
+
+        if path is not None and meta["runs"]:
+            self.materialize(entry_dir, path)
+        return entry_dir
+
+    def parts(self, entry_dir: Path) -> List[Path]:
+        """
+        Return the part files of an entry in order.
+        """
+        meta = json.loads((entry_dir / _META).read_text())
+        if "runs" in meta:
+            # incremental entries, skip parts of interrupted runs
+            return [entry_dir / run["part"] for run in meta["runs"]]
+        return sorted(entry_dir.glob("part-*.parquet"))
+
+    def materialize(self, entry_dir: Path, path: Union[str, Path]) -> Path:
+        """
+        Write the features of an entry to a single Parquet file, e.g. for the tuning
+        scripts.
+        """
+        path = Path(path)
+        tmp_path = path.with_name(f".tmp-{path.name}-{os.getpid()}")
+        parts = self.parts(entry_dir)
+        if len(parts) == 1:
+            # a copy, not a link, so writes to the file can't corrupt the entry
+            shutil.copyfile(parts[0], tmp_path)
+        else:
+            schema = pq.read_schema(parts[0])
+            with pq.ParquetWriter(tmp_path, schema) as writer:
+                for part in parts:
+                    part_file = pq.ParquetFile(part)
+                    for i in range(part_file.num_row_groups):
+                        writer.write_table(part_file.read_row_group(i).cast(schema))
+        os.replace(tmp_path, path)
+        return path
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """
+        Remove the entries of a feature table, or all entries (including the
+        fitted pipeline records) if `name` is `None`.
+        """
+        shutil.rmtree(
+            self.root if name is None else self.root / "features" / name,
+            ignore_errors=True,
+        )
+
+    def info(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Summarize the cached entries by feature table name.
+        """
+        info = {}
+        if not self.root.exists():
+            return info
+        for meta_path in sorted((self.root / "features").glob(f"*/*/{_META}")):
+            meta = json.loads(meta_path.read_text())
+            info.setdefault(meta["name"], []).append(
+                {
+                    "key": meta["key"],
+                    "pipeline": meta["pipeline"],
+                    "created": meta["created"],
+                    "rows": meta["rows"],
+                    "path": str(meta_path.parent),
+                }
+            )
+        return info
+
+
+FEATURE_STORE = FeatureStore()
@@ -0,0 +1,193 @@
+import logging
+from pathlib import Path
+from typing import Dict, List, Literal, NamedTuple, Optional, Sequence, Union
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+INTEGER_PATTERN = r"^[+-]?\d+$"
+
+EncodingKind = Literal["integer", "categorical"]
+
+
+class Encoding(NamedTuple):
+    """
+    Encoding of a string column as learned on the train split: `integer` columns
+    only hold integers and are cast, `categorical` columns are replaced by the codes
+    of their values in `dictionary`.
+    """
+
+    kind: EncodingKind
+    dictionary: Optional[pa.Array] = None
+
+
+Encodings = Dict[str, Encoding]
+
+
+class Features(NamedTuple):
+    X: pa.Table
+    y: pa.ChunkedArray
+    categorical_cols: List[str]
+    encodings: Encodings
+
+
+def read_features(path: Union[str, Path]) -> pa.Table:
+    """
+    Read a feature file (or a directory of part files) memory-mapped.
+    """
+    return pq.read_table(path, memory_map=True)
+
+
+def _dictionary(column: pa.ChunkedArray) -> pa.Array:
+    if pa.types.is_dictionary(column.type):
+        column = pa.chunked_array(
+            [chunk.dictionary for chunk in column.chunks], column.type.value_type
+        )
+    return pc.drop_null(pc.unique(column))
+
+
+def _codes(column: pa.ChunkedArray, dictionary: pa.Array) -> pa.ChunkedArray:
+    """
+    Map the values of a string column to their index in `dictionary`, values that
+    are not in `dictionary` become null.
+    """
+    if pa.types.is_dictionary(column.type):
+        # translate the (small) chunk dictionaries instead of the values
+        return pa.chunked_array(
+            [
+                pc.take(
+                    pc.index_in(chunk.dictionary, value_set=dictionary), chunk.indices
+                )
+                for chunk in column.chunks
+            ],
+            pa.int32(),
+        )
+    return pc.index_in(column, value_set=dictionary)
+
+
+def _integers(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """
+    Cast a string column to int64, values that aren't integers become null.
+    """
+    if pa.types.is_dictionary(column.type):
+        column = column.cast(column.type.value_type)
+    is_integer = pc.match_substring_regex(column, INTEGER_PATTERN)
+    return pc.if_else(is_integer, column, pa.scalar(None, column.type)).cast(pa.int64())
+
+
+def _is_string(type_: pa.DataType) -> bool:
+    if pa.types.is_dictionary(type_):
+        type_ = type_.value_type
+    return pa.types.is_string(type_) or pa.types.is_large_string(type_)
+
+
+def is_numerical(type_: pa.DataType) -> bool:
+    """
+    Whether a column holds integers or floats, the columns LightGBM consumed before
+    string and boolean columns were encoded.
+    """
+    return pa.types.is_integer(type_) or pa.types.is_floating(type_)
+
+
+def _holds_integers(column: pa.ChunkedArray) -> bool:
+    if column.null_count or pa.types.is_dictionary(column.type):
+        return False
+    return pc.all(pc.match_substring_regex(column, INTEGER_PATTERN)).as_py() is True
+
+
+def _learn_encoding(column: pa.ChunkedArray) -> Encoding:
+    if _holds_integers(column):
+        return Encoding("integer")
+    return Encoding("categorical", _dictionary(column))
+
+
+def encode_categoricals(
+    table: pa.Table, encodings: Optional[Encodings] = None
+) -> Features:
+    """
+    Encode the string columns of a table for LightGBM. Columns holding only integers
+    are cast to int64, all other string columns are replaced by an int32 column
+    `<name>_encoded` of category codes. Pass the encodings of the train split to
+    encode val/test, so that codes mean the same category in all splits; values
+    the train split didn't have (unseen categories, non-integers in integer
+    columns) become null, string columns without an encoding are cast to integers.
+
+    The returned `Features` has no label, see `load_features`.
+    """
+    learn = encodings is None
+    encodings = {} if learn else encodings
+    categorical_cols = []
+    for name in table.column_names:
+        column = table.column(name)
+        if not _is_string(column.type):
+            continue
+        if learn:
+            encodings[name] = _learn_encoding(column)
+        encoding = encodings.get(name)
+        if encoding is None:
+            logger.warning(
+                f"String column {name!r} has no encoding, as it isn't a string "
+                "column in the train split; casting it to integers."
+            )
+            encoding = Encoding("integer")
+        index = table.column_names.index(name)
+        if encoding.kind == "integer":
+            table = table.set_column(index, name, _integers(column))
+        else:
+            table = table.set_column(
+                index, f"{name}_encoded", _codes(column, encoding.dictionary)
+            )
+            categorical_cols.append(f"{name}_encoded")
+    return Features(table, None, categorical_cols, encodings)
+
+
+def select_columns(table: pa.Table, drop_cols: Sequence[str] = ()) -> pa.Table:
+    """
+    Select the numerical columns LightGBM can consume, except `drop_cols`.
+    """
+    return table.select(
+        [
+            name
+            for name in table.column_names
+            if (
+                pa.types.is_integer(table.column(name).type)
+                or pa.types.is_floating(table.column(name).type)
+                or pa.types.is_boolean(table.column(name).type)
+            )
+            and name not in drop_cols
+        ]
+    )
+
+
+def load_features(
+    path: Union[str, Path],
+    label: str,
+    drop_cols: Sequence[str] = (),
+    encodings: Optional[Encodings] = None,
+    numerical_only: bool = False,
+) -> Features:
+    """
+    Load a feature file for LightGBM: read it memory-mapped, drop the label and
+    `drop_cols`, encode string columns (see `encode_categoricals`) and select the
+    feature columns. Numerical columns are passed on without copies. With
+    `numerical_only`, string and boolean columns are dropped as well (see
+    `is_numerical`).
+    """
+    table = read_features(path)
+    dropped = [
+        name
+        for name in table.column_names
+        if name == label
+        or name in drop_cols
+        or (numerical_only and not is_numerical(table.column(name).type))
+    ]
+    encoded = encode_categoricals(table.drop_columns(dropped), encodings)
+    X = select_columns(encoded.X)
+    logger.info(
+        f"Loaded {X.num_rows} rows with {X.num_columns} features "
+        f"({len(encoded.categorical_cols)} categorical) from {str(path)!r}."
+    )
+    return Features(X, table.column(label), encoded.categorical_cols, encoded.encodings)
@@ -0,0 +1,142 @@
+import logging
+import os
+import weakref
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import lightgbm as lgb
+import numpy as np
+import pyarrow as pa
+from sklearn.metrics import mean_absolute_error, roc_auc_score
+
+from relbench_utils.streaming import ParquetSequence
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 65_536
+
+"""
+Metrics by their LightGBM name, so that scores can be taken from the evaluation
+results of the training if the metric was evaluated there.
+"""
+METRICS: Dict[str, Callable[[np.ndarray, np.ndarray], float]] = {
+    "auc": roc_auc_score,
+    "l1": mean_absolute_error,
+}
+
+Split = Tuple[Union[pa.Table, ParquetSequence], Union[pa.ChunkedArray, np.ndarray]]
+
+
+class Scorer:
+    """
+    Scores LightGBM models on fixed splits.
+
+    Predictions are made batch by batch in a thread pool, so memory is bounded by
+    the batches in flight for streamed splits, and memoized per (model, split).
+    Scores of splits that were used as validation sets during training are taken
+    from the model's `best_score` instead of predicting the split again;
+    `valid_names` maps these splits to their name in `lgb.train`.
+    """
+
+    def __init__(
+        self,
+        splits: Mapping[str, Split],
+        valid_names: Mapping[str, str] = {"val": "valid_0"},
+        n_threads: Optional[int] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ):
+        self.splits = dict(splits)
+        self.valid_names = dict(valid_names)
+        self.n_threads = n_threads or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self._predictions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(splits={list(self.splits)}, "
+            f"n_threads={self.n_threads}, batch_size={self.batch_size})"
+        )
+
+    def _iter_batches(
+        self, X: Union[pa.Table, ParquetSequence]
+    ) -> Iterator[Union[pa.Table, np.ndarray]]:
+        if isinstance(X, ParquetSequence):
+            yield from X.iter_batches()
+            return
+        # slices of arrow tables are zero-copy
+        for offset in range(0, X.num_rows, self.batch_size):
+            yield X.slice(offset, self.batch_size)
+
+    def _predict_batches(
+        self, model: lgb.Booster, batches: Iterable[Union[pa.Table, np.ndarray]]
+    ) -> np.ndarray:
+        num_iteration = model.best_iteration or None
+        results = []
+        in_flight: Deque[Future] = deque()
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            for batch in batches:
+                # the threads are used for the batches, not within a prediction
+                in_flight.append(
+                    executor.submit(
+                        model.predict, batch, num_iteration=num_iteration, num_threads=1
+                    )
+                )
+                # bound the number of batches held in memory
+                if len(in_flight) >= 2 * self.n_threads:
+                    results.append(in_flight.popleft().result())
+            results.extend(future.result() for future in in_flight)
+        return np.concatenate(results) if results else np.empty(0)
+
+    def predict(self, model: lgb.Booster, split: str) -> np.ndarray:
+        """
+        Predict a split with the best iteration of a model.
+        """
+        key = (split, model.best_iteration)
+        predictions = self._predictions.setdefault(model, {})
+        if key not in predictions:
+            X, _ = self.splits[split]
+            predictions[key] = self._predict_batches(model, self._iter_batches(X))
+        return predictions[key]
+
+    def validation_score(
+        self, model: lgb.Booster, split: str, metric: str
+    ) -> Optional[float]:
+        """
+        Return the score of a split from the evaluation results of the training,
+        `None` if the split wasn't a validation set or the metric wasn't evaluated.
+        """
+        if split not in self.valid_names:
+            return None
+        return model.best_score.get(self.valid_names[split], {}).get(metric)
+
+    def score(self, model: lgb.Booster, split: str, metric: str) -> float:
+        """
+        Score a model on a split with a metric of `METRICS`.
+        """
+        score = self.validation_score(model, split, metric)
+        if score is not None:
+            return float(score)
+        _, y = self.splits[split]
+        return float(METRICS[metric](np.asarray(y), self.predict(model, split)))
+
+    def scores(
+        self, model: lgb.Booster, metric: str, splits: Optional[Iterable[str]] = None
+    ) -> Dict[str, float]:
+        """
+        Score a model on several splits (all by default).
+        """
+        return {
+            split: self.score(model, split, metric)
+            for split in (self.splits if splits is None else splits)
+        }
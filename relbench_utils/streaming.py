@@ -0,0 +1,187 @@
+import logging
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+import lightgbm as lgb
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from relbench_utils.features import (
+    Encoding,
+    Encodings,
+    _holds_integers,
+    _is_string,
+    encode_categoricals,
+    is_numerical,
+    select_columns,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 65_536
+
+
+def learn_encodings(
+    file: pq.ParquetFile, columns: Sequence[str], batch_size: int = DEFAULT_BATCH_SIZE
+) -> Encodings:
+    """
+    Learn the encodings of the string columns of a Parquet file (see
+    `encode_categoricals`) in one pass over its record batches. Only the string
+    columns are read and only their distinct values are kept in memory.
+    """
+    string_cols = [
+        name for name in columns if _is_string(file.schema_arrow.field(name).type)
+    ]
+    if not string_cols:
+        return {}
+
+    dictionaries = {name: [] for name in string_cols}
+    integers = dict.fromkeys(string_cols, True)
+    for batch in file.iter_batches(batch_size=batch_size, columns=string_cols):
+        for name in string_cols:
+            column = pa.chunked_array([batch.column(name)])
+            integers[name] = integers[name] and _holds_integers(column)
+            if pa.types.is_dictionary(column.type):
+                column = pa.chunked_array(
+                    [chunk.dictionary for chunk in column.chunks],
+                    column.type.value_type,
+                )
+            # keep the dictionaries small by deduplicating after every batch
+            dictionaries[name] = [
+                pc.unique(pa.chunked_array([*dictionaries[name], *column.chunks]))
+            ]
+
+    return {
+        name: (
+            Encoding("integer")
+            if integers[name]
+            else Encoding("categorical", pc.drop_null(dictionaries[name][0]))
+        )
+        for name in string_cols
+    }
+
+
+class ParquetSequence(lgb.Sequence):
+    """
+    A LightGBM sequence streaming the encoded feature rows of a Parquet file.
+
+    Rows are read in record batches of `batch_size` rows, encoded like
+    `load_features` does and converted to float64, so memory is bounded by one
+    batch instead of the whole table. Categoricals are encoded with global
+    dictionaries learned in a first pass over the file (or the `encodings` of the
+    train split for val/test).
+
+    LightGBM reads a sequence twice in order: it samples rows for the bin
+    construction and then pushes consecutive batches, each pass is one scan of the
+    file.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        label: str,
+        drop_cols: Sequence[str] = (),
+        encodings: Optional[Encodings] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        numerical_only: bool = False,
+    ):
+        self.path = Path(path)
+        self.label = label
+        self.batch_size = batch_size
+        self.file = pq.ParquetFile(path, memory_map=True)
+        self.columns = [
+            field.name
+            for field in self.file.schema_arrow
+            if field.name != label
+            and field.name not in drop_cols
+            and (not numerical_only or is_numerical(field.type))
+        ]
+        self.encodings = (
+            learn_encodings(self.file, self.columns, batch_size)
+            if encodings is None
+            else encodings
+        )
+
+        encoded = encode_categoricals(
+            self.file.schema_arrow.empty_table().select(self.columns), self.encodings
+        )
+        self.schema = select_columns(encoded.X).schema
+        self.categorical_cols = encoded.categorical_cols
+
+        self._batches: Optional[Iterator[np.ndarray]] = None
+        self._batch: Tuple[int, np.ndarray] = (0, np.empty((0, len(self.schema))))
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(path={str(self.path)!r}, rows={len(self)}, "
+            f"features={len(self.schema)}, batch_size={self.batch_size})"
+        )
+
+    def __len__(self) -> int:
+        return self.file.metadata.num_rows
+
+    @property
+    def feature_names(self) -> List[str]:
+        return self.schema.names
+
+    def _encode(self, table: pa.Table) -> pa.Table:
+        return select_columns(
+            encode_categoricals(table.select(self.columns), self.encodings).X
+        )
+
+    def _to_numpy(self, table: pa.Table) -> np.ndarray:
+        rows = np.empty((table.num_rows, table.num_columns), dtype=np.float64)
+        for i, column in enumerate(table.columns):
+            # nulls become nan
+            rows[:, i] = column.to_numpy(zero_copy_only=False)
+        return rows
+
+    def iter_batches(self) -> Iterator[np.ndarray]:
+        """
+        Iterate over the encoded feature rows in batches of `batch_size` rows.
+        """
+        for batch in self.file.iter_batches(
+            batch_size=self.batch_size, columns=self.columns
+        ):
+            yield self._to_numpy(self._encode(pa.Table.from_batches([batch])))
+
+    def labels(self) -> np.ndarray:
+        return self.file.read(columns=[self.label]).column(0).to_numpy()
+
+    def _rows(self, start: int, stop: int) -> np.ndarray:
+        """
+        Read the rows `[start, stop)`, continuing the current scan if possible.
+        """
+        parts = []
+        while start < stop:
+            offset, batch = self._batch
+            if start < offset or self._batches is None:
+                # rows before the current batch, restart the scan
+                self._batches = self.iter_batches()
+                self._batch = (0, next(self._batches))
+                continue
+            if start >= offset + len(batch):
+                self._batch = (offset + len(batch), next(self._batches))
+                continue
+            end = min(stop, offset + len(batch))
+            parts.append(batch[start - offset : end - offset])
+            start = end
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else self._batch[1][:0]
+
+    def __getitem__(self, idx: Union[int, slice]) -> np.ndarray:
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                raise ValueError("ParquetSequence only supports contiguous slices")
+            return self._rows(start, stop)
+        if isinstance(idx, (int, np.integer)):
+            if idx < 0:
+                idx += len(self)
+            return self._rows(idx, idx + 1)[0]
+        raise TypeError(
+            f"Sequence index must be integer or slice, got {type(idx).__name__}"
+        )
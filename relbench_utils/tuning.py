@@ -0,0 +1,251 @@
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+from typing import Callable, List, Literal, Optional, Sequence, Union
+
+import lightgbm as lgb
+import optuna
+from optuna.storages.journal import (
+    JournalFileBackend,
+    JournalFileOpenLock,
+    JournalStorage,
+)
+from optuna.trial import TrialState
+
+logger = logging.getLogger(__name__)
+
+PrunerName = Literal["median", "successive_halving", "none"]
+
+Objective = Callable[[optuna.Trial, int], float]
+
+MultiFidelityPrunerName = Literal["successive_halving", "hyperband"]
+
+"""
+Default row fractions of the training data a configuration is evaluated on in a
+multi-fidelity search, each `MULTI_FIDELITY_REDUCTION_FACTOR` times the previous.
+"""
+MULTI_FIDELITY_REDUCTION_FACTOR = 3
+MULTI_FIDELITY_FRACTIONS = (1 / 27, 1 / 9, 1 / 3, 1.0)
+
+
+def create_journal_storage(path: Union[str, Path]) -> JournalStorage:
+    """
+    Create a journal file storage that can be shared by several processes. The open
+    lock also works on network file systems that don't support symlinks.
+    """
+    path = str(path)
+    return JournalStorage(JournalFileBackend(path, lock_obj=JournalFileOpenLock(path)))
+
+
+def create_pruner(
+    name: PrunerName = "median", n_warmup_steps: int = 50
+) -> optuna.pruners.BasePruner:
+    """
+    Create a pruner that stops trials whose intermediate values (the validation
+    metric per boosting round) fall behind the other trials.
+    """
+    if name == "median":
+        return optuna.pruners.MedianPruner(
+            n_startup_trials=5, n_warmup_steps=n_warmup_steps
+        )
+    if name == "successive_halving":
+        return optuna.pruners.SuccessiveHalvingPruner(min_resource=n_warmup_steps)
+    if name == "none":
+        return optuna.pruners.NopPruner()
+    raise ValueError(f"Unknown pruner: {name!r}")
+
+
+def fidelity_steps(fractions: Sequence[float]) -> List[int]:
+    """
+    Map row fractions to the steps intermediate values are reported at, in units of
+    the smallest fraction.
+    """
+    return [round(fraction / fractions[0]) for fraction in fractions]
+
+
+def create_multi_fidelity_pruner(
+    name: MultiFidelityPrunerName = "successive_halving",
+    fractions: Sequence[float] = MULTI_FIDELITY_FRACTIONS,
+    reduction_factor: int = MULTI_FIDELITY_REDUCTION_FACTOR,
+) -> optuna.pruners.BasePruner:
+    """
+    Create a pruner whose rungs are the `fractions` of the training data (see
+    `evaluate_multi_fidelity`): asynchronous successive halving promotes the best
+    `1 / reduction_factor` of the trials of a rung to the next fraction, Hyperband
+    additionally runs brackets starting at larger fractions.
+    """
+    steps = fidelity_steps(fractions)
+    if name == "successive_halving":
+        return optuna.pruners.SuccessiveHalvingPruner(
+            min_resource=steps[0], reduction_factor=reduction_factor
+        )
+    if name == "hyperband":
+        return optuna.pruners.HyperbandPruner(
+            min_resource=steps[0],
+            max_resource=steps[-1],
+            reduction_factor=reduction_factor,
+        )
+    raise ValueError(f"Unknown multi-fidelity pruner: {name!r}")
+
+
+def evaluate_multi_fidelity(
+    trial: optuna.Trial,
+    fractions: Sequence[float],
+    datasets: Sequence[lgb.Dataset],
+    evaluate: Callable[[lgb.Dataset], float],
+) -> float:
+    """
+    Evaluate a configuration on increasing row subsamples of the training data (see
+    `relbench_utils.datasets.create_subsample_datasets`), reporting each value at
+    the step of its fraction, and stop as soon as the pruner doesn't promote the
+    trial. Returns the value on the largest fraction, so only trials that made it
+    to the full data complete.
+    """
+    for step, fraction, dataset in zip(fidelity_steps(fractions), fractions, datasets):
+        value = evaluate(dataset)
+        trial.report(value, step=step)
+        trial.set_user_attr("fraction", fraction)
+        if fraction < fractions[-1] and trial.should_prune():
+            raise optuna.TrialPruned(
+                f"Trial was pruned on {fraction:.4g} of the data with value={value:.6f}."
+            )
+    return value
+
+
+def thread_share(n_workers: int, n_threads: Optional[int] = None) -> int:
+    """
+    Number of threads available to each of `n_workers` worker processes.
+    """
+    n_threads = n_threads or os.cpu_count() or 1
+    return max(1, n_threads // n_workers)
+
+
+class LightGBMPruningCallback:
+    """
+    A LightGBM callback reporting the validation metric of every boosting round as
+    intermediate value of an Optuna trial and stopping the training if the trial is
+    pruned.
+    """
+
+    # run before the early stopping callback (order 30)
+    order = 20
+
+    def __init__(
+        self,
+        trial: optuna.Trial,
+        metric: str,
+        valid_name: str = "valid_0",
+        report_interval: int = 1,
+    ):
+        self.trial = trial
+        self.metric = metric
+        self.valid_name = valid_name
+        self.report_interval = report_interval
+
+    def __call__(self, env: lgb.callback.CallbackEnv) -> None:
+        if (env.iteration + 1) % self.report_interval:
+            return
+        for data_name, eval_name, value, *_ in env.evaluation_result_list:
+            if data_name == self.valid_name and eval_name == self.metric:
+                break
+        else:
+            raise ValueError(
+                f"Metric {self.metric!r} on {self.valid_name!r} is not evaluated"
+            )
+
+        self.trial.report(value, step=env.iteration)
+        if self.trial.should_prune():
+            raise optuna.TrialPruned(
+                f"Trial was pruned at iteration {env.iteration} with "
+                f"{self.metric}={value:.6f}."
+            )
+
+
+def _run_worker(
+    study_name: str,
+    storage_path: str,
+    objective: Objective,
+    n_trials: int,
+    num_threads: int,
+    pruner: optuna.pruners.BasePruner,
+) -> None:
+    study = optuna.load_study(
+        study_name=study_name,
+        storage=create_journal_storage(storage_path),
+        pruner=pruner,
+    )
+    states = (TrialState.COMPLETE, TrialState.PRUNED)
+    # the callback is only checked after a trial, don't start one if already done
+    if len(study.get_trials(deepcopy=False, states=states)) >= n_trials:
+        return
+    study.optimize(
+        lambda trial: objective(trial, num_threads),
+        callbacks=[optuna.study.MaxTrialsCallback(n_trials, states=states)],
+    )
+
+
+def optimize_parallel(
+    objective: Objective,
+    study_name: str,
+    direction: str,
+    n_trials: int,
+    n_workers: int = 1,
+    storage_path: Optional[Union[str, Path]] = None,
+    pruner: Optional[optuna.pruners.BasePruner] = None,
+    n_threads: Optional[int] = None,
+) -> optuna.Study:
+    """
+    Run an Optuna study with `n_workers` worker processes sharing a journal file
+    storage (`<study_name>.journal` by default).
+
+    The objective is called as `objective(trial, num_threads)`, where `num_threads`
+    is the worker's share of the `n_threads` available threads (all cores by
+    default). The study is resumable: completed and pruned trials count towards
+    `n_trials`, so re-running a finished study doesn't run any new trials. Workers
+    finish their running trial when `n_trials` is reached, so up to `n_workers - 1`
+    additional trials may be run.
+
+    Workers are spawned, as forking a process that already ran LightGBM (and with
+    it OpenMP) can deadlock the workers. The objective must therefore be picklable,
+    e.g. a module-level function, and load its data in the worker, e.g. from the
+    binary dataset files of `relbench_utils.datasets.create_binary_dataset`. Scripts
+    calling this function must guard their top-level code with
+    `if __name__ == "__main__":`, as the workers import them again.
+    """
+    storage_path = str(storage_path or f"{study_name}.journal")
+    pruner = pruner or create_pruner()
+
+    optuna.create_study(
+        study_name=study_name,
+        storage=create_journal_storage(storage_path),
+        load_if_exists=True,
+        direction=direction,
+        pruner=pruner,
+    )
+    num_threads = thread_share(n_workers, n_threads)
+    logger.info(
+        f"Starting Optuna study {study_name!r} with {n_workers} worker(s) "
+        f"using {num_threads} thread(s) each..."
+    )
+
+    worker_args = (study_name, storage_path, objective, n_trials, num_threads, pruner)
+    if n_workers == 1:
+        _run_worker(*worker_args)
+    else:
+        context = multiprocessing.get_context("spawn")
+        workers = [
+            context.Process(target=_run_worker, args=worker_args)
+            for _ in range(n_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        failed = [worker.exitcode for worker in workers if worker.exitcode]
+        if failed:
+            raise RuntimeError(f"{len(failed)} tuning worker(s) failed: {failed}")
+
+    return optuna.load_study(
+        study_name=study_name, storage=create_journal_storage(storage_path)
+    )